@@ -171,10 +171,11 @@ class Bookmarks:
             item = trax.Track(key)
             title = item.get_tag_display('title')
             if self.use_covers:
-                image = covers.MANAGER.get_cover(item, set_only=True)
+                image = covers.MANAGER.get_cover_thumbnail(item, (16, 16),
+                    set_only=True)
                 if image:
                     try:
-                        pix = icons.MANAGER.pixbuf_from_data(image, size=(16,16))
+                        pix = icons.MANAGER.pixbuf_from_data(image)
                     except GLib.GError:
                         logger.warn('Could not load cover')
                         pix = None
@@ -24,77 +24,99 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
-import copy
 import os
-import threading
+import shutil
+import tempfile
 
 from xl import (
-    common,
     formatter,
     settings,
-    transcoder,
-    trax
+    transcoder
 )
 
 
 class CDImporter(object):
+    """
+        Imports tracks from a CD
+
+        The disc is read one track at a time into temporary WAV files,
+        which are encoded in parallel while the next tracks are read.
+    """
     def __init__(self, tracks):
         self.tracks = [ t for t in tracks if
                 t.get_loc_for_io().startswith("cdda") ]
         self.duration = float(sum( [ t.get_tag_raw('__length') for t in self.tracks ] ))
-        self.transcoder = transcoder.Transcoder()
         self.formatter = formatter.TrackFormatter(settings.get_option("cd_import/outpath",
 	     "%s/$artist/$album/$tracknumber - $title" % os.getenv("HOME")))
-        self.current = None
-        self.current_len = None
         self.progress = 0.0
 
         self.running = False
 
         self.format = settings.get_option("cd_import/format",
                                 "Ogg Vorbis")
+        if self.format not in transcoder.FORMATS:
+            self.format = "Ogg Vorbis"
         self.quality = settings.get_option("cd_import/quality", -1)
 
-        self.cont = None
+        # Reading several tracks at once would only make the drive seek
+        self.rip_queue = transcoder.TranscodeQueue(workers=1)
+        self.rip_queue.job_done_cb = self._on_track_ripped
+        self.encode_queue = transcoder.TranscodeQueue()
+        self.encode_queue.job_done_cb = self._on_track_encoded
+        self.tempdir = None
 
     def do_import(self):
         self.running = True
-
-        self.cont = threading.Event()
-
-        self.transcoder.set_format(self.format)
-        if self.quality != -1:
-            self.transcoder.set_quality(self.quality)
-        self.transcoder.end_cb = self._end_cb
-
-        for tr in self.tracks:
-            self.cont.clear()
-            self.current = tr
-            self.current_len = tr.get_tag_raw('__length')
-            loc = tr.get_loc_for_io()
-            trackno, device = loc[7:].split("/#")
-            src = "cdparanoiasrc track=%s device=\"%s\""%(trackno, device)
-            self.transcoder.set_raw_input(src)
-            outloc = self.get_output_location(tr)
-            self.transcoder.set_output(outloc)
-            self.transcoder.start_transcode()
-            self.cont.wait()
-            if not self.running:
-                break
-            tr2 = trax.Track("file://"+outloc)
-            for t in tr.list_tags():
-                if not t.startswith("__"):
-                    tr2.set_tag_raw(t, tr.get_tag_raw(t))
-            tr2.write_tags()
-            try:
-                incr = tr.get_tag_raw('__length') / self.duration
-                self.progress += incr
-            except:
-                raise
+        self.tempdir = tempfile.mkdtemp(prefix='exaile-cd-')
+
+        try:
+            for i, tr in enumerate(self.tracks):
+                loc = tr.get_loc_for_io()
+                trackno, device = loc[7:].split("/#")
+                src = "cdparanoiasrc track=%s device=\"%s\""%(trackno, device)
+                job = transcoder.TranscodeJob(
+                    os.path.join(self.tempdir, '%d.wav' % i),
+                    raw_input=src, raw_encoder='wavenc',
+                    length=tr.get_tag_raw('__length'))
+                job.track = tr
+                self.rip_queue.add(job)
+
+            self.rip_queue.wait()
+            self.encode_queue.wait()
+        finally:
+            shutil.rmtree(self.tempdir, ignore_errors=True)
         self.progress = 100.0
 
-    def _end_cb(self):
-        self.cont.set()
+    def _on_track_ripped(self, job):
+        """
+            Queues the encoding of a track that was read from the disc
+        """
+        if job.state != 'done' or not self.running:
+            self._remove_wav(job.output)
+            return
+        tr = job.track
+        tags = {}
+        for t in tr.list_tags():
+            if not t.startswith("__"):
+                tags[t] = tr.get_tag_raw(t)
+        self.encode_queue.add(transcoder.TranscodeJob(
+            self.get_output_location(tr), path=job.output,
+            format=self.format,
+            quality=self.quality if self.quality != -1 else None,
+            tags=tags, length=job.length))
+
+    def _on_track_encoded(self, job):
+        """
+            Removes the WAV file of a track once it is encoded, so that
+            at most a few of them take up space at a time
+        """
+        self._remove_wav(job.path)
+
+    def _remove_wav(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
     def get_output_location(self, track):
         path = self.formatter.format(track)
@@ -103,17 +125,18 @@ class CDImporter(object):
         if not os.path.exists(directorypath):
             os.makedirs(directorypath)
 
-        extension = transcoder.FORMATS[self.transcoder.dest_format]['extension']
+        extension = transcoder.FORMATS[self.format]['extension']
 
         return path + '.' + extension
 
     def stop(self):
         self.running = False
-        self.transcoder.stop()
+        self.rip_queue.cancel()
+        self.encode_queue.cancel()
 
     def get_progress(self):
-        if not self.current or not self.current_len:
+        if self.progress or not self.duration:
             return self.progress
-        incr = self.current_len / self.duration
-        pos = self.transcoder.get_time()/float(self.current_len)
-        return self.progress + pos*incr
+        # reading and encoding each count for half of the import
+        return (self.rip_queue.get_progress() +
+            self.encode_queue.get_progress(self.duration)) / 2
@@ -29,7 +29,7 @@ from gettext import gettext as _
 from xlgui.panel.collection import CollectionPanel
 from xlgui import guiutil
 from xlgui.widgets import dialogs, menu, menuitems
-from daap import DAAPClient, DAAPError
+from daap import DAAPClient, DAAPError, DAAPTrack
 from xl import (
     collection, 
     event, 
@@ -425,7 +425,10 @@ class DaapConnection(object):
         self.all = []
         self.session = None
         self.connected = False
-        self.tracks = None
+        self.tracks = {}        # item id -> DAAPTrack
+        self.items = {}         # item id -> Track
+        self.revision = 0       # server revision self.items is at
+        self.database = None
         self.server = server
         self.port = port
         self.name = name
@@ -462,83 +465,102 @@ class DaapConnection(object):
         except:
             pass
         self.session = None
-        self.tracks = None
+        self.tracks = {}
+        self.items = {}
+        self.revision = 0
         self.database = None
         self.all = []
         self.connected = False
 
     def reload(self):
         """
-            Reload the tracks from the server
-        """
-        self.tracks = None
-        self.database = None
-        self.all = []
-        self.get_database()
+            Brings the tracks up to date with the server. Only the items
+            changed since the last reload are fetched if the server
+            supports it.
 
-        t = time.time()
-        self.convert_list()
-        logger.debug('{0} tracks loaded in {1}s'.format(len(self.all),
-                                                        time.time()-t))
-
-
-    def get_database(self):
-        """
-            Get a DAAP database and its track list.
+            :returns: the tracks that were added and the tracks that
+                were removed
         """
-        if self.session:
+        if not self.session:
+            return [], []
+        if self.database is None:
             self.database = self.session.library()
-            self.get_tracks(1)
 
-    def get_tracks(self, reset = False):
-        """
-            Get the track list from a DAAP database
-        """
-        if reset or self.tracks == None:
-            if self.database is None:
-                self.database = self.session.library()
-            self.tracks = self.database.tracks()
+        self.session.update()
+        revision = self.session.revision
+        if revision == self.revision:
+            return [], []
 
-        return self.tracks
+        t = time.time()
+        listing = self.database.items(revision, self.revision)
+        tracks = {}
+        items = {}
+        # tags of known tracks only need to be announced for deltas
+        with trax.batch_tag_changes():
+            for atom in listing:
+                tr = DAAPTrack(self.database, atom)
+                tracks[tr.id] = tr
+                items[tr.id] = self.convert_track(tr, bool(self.revision))
+        logger.debug('{0} tracks loaded in {1}s'.format(len(items),
+                                                        time.time()-t))
 
-    def convert_list(self):
+        if listing.atoms.get('muty') == 1:
+            # only the changed items were sent
+            deleted = listing.deleted
+            self.tracks.update(tracks)
+        else:
+            deleted = [i for i in self.items if i not in items]
+            self.tracks = tracks
+
+        removed = []
+        for i in deleted:
+            self.tracks.pop(i, None)
+            old = self.items.pop(i, None)
+            if old is not None:
+                removed.append(old)
+        added = [track for i, track in items.iteritems()
+                    if i not in self.items]
+        self.items.update(items)
+        self.revision = revision
+        self.all = self.items.values()
+        return added, removed
+
+    def convert_track(self, tr, notify_changed=False):
         """
-            Converts the DAAP track database into Exaile Tracks.
+            Converts a DAAPTrack into an Exaile Track.
         """
         # Convert DAAPTrack's attributes to Tracks.
         eqiv = {'title':'minm','artist':'asar','album':'asal','tracknumber':'astn',}
 #            'genre':'asgn','enc':'asfm','bitrate':'asbr'}
 
-        for tr in self.tracks:
-            if tr is not None:
-                #http://<server>:<port>/databases/<dbid>/items/<id>.<type>?session-id=<sessionid>
-
-                uri = "http://%s:%s/databases/%s/items/%s.%s?session-id=%s" % \
-                    (self.server, self.port, self.database.id, tr.id,
-                    tr.type, self.session.sessionid)
+        atoms = dict((a.code, a.value) for a in tr.atom.contains)
 
-                # Don't scan tracks because gio is slow!
-                temp = trax.Track(uri, scan=False)
+        #http://<server>:<port>/databases/<dbid>/items/<id>.<type>?session-id=<sessionid>
 
-                for field in eqiv.keys():
-                    try:
-                        tag = u'%s'%tr.atom.getAtom(eqiv[field])
-                        if tag != 'None':
-                            temp.set_tag_raw(field, [tag], notify_changed=False)
+        uri = "http://%s:%s/databases/%s/items/%s.%s?session-id=%s" % \
+            (self.server, self.port, self.database.id, atoms.get('miid'),
+            atoms.get('asfm'), self.session.sessionid)
 
-                    except:
-                        if field is 'tracknumber':
-                            temp.set_tag_raw('tracknumber', [0], notify_changed=False)
+        # Don't scan tracks because gio is slow!
+        temp = trax.Track(uri, scan=False)
 
+        for field, code in eqiv.iteritems():
+            value = atoms.get(code)
+            if value is not None:
+                temp.set_tag_raw(field, [u'%s' % value],
+                                 notify_changed=notify_changed)
+            elif field == 'tracknumber':
+                temp.set_tag_raw('tracknumber', [0],
+                                 notify_changed=notify_changed)
 
-                #TODO: convert year (asyr) here as well, what's the formula?
-                try:
-                    temp.set_tag_raw("__length", tr.atom.getAtom('astm') / 1000,
-                                                         notify_changed=False)
-                except:
-                    temp.set_tag_raw("__length", 0, notify_changed=False)
+        #TODO: convert year (asyr) here as well, what's the formula?
+        length = atoms.get('astm')
+        if length is None:
+            length = 0
+        temp.set_tag_raw("__length", length / 1000,
+                         notify_changed=notify_changed)
 
-                self.all.append(temp)
+        return temp
 
 
     @common.threaded
@@ -546,14 +568,14 @@ class DaapConnection(object):
         """
             Save the track with track_id to filename
         """
-        for t in self.tracks:
-            if t.id == track_id:
-                try:
-                    t.save(filename)
-                except CannotSendRequest:
-                    dialog = Gtk.MessageDialog(APP.window,
-                        Gtk.DialogFlags.MODAL, Gtk.MessageType.INFO, Gtk.ButtonsType.OK,
-                        _("""This server does not support multiple connections.
+        t = self.tracks.get(track_id)
+        if t is not None:
+            try:
+                t.save(filename)
+            except CannotSendRequest:
+                dialog = Gtk.MessageDialog(APP.window,
+                    Gtk.DialogFlags.MODAL, Gtk.MessageType.INFO, Gtk.ButtonsType.OK,
+                    _("""This server does not support multiple connections.
 You must stop playback before downloading songs."""))
 
 
@@ -584,23 +606,19 @@ class DaapLibrary(collection.Library):
         self.scanning = True
         db = self.collection
 
-        # DAAP gives us all the tracks in one dump
-        self.daap_share.reload()
-        if self.daap_share.all:
-            count = len(self.daap_share.all)
-        else:
-            count = 0
+        added, removed = self.daap_share.reload()
+        count = len(self.daap_share.all)
 
-        if count > 0:
-            logger.info('Adding %d tracks from %s. (%f s)' % (count, 
+        if removed:
+            self.collection.remove_tracks(removed)
+        if added:
+            logger.info('Adding %d tracks from %s. (%f s)' % (len(added),
                                     self.daap_share.name, time.time()-t))
-            self.collection.add_tracks(self.daap_share.all)
-
+            self.collection.add_tracks(added)
 
         if notify_interval is not None:
             event.log_event('tracks_scanned', self, count)
 
-        # track removal?
         self.scanning = False
         #return True
 
@@ -9,7 +9,7 @@
 #
 # Stripped clean + a few bug fixes, Erik Hetzner
 
-import struct, sys, httplib
+import struct, sys, httplib, socket, zlib
 import logging
 from daap_data import *
 from cStringIO import StringIO
@@ -258,6 +258,87 @@ class DAAPObject(object):
 do = DAAPObject
 
 
+class DAAPStream(object):
+    """Buffered reader over an HTTP response, gunzipping it on the fly
+    if it is compressed."""
+    chunk = 64 * 1024
+
+    def __init__(self, response, gzip=False):
+        self.response = response
+        if gzip:
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self.decompressor = None
+        self.buffer = ''
+        self.pos = 0
+
+    def read(self, size):
+        """Reads exactly size bytes, raising DAAPError if the response
+        ends before that"""
+        if len(self.buffer) - self.pos < size:
+            parts = [self.buffer[self.pos:]]
+            available = len(parts[0])
+            while available < size:
+                data = self.response.read(self.chunk)
+                if not data:
+                    if self.decompressor is not None:
+                        data = self.decompressor.flush()
+                        self.decompressor = None
+                    if not data:
+                        raise DAAPError('DAAPStream: response ended early')
+                elif self.decompressor is not None:
+                    data = self.decompressor.decompress(data)
+                parts.append(data)
+                available += len(data)
+            self.buffer = ''.join(parts)
+            self.pos = 0
+        data = self.buffer[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+
+class DAAPListingReader(object):
+    """Reads a listing response, like daap.databasesongs, from a
+    DAAPStream. Iterating over it yields the dmap.listingitem atoms of the
+    listing as they arrive, without keeping the whole response around.
+
+    Once the items have been read, atoms maps the codes of the other
+    atoms in the response to their values and deleted holds the ids in
+    a dmap.deletedidlisting, if the response had one."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.atoms = {}
+        self.deleted = []
+
+    def _read_object(self, header, length):
+        object = DAAPObject()
+        object.processData(StringIO(header + self.stream.read(length)))
+        return object
+
+    def __iter__(self):
+        code, length = struct.unpack('!4sI', self.stream.read(8))
+        remaining = length
+        while remaining > 0:
+            header = self.stream.read(8)
+            code, length = struct.unpack('!4sI', header)
+            remaining -= 8 + length
+            if code == 'mlcl':
+                while length > 0:
+                    header = self.stream.read(8)
+                    item_length = struct.unpack('!4sI', header)[1]
+                    length -= 8 + item_length
+                    yield self._read_object(header, item_length)
+            else:
+                object = self._read_object(header, length)
+                if code == 'mudl':
+                    self.deleted = [o.value for o in object.contains]
+                elif object.type == 'c':
+                    self.atoms[code] = object
+                else:
+                    self.atoms[code] = object.value
+
+
 class DAAPClient(object):
     def __init__(self):
         self.socket = None
@@ -312,16 +393,28 @@ class DAAPClient(object):
 #        else:
 #            headers[ 'Client-DAAP-Validation' ] = hash_v3(r, 2, self.request_id)
 
-        # there are servers that don't allow >1 download from a single HTTP
-        # session, or something. Reset the connection each time. Thanks to
-        # Fernando Herrera for this one.
-        self.socket.close()
-        self.socket.connect()
-
-        self.socket.request('GET', r, None, headers)
-
-        response    = self.socket.getresponse()
-        return response;
+        # the connection is kept alive between requests; if the server
+        # closed it in the meantime, reconnect and try again
+        try:
+            self.socket.request('GET', r, None, headers)
+            response = self.socket.getresponse()
+        except (httplib.HTTPException, socket.error):
+            log.debug('DAAPClient: connection lost, reconnecting')
+            self.socket.close()
+            self.socket.request('GET', r, None, headers)
+            response = self.socket.getresponse()
+        return response
+
+    def _check_status(self, r, response):
+        status = response.status
+        if status == 401:
+            raise DAAPError('DAAPClient: %s: auth required'%r)
+        elif status == 403:
+            raise DAAPError('DAAPClient: %s: Authentication failure'%r)
+        elif status == 503:
+            raise DAAPError('DAAPClient: %s: 503 - probably max connections to server'%r)
+        elif status not in (200, 204):
+            raise DAAPError('DAAPClient: %s: Error %s making request'%(r, response.status))
 
     def request(self, r, params = {}, answers = 1):
         """Make a request to the DAAP server, with the passed params. This
@@ -329,34 +422,36 @@ class DAAPClient(object):
 
         # this returns an HTTP response object
         response    = self._get_response(r, params)
-        status = response.status
         content = response.read()
         # if we got gzipped data base, gunzip it.
         if response.getheader("Content-Encoding") == "gzip":
             log.debug("gunzipping data")
             old_len = len(content)
-            compressedstream = StringIO( content )
-            import gzip
-            gunzipper = gzip.GzipFile(fileobj=compressedstream)
-            content = gunzipper.read()
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
             log.debug("expanded from %s bytes to %s bytes", old_len, len(content))
         # close this, we're done with it
         response.close()
 
-        if status == 401:
-            raise DAAPError('DAAPClient: %s: auth required'%r)
-        elif status == 403:
-            raise DAAPError('DAAPClient: %s: Authentication failure'%r)
-        elif status == 503:
-            raise DAAPError('DAAPClient: %s: 503 - probably max connections to server'%r)
-        elif status == 204:
+        self._check_status(r, response)
+        if response.status == 204:
             # no content, ie logout messages
             return None
-        elif status != 200:
-            raise DAAPError('DAAPClient: %s: Error %s making request'%(r, response.status))
 
         return self.readResponse( content )
 
+    def request_listing(self, r, params = {}):
+        """Like request, but returns a DAAPListingReader that parses the
+        response while it is downloaded. The items have to be read before
+        making another request."""
+        response = self._get_response(r, params)
+        if response.status != 200:
+            response.read()
+            response.close()
+            self._check_status(r, response)
+            raise DAAPError('DAAPClient: %s: no listing in response' % r)
+        gzip = response.getheader("Content-Encoding") == "gzip"
+        return DAAPListingReader(DAAPStream(response, gzip))
+
     def readResponse(self, data):
         """Convert binary response from a request to a DAAPObject"""
         str = StringIO(data)
@@ -404,6 +499,10 @@ class DAAPSession(object):
         params['session-id'] = self.sessionid
         return self.connection.request(r, params, answers)
 
+    def request_listing(self, r, params = {}):
+        params['session-id'] = self.sessionid
+        return self.connection.request_listing(r, params)
+
     def update(self):
         response = self.request("/update")
 	self.revision = response.getAtom('musr')
@@ -437,12 +536,19 @@ class DAAPDatabase(object):
 
     def tracks(self):
         """returns all the tracks in this database, as DAAPTrack objects"""
-        response = self.session.request("/databases/%s/items"%self.id, {
-            'meta':daap_atoms
-        })
-        #response.printTree()
-        track_list = response.getAtom("mlcl").contains
-        return [DAAPTrack(self, t) for t in track_list]
+        return [DAAPTrack(self, t) for t in self.items()]
+
+    def items(self, revision=None, delta=None):
+        """returns a DAAPListingReader for the items of this database.
+        If a revision and a delta revision are given, servers supporting
+        it only send the items changed between the two; the reader's
+        'muty' atom is 1 in that case."""
+        params = {'meta': daap_atoms}
+        if revision and delta:
+            params['revision-number'] = revision
+            params['delta'] = delta
+        return self.session.request_listing("/databases/%s/items"%self.id,
+                                            params)
 
     def playlists(self):
         response = self.session.request("/databases/%s/containers"%self.id)
@@ -1,55 +1,207 @@
 
 import logging
+import threading
+from collections import OrderedDict
 from gi.repository import GObject
-from xl import collection, event, settings
+from xl import collection, common, event, settings
 import spydaap.parser.exaile
+from spydaap.daap import do
 
 log = logging.getLogger(__file__)
 
 
 # todo support multiple connections?
 class CollectionWrapper:
-    '''Class to wrap Exaile's collection to make it spydaap compatible'''
+    '''Class to wrap Exaile's collection to make it spydaap compatible.
+
+    Tracks keep their item id while they are in the collection. Changes
+    to the collection are gathered into revisions, so that clients can
+    ask for the items that changed since the revision they have.'''
     class TrackWrapper:
         '''Wrap a single track for spydaap'''
+        parser = spydaap.parser.exaile.ExaileParser()
+
         def __init__(self, id, track):
             self.track = track
             self.id = id
-            self.parser = spydaap.parser.exaile.ExaileParser()
-            self.daap = None
+            self.invalidate()
 
-        def get_dmap_raw(self):
-            if self.daap is None:
+        def invalidate(self):
+            self.fields = None
+            self.listing = {}
+
+        def get_dmap_fields(self):
+            '''Returns a list of (field name, encoded field) pairs'''
+            fields = self.fields
+            if fields is None:
                 do = self.parser.parse(self.track)[0]
                 if do is not None:
-                    self.daap = ''.join([d.encode() for d in do])
+                    fields = [(d.codeName(), d.encode()) for d in do]
                 else:
-                    self.daap = ''
-            return self.daap
+                    fields = []
+                self.fields = fields
+            return fields
+
+        def get_dmap_raw(self):
+            return ''.join([f for n, f in self.get_dmap_fields()])
+
+        def get_listing_item(self, meta):
+            '''Returns the encoded listing item holding the fields
+            named in meta, or all fields if meta is None'''
+            listing = self.listing
+            item = listing.get(meta)
+            if item is None:
+                fields = [f for n, f in self.get_dmap_fields()
+                        if meta is None or n in meta]
+                item = do('dmap.listingitem',
+                          [ do('dmap.itemkind', 2),
+                            do('dmap.containeritemid', self.id),
+                            do('dmap.itemid', self.id)
+                            ] + fields).encode()
+                listing[meta] = item
+            return item
 
         def get_original_filename(self):
             return self.track.get_local_path()
 
+    # how many revisions to remember the changes of
+    max_history = 50
+    # tags that end up in the encoded fields of an item
+    dmap_tags = frozenset(TrackWrapper.parser._string_map.keys() +
+            TrackWrapper.parser._int_map.keys() + ['__length', '__loc'])
+
     def __init__(self, collection):
         self.collection = collection
-        self.map = []
+        self.revision = 1
+        self.lock = threading.RLock()
+        self.items = None       # id -> TrackWrapper, built on first use
+        self.locations = {}     # location -> TrackWrapper
+        self.next_id = 1
+        self.history = []       # (revision, changed ids, deleted ids)
+        self.changed = set()
+        self.deleted = set()
+
+        event.add_callback(self.on_tracks_added, 'tracks_added', collection)
+        event.add_callback(self.on_tracks_removed, 'tracks_removed',
+                collection)
+        event.add_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.add_callback(self.on_tracks_tags_changed, 'tracks_tags_changed')
+
+    def _get_items(self):
+        with self.lock:
+            if self.items is None:
+                self.items = OrderedDict()
+                for t in self.collection:
+                    self._add(t)
+            return self.items
+
+    def _add(self, track):
+        w = self.TrackWrapper(self.next_id, track)
+        self.next_id += 1
+        self.items[w.id] = w
+        self.locations[track.get_loc_for_io()] = w
+        return w
+
+    def on_tracks_added(self, type, collection, locations):
+        with self.lock:
+            if self.items is None:
+                return
+            for loc in locations:
+                track = collection.get_track_by_loc(loc)
+                if track is not None and loc not in self.locations:
+                    self.changed.add(self._add(track).id)
+        self._commit_changes()
+
+    def on_tracks_removed(self, type, collection, locations):
+        with self.lock:
+            if self.items is None:
+                return
+            for loc in locations:
+                w = self.locations.pop(loc, None)
+                if w is not None:
+                    del self.items[w.id]
+                    self.changed.discard(w.id)
+                    self.deleted.add(w.id)
+        self._commit_changes()
+
+    def _on_tags_changed(self, changes):
+        moved = set([track for track, tag in changes if tag == '__loc'])
+        if moved:
+            # the wrappers of moved tracks are still under the old location
+            for loc, w in self.locations.items():
+                if w.track in moved:
+                    del self.locations[loc]
+                    self.locations[w.track.get_loc_for_io()] = w
+        for track, tag in changes:
+            w = self.locations.get(track.get_loc_for_io())
+            if w is not None:
+                w.invalidate()
+                self.changed.add(w.id)
+
+    def on_track_tags_changed(self, type, track, tag):
+        if self.items is None or tag not in self.dmap_tags:
+            return
+        with self.lock:
+            self._on_tags_changed([(track, tag)])
+        self._commit_changes()
+
+    def on_tracks_tags_changed(self, type, cls, changes):
+        if self.items is None:
+            return
+        changes = [(track, tag) for track, tag in changes
+                if tag in self.dmap_tags]
+        if not changes:
+            return
+        with self.lock:
+            self._on_tags_changed(changes)
+        self._commit_changes()
+
+    @common.glib_wait(1000)
+    def _commit_changes(self):
+        '''Makes the changes gathered since the last call a new revision'''
+        with self.lock:
+            if not self.changed and not self.deleted:
+                return
+            self.revision += 1
+            self.history.append((self.revision, self.changed, self.deleted))
+            del self.history[:-self.max_history]
+            self.changed = set()
+            self.deleted = set()
+            revision = self.revision
+        event.log_event('daapserver_library_changed', self, revision)
+
+    def get_changes(self, revision):
+        '''Returns a list of the items changed since revision and a set
+        of the ids deleted since then, or None if that is too long ago'''
+        with self.lock:
+            if revision >= self.revision:
+                return [], set()
+            if not self.history or self.history[0][0] > revision + 1:
+                return None
+            changed = set()
+            deleted = set()
+            for rev, c, d in self.history:
+                if rev > revision:
+                    changed |= c
+                    deleted |= d
+            items = self._get_items()
+            return [items[id] for id in sorted(changed) if id in items], \
+                deleted
 
     def __iter__(self):
-        i = 0
-        self.map = []
-        for t in self.collection:
-            self.map.append(self.TrackWrapper(i, t))
-            yield self.map[i]
-            i += 1
-    
+        with self.lock:
+            return iter(self._get_items().values())
+
     def get_item_by_id(self, id):
-        return self.map[int(id)]
-    
-    def __getitem__(self, idx):
-        return self.map[idx]
+        try:
+            return self._get_items()[int(id)]
+        except KeyError:
+            raise IndexError(id)
+
+    __getitem__ = get_item_by_id
 
     def __len__(self):
-        return len(self.collection)
+        return len(self._get_items())
 
 from server import DaapServer
 
@@ -15,7 +15,7 @@
 #You should have received a copy of the GNU General Public License
 #along with Spydaap. If not, see <http://www.gnu.org/licenses/>.
 
-import BaseHTTPServer, SocketServer, getopt, grp, httplib, logging, os, pwd, select, signal, spydaap, sys, socket
+import BaseHTTPServer, Queue, getopt, grp, httplib, logging, os, pwd, select, signal, spydaap, sys, socket, threading
 import spydaap.daap, spydaap.metadata, spydaap.containers, spydaap.cache, spydaap.server, spydaap.zeroconf
 from spydaap.daap import do
 from threading import Thread
@@ -27,14 +27,85 @@ logger = logging.getLogger('daapserver')
 
 __all__ = ['DaapServer']
 
-class MyThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
-    """Handle requests in a separate thread."""
+class ThreadPoolMixIn:
+    """Handle connections with a bounded pool of threads, which are
+    started as they are needed and then reused."""
+    max_threads = 32
+    # threads waiting for the library to change in /update leave the
+    # pool, so they don't starve the other requests, and are capped
+    # separately
+    max_waiting_threads = 64
+    # clients waiting for /update must not keep exaile from quitting
+    daemon_threads = True
+
+    def init_pool(self):
+        self.requests = Queue.Queue()
+        self.pool_lock = threading.Lock()
+        self.pool_local = threading.local()
+        self.threads = 0
+        self.idle_threads = 0
+        self.waiting_threads = 0
+
+    def leave_pool(self):
+        """Called by a handler that is about to wait for a long time.
+        The pool starts another thread in place of the calling one,
+        which exits once its connection is closed. Returns False if
+        too many threads are waiting already."""
+        with self.pool_lock:
+            if getattr(self.pool_local, 'waiting', False):
+                return True
+            if self.waiting_threads >= self.max_waiting_threads:
+                return False
+            self.pool_local.waiting = True
+            self.waiting_threads += 1
+            self.threads -= 1
+        return True
+
+    def process_request(self, request, client_address):
+        with self.pool_lock:
+            if self.idle_threads <= 0 and self.threads < self.max_threads:
+                self.threads += 1
+                self.idle_threads += 1
+                t = Thread(target=self.process_requests)
+                t.daemon = self.daemon_threads
+                t.start()
+            self.idle_threads -= 1
+        self.requests.put((request, client_address))
+
+    def process_requests(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            (request, client_address) = item
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+            with self.pool_lock:
+                if getattr(self.pool_local, 'waiting', False):
+                    self.waiting_threads -= 1
+                    break
+                self.idle_threads += 1
+
+    def stop_pool(self):
+        with self.pool_lock:
+            for i in range(self.threads):
+                self.requests.put(None)
+            self.threads = 0
+            self.idle_threads = 0
+
+class MyThreadedHTTPServer(ThreadPoolMixIn, BaseHTTPServer.HTTPServer):
+    """Handle requests with a pool of threads."""
     timeout = 1
 
     def __init__(self, *args):
         if ':' in args[0][0]:
             self.address_family = socket.AF_INET6   
         BaseHTTPServer.HTTPServer.__init__(self,*args)
+        self.init_pool()
         self.keep_running = True
 
     def serve_forever(self):
@@ -44,6 +115,7 @@ class MyThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServe
     def force_stop(self):
         self.keep_running = False
         self.server_close()
+        self.stop_pool()
         
 class DaapServer():
     def __init__(self, library, name=spydaap.server_name, host='', port=spydaap.port):
@@ -54,18 +126,24 @@ class DaapServer():
         self.name = name
         self.httpd = None
         self.handler = None
+        self.responses = spydaap.cache.ResponseCache(library.revision)
         
         # Set a callback that will let us propagate library changes to clients
-        event.add_callback( self.update_rev, 'libraries_modified',
-                                                     library.collection) 
+        event.add_callback(self.update_rev, 'daapserver_library_changed',
+                                                     library)
         
-    def update_rev(self, *args):
-        if self.handler is not None:
-            # Updating the server revision, so if a client checks 
-            # it can see the library has changed
-            self.handler.daap_server_revision += 1
-            logger.info('Libraries Changed, incrementing revision to %d.' 
-                                    % self.handler.daap_server_revision )
+    def update_rev(self, type, library, revision):
+        # Updating the server revision, so if a client checks 
+        # it can see the library has changed
+        self.responses.set_revision(revision)
+        logger.info('Library changed, incrementing revision to %d.'
+                                % revision)
+        if self.httpd is not None:
+            self.rebuild_responses()
+
+    @common.threaded
+    def rebuild_responses(self):
+        self.responses.rebuild()
         
     def set(self, **kwargs):
         for key in kwargs:
@@ -77,7 +155,8 @@ class DaapServer():
                                                 self.port,  
                                                 stype="_daap._tcp")
         self.handler = spydaap.server.makeDAAPHandlerClass(
-                                        str(self.name), [], self.library, [])
+                                        str(self.name), self.responses,
+                                        self.library, [])
         self.httpd = MyThreadedHTTPServer((self.host, self.port), 
                                      self.handler)
         
@@ -21,7 +21,7 @@ import config
 logging.basicConfig()
 log = logging.getLogger('spydaap')
 
-cache = spydaap.cache.Cache(spydaap.cache_dir)
+cache = spydaap.cache.ResponseCache()
 md_cache = spydaap.metadata.MetadataCache(os.path.join(spydaap.cache_dir, "media"), spydaap.parsers)
 container_cache = spydaap.containers.ContainerCache(os.path.join(spydaap.cache_dir, "containers"), spydaap.container_list)
 keep_running = True
@@ -13,7 +13,16 @@
 #You should have received a copy of the GNU General Public License
 #along with Spydaap. If not, see <http://www.gnu.org/licenses/>.
 
-import os, playlists
+import errno, os, playlists, select, socket
+
+try:
+    from os import sendfile
+except ImportError:
+    try:
+        # the pysendfile module provides it on python 2
+        from sendfile import sendfile
+    except ImportError:
+        sendfile = None
 
 server_name = "spydaap"
 port = 3689
@@ -53,3 +62,50 @@ class ContentRangeFile(object):
 
     def __iter__(self):
         return self
+
+class FileRange(object):
+    """A byte range of an open file, which send() writes to a socket
+    without copying it through python where sendfile is available."""
+    chunk = 256 * 1024
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.start = start
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def send(self, sock):
+        offset = self.start
+        end = self.start + self.length
+        if sendfile is not None:
+            while offset < end:
+                try:
+                    sent = sendfile(sock.fileno(), self.file.fileno(),
+                                    offset, min(end - offset, self.chunk))
+                except OSError, e:
+                    if e.errno == errno.EAGAIN:
+                        # sockets with a timeout are non-blocking
+                        if not select.select([], [sock], [],
+                                             sock.gettimeout())[1]:
+                            raise socket.timeout()
+                        continue
+                    if e.errno in (errno.EINVAL, errno.ENOSYS) and \
+                            offset == self.start:
+                        # not supported for this file, copy it instead
+                        break
+                    raise
+                if sent == 0: # the file was truncated
+                    return
+                offset += sent
+        self.file.seek(offset)
+        while offset < end:
+            data = self.file.read(min(end - offset, self.chunk))
+            if data == '':
+                return
+            sock.sendall(data)
+            offset += len(data)
+
+    def close(self):
+        self.file.close()
@@ -13,7 +13,7 @@
 #You should have received a copy of the GNU General Public License
 #along with Spydaap. If not, see <http://www.gnu.org/licenses/>.
 
-import md5, os, sys
+import md5, os, sys, threading, time, zlib
 
 class Cache(object):
     def __init__(self, dir):
@@ -105,3 +105,77 @@ class OrderedCacheItem(object):
     
     def get_pid(self):
         return self.pid    
+
+class Response(object):
+    """An encoded response, along with a gzip compressed copy that is
+    made the first time it is asked for."""
+    def __init__(self, data):
+        self.data = data
+        self.gzipped = None
+
+    def get_gzipped(self):
+        if self.gzipped is None:
+            c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.gzipped = c.compress(self.data) + c.flush()
+        return self.gzipped
+
+class ResponseCache(object):
+    """Keeps encoded responses in memory for the current revision of the
+    library.
+
+    When the revision changes all responses are dropped; rebuild() builds
+    the ones that were asked for before again, so that they are ready
+    when clients fetch the new revision."""
+    def __init__(self, revision=1):
+        self.revision = revision
+        self.responses = {}
+        self.builders = {}
+        self.changed = threading.Condition()
+
+    def get(self, key, build, rebuild=True):
+        """Returns the Response for key, calling build() to get its data
+        if it isn't cached yet. Responses with rebuild set are built again
+        by rebuild() after the revision changes."""
+        with self.changed:
+            response = self.responses.get(key)
+            revision = self.revision
+            if rebuild:
+                self.builders[key] = build
+        if response is None:
+            response = Response(build())
+            with self.changed:
+                # don't keep data built while the revision changed
+                if self.revision == revision:
+                    self.responses[key] = response
+        return response
+
+    def set_revision(self, revision):
+        with self.changed:
+            self.revision = revision
+            self.responses = {}
+            self.changed.notify_all()
+
+    def wait_for_revision(self, revision, timeout):
+        """Waits up to timeout seconds for the revision to become newer
+        than revision, returns the current revision."""
+        end = time.time() + timeout
+        with self.changed:
+            while self.revision <= revision:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+            return self.revision
+
+    def rebuild(self, gzip=True):
+        with self.changed:
+            builders = self.builders.items()
+        for key, build in builders:
+            response = self.get(key, build)
+            if gzip:
+                response.get_gzipped()
+
+    def clean(self):
+        with self.changed:
+            self.responses = {}
+            self.builders = {}
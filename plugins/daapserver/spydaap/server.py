@@ -16,13 +16,125 @@
 import BaseHTTPServer, errno, logging, os, re, urlparse, socket, spydaap, sys
 from spydaap.daap import do
 
+# responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = 1024
+
+def parse_meta(query):
+    """Returns the set of fields named by the meta parameter of a
+    request, or None if all fields should be sent."""
+    meta = query.get('meta')
+    if not meta:
+        return None
+    names = frozenset(n for n in meta[0].split(',') if n)
+    if not names or 'all' in names:
+        return None
+    return names
+
+def encode_item(md, meta):
+    if hasattr(md, 'get_listing_item'):
+        return md.get_listing_item(meta)
+    return do('dmap.listingitem',
+              [ do('dmap.itemkind', 2),
+                do('dmap.containeritemid', md.id),
+                do('dmap.itemid', md.id),
+                md.get_dmap_raw()
+                ]).encode()
+
+def build_item_list(md_cache, meta):
+    children = [ encode_item(md, meta) for md in md_cache ]
+    file_count = len(children)
+    d = do('daap.databasesongs',
+           [ do('dmap.status', 200),
+             do('dmap.updatetype', 0),
+             do('dmap.specifiedtotalcount', file_count),
+             do('dmap.returnedcount', file_count),
+             do('dmap.listing',
+                [ ''.join(children) ]) ])
+    return d.encode()
+
+def build_item_delta(md_cache, meta, revision):
+    """Builds an item list holding only the items changed since revision,
+    falling back to the full list if md_cache can't tell what changed."""
+    changes = None
+    if hasattr(md_cache, 'get_changes'):
+        changes = md_cache.get_changes(revision)
+    if changes is None:
+        return build_item_list(md_cache, meta)
+    (changed, deleted) = changes
+    children = [ encode_item(md, meta) for md in changed ]
+    d = do('daap.databasesongs',
+           [ do('dmap.status', 200),
+             do('dmap.updatetype', 1),
+             do('dmap.specifiedtotalcount', len(md_cache)),
+             do('dmap.returnedcount', len(children)),
+             do('dmap.listing',
+                [ ''.join(children) ]),
+             do('dmap.deletedidlisting',
+                [ do('dmap.itemid', id) for id in sorted(deleted) ]) ])
+    return d.encode()
+
+def build_container_list(container_cache):
+    container_do = []
+    for i, c in enumerate(container_cache):
+        d = [ do('dmap.itemid', i + 1 ),
+              do('dmap.itemcount', len(c)),
+              do('dmap.containeritemid', i + 1),
+              do('dmap.itemname', c.get_name()) ]
+        if c.get_name() == 'Library': # this should be better
+            d.append(do('daap.baseplaylist', 1))
+        else:
+            d.append(do('com.apple.itunes.smart-playlist', 1))
+        container_do.append(do('dmap.listingitem', d))
+    d = do('daap.databaseplaylists',
+           [ do('dmap.status', 200),
+             do('dmap.updatetype', 0),
+             do('dmap.specifiedtotalcount', len(container_do)),
+             do('dmap.returnedcount', len(container_do)),
+             do('dmap.listing',
+                container_do)
+             ])
+    return d.encode()
+
+def parse_range(header, size):
+    """Returns the first and last byte positions of the single byte range
+    in a Range header, or None if the range can't be satisfied. Raises
+    ValueError for headers that aren't understood."""
+    m = re.match('^bytes=([0-9]*)-([0-9]*)$', header.strip())
+    if m is None:
+        raise ValueError(header)
+    (first, last) = m.groups()
+    if first == '':
+        if last == '':
+            raise ValueError(header)
+        # the last bytes of the file
+        length = int(last)
+        if length == 0 or size == 0:
+            return None
+        return (max(size - length, 0), size - 1)
+    first = int(first)
+    if last == '':
+        last = size - 1
+    elif int(last) < first:
+        raise ValueError(header)
+    else:
+        last = min(int(last), size - 1)
+    if first > last:
+        return None
+    return (first, last)
+
 def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
+    """cache is a spydaap.cache.ResponseCache holding the encoded item
+    and container lists for the current revision."""
     session_id = 1
     log = logging.getLogger('spydaap.server')
 
     class DAAPHandler(BaseHTTPServer.BaseHTTPRequestHandler):
-        daap_server_revision = 1
         protocol_version = "HTTP/1.1"
+        # close idle keep-alive connections, so they don't hold on to
+        # one of the server's threads
+        timeout = 60
+        # how long an /update request waits for the library to change
+        update_timeout = 1800
 
         def h(self, data, **kwargs):
             self.send_response(kwargs.get('status', 200))
@@ -36,7 +148,9 @@ def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
                 for k, v in kwargs['extra_headers'].iteritems():
                     self.send_header(k, v)
             try:
-                if type(data) == file:
+                if isinstance(data, spydaap.FileRange):
+                    self.send_header("Content-Length", str(len(data)))
+                elif type(data) == file:
                     self.send_header("Content-Length", str(os.stat(data.name).st_size))
                 else:
                     self.send_header("Content-Length", len(data))                   
@@ -47,17 +161,40 @@ def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
                 pass
             else:
                 try:
-                    if (hasattr(data, 'next')):
+                    if isinstance(data, spydaap.FileRange):
+                        self.wfile.flush()
+                        data.send(self.connection)
+                    elif (hasattr(data, 'next')):
                         for d in data:
                             self.wfile.write(d)
                     else:
                         self.wfile.write(data)
-                except socket.error, ex:
-                    if ex.errno in [errno.ECONNRESET]: pass
+                except (socket.error, OSError), ex:
+                    if ex.errno in [errno.ECONNRESET, errno.EPIPE]:
+                        self.close_connection = 1
                     else: raise
             if (hasattr(data, 'close')):
                 data.close()
 
+        def h_cached(self, response):
+            """sends a spydaap.cache.Response, compressed if the client
+            accepts gzip"""
+            accept = self.headers.get('Accept-Encoding', '')
+            if len(response.data) >= GZIP_MIN_SIZE and 'gzip' in accept:
+                self.h(response.get_gzipped(),
+                       extra_headers={'Content-Encoding': 'gzip'})
+            else:
+                self.h(response.data)
+
+        def get_query(self):
+            return urlparse.parse_qs(urlparse.urlparse(self.path).query)
+
+        def get_int_param(self, query, name):
+            try:
+                return int(query[name][0])
+            except (KeyError, ValueError):
+                return 0
+
         #itunes sends request for:
         #GET daap://192.168.1.4:3689/databases/1/items/626.mp3?seesion-id=1
         #so we must hack the urls; annoying.
@@ -165,34 +302,37 @@ def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
             self.h(d.encode())
 
         def do_GET_item_list(self, database_id):
-            def build_item(md):
-                return do('dmap.listingitem', 
-                          [ do('dmap.itemkind', 2),
-                            do('dmap.containeritemid', md.id),
-                            do('dmap.itemid', md.id),
-                            md.get_dmap_raw()
-                            ])
-
-            def build():
-                children = [ build_item (md) for md in md_cache ]
-                file_count = len(children)
-                d = do('daap.databasesongs',
-                       [ do('dmap.status', 200),
-                         do('dmap.updatetype', 0),
-                         do('dmap.specifiedtotalcount', file_count),
-                         do('dmap.returnedcount', file_count),
-                         do('dmap.listing',
-                            children) ])
-                return d.encode()
-
-            data = build()
-#            data = cache.get('item_list', build)
-            self.h(data)
+            query = self.get_query()
+            meta = parse_meta(query)
+            delta = self.get_int_param(query, 'delta')
+            if delta:
+                response = cache.get(('items', meta, delta),
+                        lambda: build_item_delta(md_cache, meta, delta),
+                        rebuild=False)
+            else:
+                response = cache.get(('items', meta),
+                        lambda: build_item_list(md_cache, meta))
+            self.h_cached(response)
 
         def do_GET_update(self):
+            # clients polling with the current revision and a delta wait
+            # until the library changes
+            query = self.get_query()
+            revision = self.get_int_param(query, 'revision-number')
+            current = cache.revision
+            if 'delta' in query and current <= revision:
+                leave_pool = getattr(self.server, 'leave_pool', None)
+                if leave_pool is not None and not leave_pool():
+                    self.send_error(503)
+                    return
+                waited = 0
+                while current <= revision and waited < self.update_timeout \
+                        and getattr(self.server, 'keep_running', True):
+                    current = cache.wait_for_revision(revision, 1)
+                    waited += 1
             mupd = do('dmap.updateresponse',
                       [ do('dmap.status', 200),
-                        do('dmap.serverrevision', self.daap_server_revision),
+                        do('dmap.serverrevision', current),
                         ])
             self.h(mupd.encode())
 
@@ -203,48 +343,47 @@ def makeDAAPHandlerClass(server_name, cache, md_cache, container_cache):
                 self.send_error(404)    # this can be caused by left overs from previous sessions
                 return
 
+            try:
+                f = open(fn, 'rb')
+            except IOError:
+                self.send_error(404)
+                return
+
+            size = os.fstat(f.fileno()).st_size
+            (start, end) = (0, size - 1)
+            extra_headers = {}
+            status = 200
             if (self.headers.has_key('Range')):
-                rs = self.headers['Range']
-                m = re.compile('bytes=([0-9]+)-([0-9]+)?').match(rs)
-                (start, end) = m.groups()
-                if end != None: end = int(end)
-                else: end = os.stat(fn).st_size
-                start = int(start)
-                f = spydaap.ContentRangeFile(fn, open(fn), start, end)
-                extra_headers={"Content-Range": "bytes %s-%s/%s"%(str(start), str(end), str(os.stat(fn).st_size))}
-                status=206
-            else: 
-                f = open(fn)
-                extra_headers={}
-                status=200
+                try:
+                    r = parse_range(self.headers['Range'], size)
+                except ValueError:
+                    r = (start, end) # ignore it and send the whole file
+                else:
+                    if r is None:
+                        f.close()
+                        self.send_response(416)
+                        self.send_header('Content-Range', 'bytes */%d' % size)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    extra_headers = {"Content-Range": "bytes %d-%d/%d"
+                                     % (r[0], r[1], size)}
+                    status = 206
+                (start, end) = r
             # this is ugly, very wrong.
             type = "audio/%s"%(os.path.splitext(fn)[1])
-            self.h(f, type=type, status=status, extra_headers=extra_headers)
+            self.h(spydaap.FileRange(f, start, end - start + 1),
+                   type=type, status=status, extra_headers=extra_headers)
 
         def do_GET_container_list(self, database):
-            container_do = []
-            for i, c in enumerate(container_cache):
-                d = [ do('dmap.itemid', i + 1 ),
-                      do('dmap.itemcount', len(c)),
-                      do('dmap.containeritemid', i + 1),
-                      do('dmap.itemname', c.get_name()) ]
-                if c.get_name() == 'Library': # this should be better
-                    d.append(do('daap.baseplaylist', 1))
-                else:
-                    d.append(do('com.apple.itunes.smart-playlist', 1))
-                container_do.append(do('dmap.listingitem', d))
-            d = do('daap.databaseplaylists',
-                   [ do('dmap.status', 200),
-                     do('dmap.updatetype', 0),
-                     do('dmap.specifiedtotalcount', len(container_do)),
-                     do('dmap.returnedcount', len(container_do)),
-                     do('dmap.listing',
-                        container_do)
-                     ])
-            self.h(d.encode())
+            response = cache.get(('containers',),
+                    lambda: build_container_list(container_cache))
+            self.h_cached(response)
 
         def do_GET_container_item_list(self, database_id, container_id):
             container = container_cache.get_item_by_id(container_id)
-            self.h(container.get_daap_raw())
+            response = cache.get(('containers', container_id),
+                    container.get_daap_raw)
+            self.h_cached(response)
 
     return DAAPHandler
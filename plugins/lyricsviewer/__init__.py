@@ -90,10 +90,13 @@ class LyricsViewer(object):
 
         event.add_ui_callback(self.playback_cb, 'playback_track_start')
         event.add_ui_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.add_ui_callback(self.on_tracks_tags_changed,
+                'tracks_tags_changed')
         event.add_ui_callback(self.end_cb, 'playback_player_end')
         event.add_ui_callback(self.search_method_added_cb,
                 'lyrics_search_method_added')
         event.add_ui_callback(self.on_option_set, 'plugin_lyricsviewer_option_set')
+        lyrics.MANAGER.add_prefetch_user()
         #self.style_handler = self.notebook.connect('style-set', self.set_style)
 
         self.update_lyrics()
@@ -161,11 +164,14 @@ class LyricsViewer(object):
     def remove_callbacks(self):
         event.remove_callback(self.playback_cb, 'playback_track_start')
         event.remove_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.remove_callback(self.on_tracks_tags_changed,
+                'tracks_tags_changed')
         event.remove_callback(self.end_cb, 'playback_player_end')
         event.remove_callback(self.search_method_added_cb,
                 'lyrics_search_method_added')
         event.remove_callback(self.on_option_set,
                 'plugin_lyricsviewer_option_set')
+        lyrics.MANAGER.remove_prefetch_user()
         #self.notebook.disconnect(self.style_handler)
 
     def search_method_added_cb(self, eventtype, lyrics, provider):
@@ -175,6 +181,13 @@ class LyricsViewer(object):
         if player.PLAYER.current == track and tag in ["artist", "title"]:
             self.update_lyrics()
 
+    def on_tracks_tags_changed(self, eventtype, obj, changes):
+        current = player.PLAYER.current
+        for track, tag in changes:
+            if current == track and tag in ["artist", "title"]:
+                self.update_lyrics()
+                return
+
     def playback_cb(self, eventtype, player, data):
         self.update_lyrics()
 
@@ -768,6 +768,8 @@ class PlaylistButtonControl(Gtk.ToggleButton, BaseControl, QueueAdapter):
         self.view.connect('drag-leave', self.on_drag_leave)
         event.add_ui_callback(self.on_track_tags_changed,
             'track_tags_changed')
+        event.add_ui_callback(self.on_tracks_tags_changed,
+            'tracks_tags_changed')
         event.add_ui_callback(self.on_option_set,
             'plugin_minimode_option_set')
         self.on_option_set('plugin_minimode_option_set', settings,
@@ -953,6 +955,19 @@ class PlaylistButtonControl(Gtk.ToggleButton, BaseControl, QueueAdapter):
         if track in playlist and track_position == playlist.current_position:
             self.label.set_text(self.formatter.format(track))
 
+    def on_tracks_tags_changed(self, event, obj, changes):
+        """
+            Updates the button on batched tag changes
+        """
+        playlist = self.view.playlist
+        position = playlist.current_position
+        if not 0 <= position < len(playlist):
+            return
+
+        track = playlist[position]
+        if any(changed is track for changed, tag in changes):
+            self.label.set_text(self.formatter.format(track))
+
     def on_option_set(self, event, settings, option):
         """
             Updates control upon setting change
@@ -22,37 +22,79 @@
 
 from __future__ import division, print_function
 
+import logging
 import os.path
 
-from gi.repository import (
-    Gdk,
-    GLib,
-)
+from gi.repository import Gdk
 
 import xl.event
 from xl.nls import gettext as _
 import xl.player
+import xl.settings
 import xl.xdg
 import xlgui.guiutil
 
 from cache import ExaileMoodbarCache
-from generator import SpectrumMoodbarGenerator
+from generator import (
+    GstMoodbarGenerator,
+    MoodbarGeneratorError,
+    MoodbarGeneratorPool,
+    SpectrumMoodbarGenerator,
+)
 from painter import MoodbarPainter
 from widget import Moodbar
 
 
+logger = logging.getLogger(__name__)
+
+# Generation priorities; lower numbers are generated first
+PRIORITY_CURRENT = 0
+PRIORITY_UPCOMING = 1  # Plus the position in the upcoming tracks
+PRIORITY_COLLECTION = 1000
+
+
+def create_generator(name):
+    """Return the first working generator.
+
+    :param name: 'moodbar' for the moodbar program, 'gstreamer' for in-process
+        analysis, or 'auto' to try both in that order
+    :rtype: MoodbarGenerator
+    :raise MoodbarGeneratorError: if none of them works
+    """
+    classes = {
+        'moodbar': [SpectrumMoodbarGenerator],
+        'gstreamer': [GstMoodbarGenerator],
+    }.get(name, [SpectrumMoodbarGenerator, GstMoodbarGenerator])
+    for cls in classes:
+        generator = cls()
+        try:
+            generator.check()
+        except MoodbarGeneratorError as e:
+            error = e
+            logger.info("Not using %s: %s", cls.__name__, e)
+        else:
+            return generator
+    raise error
+
+
 class MoodbarPlugin:
     def __init__(self):
         self.main_controller = self.preview_controller = None
 
     def enable(self, exaile):
-        self.generator = SpectrumMoodbarGenerator()
-        self.generator.check()
+        self.generator = create_generator(
+            xl.settings.get_option('plugin/moodbar/generator', 'auto'))
 
         self.exaile = exaile
-        self.cache = ExaileMoodbarCache(os.path.join(xl.xdg.get_cache_dir(), 'moods'))
+        cache_size = xl.settings.get_option('plugin/moodbar/cache_size', 64)  # MiB
+        self.cache = ExaileMoodbarCache(os.path.join(xl.xdg.get_cache_dir(), 'moods'),
+            cache_size * 1024 * 1024 if cache_size else None)
         self.painter = MoodbarPainter()
+        self.pool = MoodbarGeneratorPool(self.generator, self.cache,
+            xl.settings.get_option('plugin/moodbar/workers', 2))
 
+        xl.event.add_ui_callback(self.on_playback_track_start, 'playback_track_start',
+            xl.player.PLAYER)
         xl.event.add_ui_callback(self.on_preview_device_enabled, 'preview_device_enabled')
         xl.event.add_ui_callback(self.on_preview_device_disabling, 'preview_device_disabling')
         previewdevice = exaile.plugins.enabled_plugins.get('previewdevice', None)
@@ -61,17 +103,43 @@ class MoodbarPlugin:
 
     def on_gui_loaded(self):
         self.main_controller = MoodbarController(self, xl.player.PLAYER, self.exaile.gui.main.progress_bar)
+        if xl.settings.get_option('plugin/moodbar/pregenerate_collection', False):
+            self.pregenerate_collection()
 
     def disable(self, exaile):
         if not self.main_controller:  # Disabled more than once or before gui_loaded
             return
+        self.pool.stop()
+        xl.event.remove_callback(self.on_playback_track_start, 'playback_track_start',
+            xl.player.PLAYER)
         xl.event.remove_callback(self.on_preview_device_enabled, 'preview_device_enabled')
         xl.event.remove_callback(self.on_preview_device_disabling, 'preview_device_disabling')
         self.main_controller.destroy()
         if self.preview_controller:
             self.preview_controller.destroy()
         self.main_controller = self.preview_controller = None
-        del self.exaile, self.cache, self.generator, self.painter
+        del self.exaile, self.cache, self.generator, self.painter, self.pool
+
+    # Batch generation
+
+    def pregenerate_collection(self):
+        """Generate moodbars for all local tracks in the collection, after
+        those of the playing and upcoming tracks.
+        """
+        for track in self.exaile.collection.get_tracks():
+            uri = track.get_loc_for_io()
+            if uri.startswith('file://') and not self.cache.contains(uri):
+                self.pool.request(uri, PRIORITY_COLLECTION)
+
+    def on_playback_track_start(self, event, player, track):
+        """Generate moodbars for the tracks that will be played next."""
+        count = xl.settings.get_option('plugin/moodbar/pregenerate_upcoming', 5)
+        # The tracks that were upcoming before may not be anymore
+        self.pool.discard(PRIORITY_UPCOMING, PRIORITY_COLLECTION)
+        for i, track in enumerate(get_upcoming_tracks(player.queue, count)):
+            uri = track.get_loc_for_io()
+            if uri.startswith('file://'):
+                self.pool.request(uri, PRIORITY_UPCOMING + i)
 
     # Preview Device events
 
@@ -85,6 +153,27 @@ class MoodbarPlugin:
 plugin_class = MoodbarPlugin
 
 
+def get_upcoming_tracks(queue, count):
+    """
+    :type queue: xl.player.queue.PlayQueue
+    :return: Up to `count` tracks that will probably be played next, in order
+    :rtype: List[xl.trax.Track]
+    """
+    if not count:
+        return []
+    tracks = [queue.get_next()]
+    # Queued tracks come first, then the rest of the current playlist
+    for playlist in (queue, queue.current_playlist):
+        if playlist.shuffle_mode == 'disabled':
+            position = playlist.current_position
+            tracks.extend(playlist[position + 1:position + 1 + count])
+    upcoming = []
+    for track in tracks:
+        if track is not None and track not in upcoming:
+            upcoming.append(track)
+    return upcoming[:count]
+
+
 # TRANSLATORS: Time format for playback progress
 def format_time(seconds, format=_("{minutes}:{seconds:02}")):
     seconds = int(round(seconds))
@@ -114,7 +203,7 @@ class MoodbarController:
         xl.event.remove_callback(self._on_playback_track_end, 'playback_track_start', self.player)
         xl.event.remove_callback(self._on_playback_track_end, 'playback_track_end', self.player)
         if self.timer:
-            GLib.source_remove(self.timer)
+            self.timer()
         assert self.orig_seekbar
         xlgui.guiutil.gtk_widget_replace(self.moodbar, self.orig_seekbar)
         self.moodbar.destroy()
@@ -128,21 +217,25 @@ class MoodbarController:
         data = cache.get(uri) if cache else None
         self.moodbar.set_mood(data)
         self._on_timer()
-        self.timer = GLib.timeout_add_seconds(1, self._on_timer)
+        if self.timer:
+            self.timer()
+        self.timer = self.player.clock.subscribe(self._on_timer, 1000)
         if not data and uri.startswith('file://'):
             def callback(uri, data):
-                if cache:
-                    cache.put(uri, data)
-                self.moodbar.set_mood(data)
-            self.plugin.generator.generate_async(uri, callback)
+                # Still playing the same track?
+                current = self.player.current
+                if self.moodbar and current and current.get_loc_for_io() == uri:
+                    self.moodbar.set_mood(data)
+            self.plugin.pool.request(uri, PRIORITY_CURRENT, callback)
 
-    def _on_timer(self):
+    def _on_timer(self, current_time=None):
         assert self.moodbar
         try:
             total_time = self.player.current.get_tag_raw('__length')
         except AttributeError:  # No current track
-            return False
-        current_time = self.player.get_time()
+            return
+        if current_time is None:
+            current_time = self.player.get_time()
         if total_time:
             format = dict(
                 current=format_time(current_time),
@@ -154,10 +247,10 @@ class MoodbarController:
                 self.moodbar.seek_position = current_time / total_time
         else:
             self.moodbar.set_text(format_time(current_time))
-        return True
 
     def _on_playback_track_end(self, event, player, track):
-        GLib.source_remove(self.timer)
+        if self.timer:
+            self.timer()
         self.timer = None
         self.moodbar.set_mood(None)
         self.moodbar.seek_position = None
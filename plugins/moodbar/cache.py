@@ -17,8 +17,10 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import hashlib
 import os
 import sys
+import threading
 
 
 if sys.platform == 'win32':
@@ -42,29 +44,122 @@ class MoodbarCache:
         """
         raise NotImplementedError
 
+    def contains(self, uri):
+        """
+        :type uri: bytes
+        :rtype: bool
+        """
+        return self.get(uri) is not None
+
 
 class ExaileMoodbarCache(MoodbarCache):
-    def __init__(self, location):
+    """Stores moodbars as files named after a hash of the URI.
+
+    When the files take more than `max_size` bytes, the least recently used
+    ones are removed.
+    """
+
+    def __init__(self, location, max_size=None):
+        """
+        :type location: bytes
+        :param max_size: Maximum total size of the cache in bytes, or None
+        :type max_size: Optional[int]
+        """
         try:
             os.mkdir(location)
         except OSError:
             pass
         self.loc = location
+        self.max_size = max_size
+        self._size = None  # Total size of the files, once it is needed
+        self._lock = threading.Lock()
 
     def get(self, uri):
+        path = self._get_cache_path(uri)
         try:
-            with open(self._get_cache_path(uri), 'rb') as f:
-                return f.read()
+            with open(path, 'rb') as f:
+                data = f.read()
         except IOError:
-            return None
+            data = self._get_legacy(uri, path)
+        if data is not None:
+            # Mark as recently used
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return data
 
     def put(self, uri, data):
         if data is None:
             return
-        with open(self._get_cache_path(uri), 'wb') as f:
-            f.write(data)
+        with self._lock:
+            with open(self._get_cache_path(uri), 'wb') as f:
+                f.write(data)
+            if self._size is not None:
+                self._size += len(data)
+            self._evict()
+
+    def contains(self, uri):
+        return os.path.exists(self._get_cache_path(uri)) or \
+            os.path.exists(self._get_legacy_cache_path(uri))
+
+    def _evict(self):
+        """Remove the least recently used files until the cache is 10% under
+        its maximum size.
+        """
+        if self.max_size is None:
+            return
+        if self._size is not None and self._size <= self.max_size:
+            return
+        entries = []
+        for name in os.listdir(self.loc):
+            path = os.path.join(self.loc, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        self._size = sum(e[1] for e in entries)
+        if self._size <= self.max_size:
+            return
+        entries.sort()
+        target = self.max_size * 9 // 10
+        for mtime, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def _get_legacy(self, uri, path):
+        """Move a file stored under the naming scheme of older versions to its
+        current location.
+
+        :rtype: Optional[bytes]
+        """
+        legacy_path = self._get_legacy_cache_path(uri)
+        try:
+            with open(legacy_path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        try:
+            os.rename(legacy_path, path)
+        except OSError:
+            pass
+        return data
 
     def _get_cache_path(self, uri):
+        """
+        :type uri: bytes
+        :rtype: bytes
+        """
+        assert isinstance(uri, bytes)
+        return os.path.join(self.loc, hashlib.md5(uri).hexdigest().encode('ascii') + b'.mood')
+
+    def _get_legacy_cache_path(self, uri):
         """
         :type uri: bytes
         :rtype: bytes
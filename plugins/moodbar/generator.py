@@ -17,12 +17,23 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import heapq
+import itertools
+import logging
 import os
+import re
 import subprocess
 import threading
 import tempfile
 
-from gi.repository import Gio
+from gi.repository import (
+    Gio,
+    GLib,
+    Gst,
+)
+
+
+logger = logging.getLogger(__name__)
 
 
 class MoodbarGeneratorError(Exception): pass
@@ -95,4 +106,215 @@ class SpectrumMoodbarGenerator(MoodbarGenerator):
         return data
 
 
+class GstMoodbarGenerator(MoodbarGenerator):
+    """Generate moodbars in-process with the GStreamer spectrum element.
+
+    Like the `moodbar` program, the spectrum is split into low, middle, and
+    high frequencies, which become the red, green, and blue channels.
+    """
+
+    # Upper frequencies (Hz) of the red, green, and blue channels
+    CHANNELS = (920, 3150, 15500)
+    BANDS = 128
+    RATE = 44100
+    INTERVAL = 50 * Gst.MSECOND
+    # Maximum time to wait for the decoder to make progress
+    TIMEOUT = 10 * Gst.SECOND
+
+    # The magnitude field is a list, which PyGObject can't convert
+    MAGNITUDE_RE = re.compile(r'magnitude=\(float\)[{<]([^}>]*)[}>]')
+
+    PIPELINE = ('uridecodebin name=decoder ! audioconvert ! audioresample'
+                ' ! audio/x-raw,channels=1,rate=%d'
+                ' ! spectrum bands=%d interval=%d threshold=-90'
+                ' ! fakesink sync=false')
+
+    def check(self):
+        for name in ('uridecodebin', 'spectrum'):
+            if Gst.ElementFactory.find(name) is None:
+                raise MoodbarGeneratorError("GStreamer element %s is not installed" % name)
+
+    def generate(self, uri, callback=None):
+        frames = self._analyze(uri)
+        data = self._make_moodbar(frames) if frames else None
+        if callback:
+            callback(uri, data)
+        return data
+
+    def _get_channel_of_bands(self):
+        """
+        :return: For each spectrum band, the index of its channel, or None
+        :rtype: List[Optional[int]]
+        """
+        band_width = self.RATE / 2 / self.BANDS
+        channels = []
+        for band in xrange(self.BANDS):
+            freq = (band + 0.5) * band_width
+            for channel, upper in enumerate(self.CHANNELS):
+                if freq < upper:
+                    channels.append(channel)
+                    break
+            else:
+                channels.append(None)
+        return channels
+
+    def _analyze(self, uri):
+        """Decode the file, and sum the amplitudes of each channel.
+
+        :rtype: List[List[float]]
+        :raise MoodbarGeneratorError: on decoding errors
+        """
+        pipeline = Gst.parse_launch(self.PIPELINE % (self.RATE, self.BANDS, self.INTERVAL))
+        pipeline.get_by_name('decoder').props.uri = uri
+        bus = pipeline.get_bus()
+        channel_of_band = self._get_channel_of_bands()
+        frames = []
+        pipeline.set_state(Gst.State.PLAYING)
+        try:
+            while True:
+                message = bus.timed_pop_filtered(self.TIMEOUT,
+                    Gst.MessageType.ELEMENT | Gst.MessageType.EOS | Gst.MessageType.ERROR)
+                if message is None:
+                    raise MoodbarGeneratorError("Timed out while decoding %s" % uri)
+                if message.type == Gst.MessageType.EOS:
+                    break
+                if message.type == Gst.MessageType.ERROR:
+                    raise MoodbarGeneratorError(message.parse_error()[0].message)
+                structure = message.get_structure()
+                if structure is None or structure.get_name() != 'spectrum':
+                    continue
+                match = self.MAGNITUDE_RE.search(structure.to_string())
+                if not match:
+                    continue
+                frame = [0.0, 0.0, 0.0]
+                for channel, db in itertools.izip(channel_of_band, match.group(1).split(',')):
+                    if channel is not None:
+                        frame[channel] += 10 ** (float(db) / 20)
+                frames.append(frame)
+        finally:
+            pipeline.set_state(Gst.State.NULL)
+        return frames
+
+    def _make_moodbar(self, frames):
+        """Average the frames into 1000 pixels, and scale each channel to
+        0-255.
+
+        :type frames: List[List[float]]
+        :return: 1000 RGB pixels
+        :rtype: bytes
+        """
+        nframes = len(frames)
+        pixels = []
+        for i in xrange(1000):
+            start = i * nframes // 1000
+            end = max(start + 1, (i + 1) * nframes // 1000)
+            part = frames[start:end]
+            pixels.append([sum(f[c] for f in part) / len(part) for c in xrange(3)])
+        data = bytearray(3000)
+        for c in xrange(3):
+            top = max(p[c] for p in pixels) or 1
+            data[c::3] = bytearray(int(p[c] / top * 255) for p in pixels)
+        return bytes(data)
+
+
+class MoodbarGeneratorPool:
+    """Run a generator on a fixed number of worker threads.
+
+    Requests with lower priority numbers are handled first. Results are
+    stored in the cache, and also passed to the request callbacks on the
+    main thread.
+    """
+
+    def __init__(self, generator, cache, workers=2):
+        """
+        :type generator: MoodbarGenerator
+        :type cache: MoodbarCache
+        :type workers: int
+        """
+        self.generator = generator
+        self.cache = cache
+        self._queue = []  # Heap of (priority, sequence, uri)
+        self._pending = {}  # uri -> [priority, callbacks]
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        for i in xrange(max(1, workers)):
+            t = threading.Thread(name='%s-%d' % (self.__class__.__name__, i), target=self._run)
+            t.daemon = True
+            t.start()
+
+    def request(self, uri, priority, callback=None):
+        """Ask for a moodbar to be generated, unless it is in the cache.
+
+        Requesting a URI again with a lower priority number moves it ahead.
+
+        :type uri: bytes
+        :type priority: int
+        :type callback: Callable[[bytes, Optional[bytes]], None]
+        """
+        with self._condition:
+            entry = self._pending.get(uri)
+            if entry is None:
+                entry = self._pending[uri] = [priority, []]
+            elif priority < entry[0]:
+                entry[0] = priority
+            else:
+                priority = None
+            if callback:
+                entry[1].append(callback)
+            if priority is not None:
+                heapq.heappush(self._queue, (priority, next(self._sequence), uri))
+                self._condition.notify()
+
+    def discard(self, low, high):
+        """Drop pending requests with a priority number from `low` up to, but
+        not including, `high`.
+
+        :type low: int
+        :type high: int
+        """
+        with self._condition:
+            for uri, entry in self._pending.items():
+                if low <= entry[0] < high:
+                    del self._pending[uri]
+
+    def stop(self):
+        """Drop all pending requests and stop the workers after their current
+        job.
+        """
+        with self._condition:
+            self._stopped = True
+            self._queue = []
+            self._pending.clear()
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                priority, _, uri = heapq.heappop(self._queue)
+                entry = self._pending.get(uri)
+                # Skip requests that were discarded or moved ahead
+                if entry is None or entry[0] != priority:
+                    continue
+                del self._pending[uri]
+            data = self.cache.get(uri)
+            if data is None:
+                try:
+                    data = self.generator.generate(uri)
+                except MoodbarGeneratorError as e:
+                    logger.warning("Failed to generate moodbar for %s: %s", uri, e)
+                else:
+                    self.cache.put(uri, data)
+            if entry[1] and not self._stopped:
+                GLib.idle_add(self._notify, uri, data, entry[1])
+
+    def _notify(self, uri, data, callbacks):
+        for callback in callbacks:
+            callback(uri, data)
+
+
 # vi: et sts=4 sw=4 tw=99
@@ -95,10 +95,13 @@ class ExaileNotification(object):
                               }
 
         notif = Notify.Notification.new(summary, body)
-        cover_data = covers.MANAGER.get_cover(track,
-            set_only=True, use_default=True)
-        size = (48, 48) if self.resize else None
-        pixbuf = icons.MANAGER.pixbuf_from_data(cover_data, size)
+        if self.resize:
+            cover_data = covers.MANAGER.get_cover_thumbnail(track, (48, 48),
+                set_only=True, use_default=True)
+        else:
+            cover_data = covers.MANAGER.get_cover(track,
+                set_only=True, use_default=True)
+        pixbuf = icons.MANAGER.pixbuf_from_data(cover_data)
         notif.set_icon_from_pixbuf(pixbuf)
         # Attach to tray, if that's how we roll
         if ATTACH_COVERS_OPTION_ALLOWED:
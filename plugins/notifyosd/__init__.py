@@ -161,6 +161,12 @@ class ExaileNotifyOsd(object):
         if self.notify_change and not tag.startswith('__') and track == player.PLAYER.current:
             self.update_track_notify(type, player.PLAYER, track)
 
+    def on_batch_changed(self, type, obj, changes):
+        for track, tag in changes:
+            if not tag.startswith('__') and track == player.PLAYER.current:
+                self.on_changed(type, track, tag)
+                return
+
     def on_tooltip(self, *e):
         if self.tray_hover:
             track = player.PLAYER.current
@@ -194,6 +200,7 @@ def enable(exaile):
     event.add_ui_callback(EXAILE_NOTIFYOSD.on_resume, 'playback_player_resume', player.PLAYER)
     event.add_ui_callback(EXAILE_NOTIFYOSD.on_quit, 'quit_application')
     event.add_ui_callback(EXAILE_NOTIFYOSD.on_changed, 'track_tags_changed')
+    event.add_ui_callback(EXAILE_NOTIFYOSD.on_batch_changed, 'tracks_tags_changed')
     if hasattr(exaile, 'gui'):
         EXAILE_NOTIFYOSD.exaile_ready()
     else:
@@ -207,6 +214,7 @@ def disable(exaile):
     event.remove_callback(EXAILE_NOTIFYOSD.on_resume, 'playback_player_resume', player.PLAYER)
     event.remove_callback(EXAILE_NOTIFYOSD.on_quit, 'quit_application')
     event.remove_callback(EXAILE_NOTIFYOSD.on_changed, 'track_tags_changed')
+    event.remove_callback(EXAILE_NOTIFYOSD.on_batch_changed, 'tracks_tags_changed')
     if EXAILE_NOTIFYOSD.exaile.gui.tray_icon:
         EXAILE_NOTIFYOSD.exaile.gui.tray_icon.disconnect(EXAILE_NOTIFYOSD.tray_connection)
     if EXAILE_NOTIFYOSD.gui_callback:
@@ -121,6 +121,7 @@ class OSDWindow(Gtk.Window, PlaybackAdapter):
         self.add(self.info_area)
         
         event.add_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.add_callback(self.on_tracks_tags_changed, 'tracks_tags_changed')
         event.add_callback(self.on_option_set, 'plugin_osd_option_set')
 
         # Trigger initial setup trough options
@@ -141,6 +142,7 @@ class OSDWindow(Gtk.Window, PlaybackAdapter):
         """
         event.remove_callback(self.on_option_set, 'plugin_osd_option_set')
         event.remove_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.remove_callback(self.on_tracks_tags_changed, 'tracks_tags_changed')
 
         Gtk.Window.destroy(self)
 
@@ -342,6 +344,12 @@ class OSDWindow(Gtk.Window, PlaybackAdapter):
     def on_track_tags_changed(self, e, track, tag):
         if not tag.startswith('__') and track == player.PLAYER.current:
             self.on_playback_track_start(e, player.PLAYER, track)
+
+    def on_tracks_tags_changed(self, e, obj, changes):
+        for track, tag in changes:
+            if not tag.startswith('__') and track == player.PLAYER.current:
+                self.on_playback_track_start(e, player.PLAYER, track)
+                return
         
     def on_playback_track_start(self, e, player, track):
         """
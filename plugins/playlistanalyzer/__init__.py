@@ -29,11 +29,14 @@ from gi.repository import Gio
 import cgi
 import json
 from os.path import dirname, join
+import re
 
 from contextlib import closing
 
 from xl.nls import gettext as _
 from xl import (
+    common,
+    metadata,
     providers,
     settings
 )
@@ -42,6 +45,7 @@ from xl.metadata.tags import tag_data
 
 from xlgui.widgets import menu
 from analyzer_dialog import AnalyzerDialog
+from columns import CodedColumn, IntColumn, TagTable
 
 
 class PlaylistAnalyzerPlugin(object):
@@ -51,6 +55,10 @@ class PlaylistAnalyzerPlugin(object):
         self.dialog = None
         self._get_track_groups = None
         
+        # location -> (modification time, {tag: value}) of tags that are
+        # only stored on disk
+        self._disk_tags = common.LimitedCache(5000)
+        
         self.d3_loc = join(dirname(__file__), 'ext', 'd3.min.js')
     
     def enable(self, exaile):
@@ -118,41 +126,88 @@ class PlaylistAnalyzerPlugin(object):
     # Functions to generate the analysis 
     #
     
-    def get_tag(self, track, tagname, extra):
+    def get_disk_tags(self, track, tagnames):
+        '''
+            Returns a dictionary of the values of tags that are only
+            stored on disk, reading the file at most once for all of them
+        '''
+        loc = track.get_loc_for_io()
+        modified = track.get_tag_raw('__modified')
+        
+        cached = self._disk_tags.get(loc)
+        if cached is not None and cached[0] == modified:
+            values = cached[1]
+        else:
+            values = {}
         
+        missing = [t for t in tagnames if t not in values]
+        if missing:
+            values = dict(values)
+            try:
+                f = metadata.get_format(loc)
+                read = f.read_tags(missing) if f else {}
+            except Exception:
+                read = {}
+            for t in missing:
+                values[t] = read.get(t)
+            self._disk_tags[loc] = (modified, values)
+        
+        return values
+    
+    def get_column(self, tracks, tagname):
+        '''
+            Returns a column with the values of tagname for tracks
+        '''
         data = tag_data.get(tagname)
         
+        if tagname is None:
+            return CodedColumn([None] * len(tracks))
+        
         if data is not None:
             if data.type == 'int':
-                ret = track.get_tag_raw(tagname, join=True)
-                if ret is not None:
-                    if extra == 0:
-                        return int(ret)
-                    else:
-                        return int(ret) - (int(ret) % extra)
-                return
+                values = []
+                for track in tracks:
+                    ret = track.get_tag_raw(tagname, join=True)
+                    values.append(None if ret is None else int(ret))
+                return IntColumn.from_values(values)
             
             if data.use_disk:
-                return track.get_tag_disk(tagname)
+                return CodedColumn([self.get_disk_tags(track, [tagname])[tagname]
+                                    for track in tracks])
         
         if tagname == '__grouptagger':
-            return list(self.get_track_groups(track))
-        
-        return track.get_tag_raw(tagname, join=True)
-        
+            return CodedColumn([list(self.get_track_groups(track))
+                                for track in tracks])
         
+        return CodedColumn([track.get_tag_raw(tagname, join=True)
+                            for track in tracks])
     
     def generate_data(self, tracks, tagdata):
+        '''
+            Returns a :class:`columns.TagTable` with a column for each
+            (tagname, extra) pair in tagdata. Int values are rounded down
+            to multiples of extra.
+        '''
+        separators = [i for i, track in enumerate(tracks) if track is None]
+        real_tracks = [track for track in tracks if track is not None]
+        
+        tagdata = [td or (None, None) for td in tagdata]
         
-        data = []
+        # read the disk tags of each track in one go
+        disk_tags = [tag for tag, extra in tagdata
+                     if tag in tag_data and tag_data[tag].use_disk]
+        if len(disk_tags) > 1:
+            for track in real_tracks:
+                self.get_disk_tags(track, disk_tags)
         
-        for track in tracks:
-            if track is None:
-                data.append(None)
-            else:
-                data.append([self.get_tag(track, tag, extra) for tag, extra in tagdata])
+        raw = {}
+        columns = []
+        for tag, extra in tagdata:
+            if tag not in raw:
+                raw[tag] = self.get_column(real_tracks, tag)
+            columns.append(raw[tag].bucket(extra))
         
-        return data
+        return TagTable(columns, separators, len(tracks))
     
     def write_to_file(self, tmpl, uri, **kwargs):
         '''
@@ -168,8 +223,19 @@ class PlaylistAnalyzerPlugin(object):
         with open(tmpl, 'rb') as fp:
             contents = fp.read()
         
+        # tables are written out piece by piece instead of being
+        # substituted into the template
+        tables = dict((k, v) for k, v in kwargs.iteritems()
+                      if isinstance(v, TagTable))
+        if tables:
+            parts = re.split(r'(?<!%%)%%\((%s)\)s' % '|'.join(map(re.escape, tables)),
+                             contents)
+        else:
+            parts = [contents]
+        
         try:
-            contents = contents % kwargs
+            for i in xrange(0, len(parts), 2):
+                parts[i] = parts[i] % kwargs
         except:
             raise RuntimeError("Format string error in template (probably has unescaped % in it)")
         
@@ -179,7 +245,12 @@ class PlaylistAnalyzerPlugin(object):
             parent_dir = parent_dir.get_child("d3.min.js")
         
         with closing(outfile.replace('', False)) as fp:
-            fp.write(contents)
+            for i, part in enumerate(parts):
+                if i % 2:
+                    for chunk in tables[part].iter_json():
+                        fp.write(chunk)
+                else:
+                    fp.write(part)
             
         # copy d3 to the destination
         # -> TODO: add checkbox to indicate whether it should write d3 there or not
@@ -355,10 +355,12 @@ class AnalyzerDialog(object):
         
         # generate, write it out
         try:
+            table = self.plugin.generate_data(tracks, tagdata)
             kwargs = {
                 'tagdata': json.dumps(tagdata),
                 'playlist_names': [pl.name for pl in playlists], 
-                'data': json.dumps(self.plugin.generate_data(tracks, tagdata)),
+                'data': table,
+                'counts': json.dumps(table.counts()),
                 'title': self._get_title()
             }
         
@@ -0,0 +1,216 @@
+# Copyright (C) 2014 Dustin Spicuzza
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+'''
+    Columnar storage of the tag values that an analysis is made of.
+    
+    Each tag becomes one column holding its value for every track, so
+    that bucketing and counting work on whole arrays at once. NumPy is
+    used when it is installed, the array module otherwise.
+'''
+
+from array import array
+import json
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _array(typecode, values):
+    if numpy is not None:
+        return numpy.array(values, dtype={'l': numpy.int64,
+                                          'i': numpy.int32}[typecode])
+    return array(typecode, values)
+
+
+class IntColumn(object):
+    '''
+        Integer tag values. valid tells which tracks have a value.
+    '''
+    
+    def __init__(self, values, valid):
+        self.values = values
+        self.valid = valid
+    
+    @classmethod
+    def from_values(cls, values):
+        '''
+            :param values: list of ints, or None for tracks without the tag
+        '''
+        valid = [v is not None for v in values]
+        values = [0 if v is None else v for v in values]
+        if numpy is not None:
+            valid = numpy.array(valid, dtype=bool)
+        else:
+            valid = bytearray(valid)
+        return cls(_array('l', values), valid)
+    
+    def __len__(self):
+        return len(self.values)
+    
+    def __getitem__(self, i):
+        if self.valid[i]:
+            return int(self.values[i])
+    
+    def bucket(self, size):
+        '''
+            Rounds every value down to a multiple of size
+        '''
+        if not size:
+            return self
+        if numpy is not None:
+            values = self.values - self.values % size
+        else:
+            values = array('l', [v - v % size for v in self.values])
+        return IntColumn(values, self.valid)
+    
+    def counts(self):
+        '''
+            Returns a sorted list of [value, count] pairs, the value of
+            tracks without the tag being None
+        '''
+        if numpy is not None:
+            keys, counts = numpy.unique(self.values[self.valid],
+                                        return_counts=True)
+            result = [[int(k), int(c)] for k, c in zip(keys, counts)]
+            missing = len(self.valid) - int(self.valid.sum())
+        else:
+            counts = {}
+            missing = 0
+            for v, ok in zip(self.values, self.valid):
+                if ok:
+                    counts[v] = counts.get(v, 0) + 1
+                else:
+                    missing += 1
+            result = [[k, counts[k]] for k in sorted(counts)]
+        if missing:
+            result.insert(0, [None, missing])
+        return result
+
+
+class CodedColumn(object):
+    '''
+        Any other tag values, stored as codes into a list of the distinct
+        values. Values may be lists, whose items are counted separately.
+    '''
+    
+    def __init__(self, values):
+        index = {None: 0}
+        categories = [None]
+        codes = []
+        for v in values:
+            key = tuple(v) if isinstance(v, list) else v
+            code = index.get(key)
+            if code is None:
+                code = index[key] = len(categories)
+                categories.append(v)
+            codes.append(code)
+        self.codes = _array('i', codes)
+        self.categories = categories
+    
+    def __len__(self):
+        return len(self.codes)
+    
+    def __getitem__(self, i):
+        return self.categories[self.codes[i]]
+    
+    def bucket(self, size):
+        return self
+    
+    def counts(self):
+        '''
+            Returns a sorted list of [value, count] pairs
+        '''
+        if numpy is not None:
+            per_code = numpy.bincount(self.codes,
+                                      minlength=len(self.categories))
+        else:
+            per_code = [0] * len(self.categories)
+            for c in self.codes:
+                per_code[c] += 1
+        
+        counts = {}
+        for value, n in zip(self.categories, per_code):
+            if not n:
+                continue
+            if isinstance(value, list):
+                for v in value:
+                    counts[v] = counts.get(v, 0) + int(n)
+            else:
+                counts[value] = counts.get(value, 0) + int(n)
+        return [[k, counts[k]] for k in sorted(counts)]
+
+
+class TagTable(object):
+    '''
+        The columns of an analysis. Tracks lists of several playlists
+        are separated by None, which is kept as a separator row.
+    '''
+    
+    def __init__(self, columns, separators, length):
+        self.columns = columns
+        self.separators = separators
+        self.length = length
+    
+    def rows(self):
+        '''
+            Yields a list of values for each track, and None for the
+            separators
+        '''
+        separators = set(self.separators)
+        columns = self.columns
+        i = 0
+        for row in xrange(self.length):
+            if row in separators:
+                yield None
+            else:
+                yield [c[i] for c in columns]
+                i += 1
+    
+    def counts(self):
+        '''
+            Returns the value counts of each column
+        '''
+        return [c.counts() for c in self.columns]
+    
+    def iter_json(self, chunk_rows=1000):
+        '''
+            Yields the rows as a JSON list, in pieces
+        '''
+        yield '['
+        chunk = []
+        first = True
+        for row in self.rows():
+            chunk.append(json.dumps(row))
+            if len(chunk) == chunk_rows:
+                yield ('' if first else ',\n') + ',\n'.join(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield ('' if first else ',\n') + ',\n'.join(chunk)
+        yield ']'
@@ -0,0 +1,118 @@
+import unittest
+
+from gi.repository import GLib
+
+from xl import event
+from xl.player.clock import PositionClock
+
+
+class FakePlayer(object):
+    
+    def __init__(self):
+        self.current = 'track'
+        self.state = 'playing'
+        self.position = 0
+        self.queries = 0
+    
+    def get_state(self):
+        return self.state
+    
+    def query_position(self):
+        self.queries += 1
+        return self.position
+
+
+class TestPositionClock(unittest.TestCase):
+    
+    def setUp(self):
+        self.now = 0
+        self.timers = {}
+        self.glib = (GLib.get_monotonic_time, GLib.timeout_add,
+                     GLib.source_remove)
+        GLib.get_monotonic_time = lambda: self.now
+        GLib.timeout_add = self.timeout_add
+        GLib.source_remove = self.timers.pop
+        
+        self.player = FakePlayer()
+        self.clock = PositionClock(self.player, self.player.query_position)
+    
+    def tearDown(self):
+        GLib.get_monotonic_time, GLib.timeout_add, GLib.source_remove = \
+            self.glib
+    
+    def timeout_add(self, interval, func):
+        timer_id = len(self.timers) + 1
+        self.timers[timer_id] = (interval, func)
+        return timer_id
+    
+    def intervals(self):
+        return [interval for interval, func in self.timers.values()]
+    
+    def fire(self, ms):
+        self.now += ms * 1000
+        self.player.position += ms * 10**6
+        for interval, func in self.timers.values():
+            func()
+    
+    def test_interpolation(self):
+        self.player.position = 5 * 10**9
+        self.assertEqual(self.clock.get_position(), 5 * 10**9)
+        self.assertEqual(self.player.queries, 1)
+        
+        # between samples, the position advances with the monotonic clock
+        self.now += 500 * 1000
+        self.assertEqual(self.clock.get_position(), 5.5 * 10**9)
+        self.assertEqual(self.player.queries, 1)
+        
+        # the engine is queried again after the sample interval
+        self.player.position = 6.1 * 10**9
+        self.now += 500 * 1000
+        self.assertEqual(self.clock.get_position(), 6.1 * 10**9)
+        self.assertEqual(self.player.queries, 2)
+        
+        # the position doesn't advance while paused
+        self.player.state = 'paused'
+        event.log_event('playback_toggle_pause', self.player, 'track')
+        self.now += 5000 * 1000
+        self.assertEqual(self.clock.get_position(), 6.1 * 10**9)
+        self.assertEqual(self.player.queries, 3)
+    
+    def test_subscribers(self):
+        fast, slow = [], []
+        unsubscribe_fast = self.clock.subscribe(fast.append, 250)
+        unsubscribe_slow = self.clock.subscribe(slow.append, 1000)
+        
+        # a single timer runs at the shortest interval
+        self.assertEqual(self.intervals(), [250])
+        
+        for i in range(8):
+            self.fire(250)
+        
+        self.assertEqual(fast, [0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0])
+        self.assertEqual(slow, [1.0, 2.0])
+        # the engine was only queried once per second
+        self.assertEqual(self.player.queries, 3)
+        
+        # subscribers are notified of seeks immediately
+        self.player.position = 30 * 10**9
+        event.log_event('playback_seeked', self.player, 30)
+        self.assertEqual((fast[-1], slow[-1]), (30.0, 30.0))
+        
+        unsubscribe_fast()
+        self.assertEqual(self.intervals(), [1000])
+        
+        # the timer only runs during playback
+        self.player.state = 'paused'
+        event.log_event('playback_toggle_pause', self.player, 'track')
+        self.assertEqual(self.intervals(), [])
+        
+        self.player.state = 'playing'
+        event.log_event('playback_toggle_pause', self.player, 'track')
+        self.assertEqual(self.intervals(), [1000])
+        
+        self.player.current = None
+        event.log_event('playback_player_end', self.player, 'track')
+        self.assertEqual(self.intervals(), [])
+        
+        unsubscribe_slow()
+        self.assertEqual(self.intervals(), [])
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from xl import playlist, trax
+
+
+class TestPlaylistPersistence(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'playlist')
+        self.tracks = [trax.Track('file:///tmp/track%d.ogg' % i, scan=False)
+                for i in range(20)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def reload(self):
+        pl = playlist.Playlist('reloaded')
+        pl.load_from_location(self.location)
+        return pl
+
+    def test_roundtrip(self):
+        stream = trax.Track('http://example.com/stream', scan=False)
+        stream.set_tag_raw('title', u'Radio')
+        pl = playlist.Playlist('test', self.tracks[:5] + [stream])
+        pl.current_position = 2
+        pl.save_to_location(self.location)
+
+        loaded = self.reload()
+        self.assertEqual(list(loaded), list(pl))
+        self.assertEqual(loaded.current_position, 2)
+        self.assertEqual(loaded.name, u'test')
+
+    def test_changes_are_appended(self):
+        pl = playlist.Playlist('test', self.tracks[:10])
+        pl.save_to_location(self.location)
+        with open(self.location) as f:
+            saved = f.read()
+
+        pl.append(self.tracks[15])
+        del pl[2:4]
+        pl.save_to_location(self.location)
+        with open(self.location) as f:
+            self.assertTrue(f.read().startswith(saved))
+
+        self.assertEqual(list(self.reload()), list(pl))
+
+    def test_large_changes_rewrite(self):
+        pl = playlist.Playlist('test', self.tracks)
+        pl.save_to_location(self.location)
+        pl[:] = self.tracks[::-1]
+        pl.save_to_location(self.location)
+        with open(self.location) as f:
+            records = f.readlines()
+
+        # header, tracks, attrs
+        self.assertEqual(len(records), 3)
+        self.assertEqual(list(self.reload()), list(pl))
+
+    def test_changed_file_is_rewritten(self):
+        pl = playlist.Playlist('test', self.tracks[:10])
+        pl.save_to_location(self.location)
+        other = playlist.Playlist('other', self.tracks[10:])
+        other.save_to_location(self.location)
+
+        pl.append(self.tracks[15])
+        pl.save_to_location(self.location)
+        with open(self.location) as f:
+            self.assertEqual(len(f.readlines()), 3)
+        self.assertEqual(list(self.reload()), list(pl))
+
+    def test_damaged_record(self):
+        pl = playlist.Playlist('test', self.tracks[:10])
+        pl.save_to_location(self.location)
+        with open(self.location, 'ab') as f:
+            f.write('["del",0,')
+
+        loaded = self.reload()
+        self.assertEqual(list(loaded), list(pl))
+        loaded.append(self.tracks[15])
+        loaded.save_to_location(self.location)
+        self.assertEqual(list(self.reload()), list(loaded))
+
+
+class TestPlaylistShuffle(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = []
+        for i in range(12):
+            track = trax.Track('file:///tmp/shuffle%d.ogg' % i, scan=False)
+            track.set_tag_raw('album', [u'Album %d' % (i // 4)])
+            track.set_tag_raw('tracknumber', [u'%d' % (i % 4 + 1)])
+            self.tracks.append(track)
+
+    def test_track_shuffle_plays_each_track_once(self):
+        pl = playlist.Playlist('test', self.tracks)
+        pl.shuffle_mode = 'track'
+        played = [pl.next() for track in self.tracks]
+        self.assertEqual(sorted(played), sorted(self.tracks))
+
+        # tracks appended during the run are played too
+        extra = trax.Track('file:///tmp/shuffle-extra.ogg', scan=False)
+        pl.append(extra)
+        self.assertEqual(pl.next(), extra)
+        self.assertEqual(pl.next(), None)
+
+    def test_album_shuffle_plays_albums_in_order(self):
+        pl = playlist.Playlist('test', self.tracks)
+        pl.shuffle_mode = 'album'
+        played = [pl.next() for track in self.tracks]
+        for start in range(0, 12, 4):
+            album = played[start:start + 4]
+            first = self.tracks.index(album[0])
+            self.assertEqual(album, self.tracks[first:first + 4])
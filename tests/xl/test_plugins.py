@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from xl import event, main, plugins, settings
+
+PLUGININFO = '''Version='1.0'
+Authors=['Test']
+Name='Deferred'
+Description='Waits for gui_loaded'
+Category='Utility'
+'''
+
+PLUGIN = '''from xl import event
+
+enabled = []
+
+def enable(exaile):
+    if exaile.loading:
+        event.add_callback(_enable, 'gui_loaded')
+    else:
+        _enable(None, exaile, None)
+
+def _enable(eventname, exaile, nothing):
+    enabled.append(exaile)
+
+def disable(exaile):
+    pass
+'''
+
+
+class TestDeferredPlugins(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        plugindir = os.path.join(self.tempdir, 'deferred')
+        os.mkdir(plugindir)
+        with open(os.path.join(plugindir, 'PLUGININFO'), 'w') as f:
+            f.write(PLUGININFO)
+        with open(os.path.join(plugindir, '__init__.py'), 'w') as f:
+            f.write(PLUGIN)
+
+        self.enabled = settings.get_option('plugins/enabled')
+        settings.set_option('plugins/enabled', ['deferred'], save=False)
+
+        self.exaile = main.Exaile.__new__(main.Exaile)
+        self.exaile.loading = True
+        self.exaile.plugins = plugins.PluginsManager(self.exaile, load=False)
+        self.exaile.plugins.plugindirs = [self.tempdir]
+        self.exaile.plugins.manifest_location = os.path.join(self.tempdir,
+                'plugins.manifest')
+
+    def tearDown(self):
+        settings.set_option('plugins/enabled', self.enabled, save=False)
+        shutil.rmtree(self.tempdir)
+
+    def test_enabled_after_gui_loaded(self):
+        manager = self.exaile.plugins
+        manager.load_enabled(deferred=False)
+        self.assertEqual(manager.deferred_plugins, ['deferred'])
+
+        event.log_event('gui_loaded', self.exaile, None)
+        self.exaile._Exaile__init_deferred_plugins()
+
+        plugin = manager.enabled_plugins['deferred']
+        self.assertEqual(plugin.enabled, [self.exaile])
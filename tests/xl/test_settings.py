@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from xl import settings
+
+
+class TestSettingsManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'settings.ini')
+        self.settings = settings.SettingsManager(self.location)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_cached_values_follow_changes(self):
+        self.assertEqual(self.settings.get_option('test/value', 1), 1)
+        self.settings.set_option('test/value', 2, save=False)
+        self.assertEqual(self.settings.get_option('test/value', 1), 2)
+        self.settings.remove_option('test/value')
+        self.assertEqual(self.settings.get_option('test/value', 3), 3)
+
+    def test_cached_lists_are_copies(self):
+        self.settings.set_option('test/list', [1, 2], save=False)
+        self.settings.get_option('test/list').append(3)
+        self.assertEqual(self.settings.get_option('test/list'), [1, 2])
+
+    def test_save_only_when_dirty(self):
+        self.settings.set_option('test/value', 2, save=False)
+        self.settings.save()
+        os.utime(self.location, (1000, 1000))
+
+        self.settings.save()
+        self.assertEqual(os.path.getmtime(self.location), 1000)
+        self.assertFalse(os.path.exists(self.location + '.new'))
+
+        loaded = settings.SettingsManager(self.location)
+        self.assertEqual(loaded.get_option('test/value'), 2)
+
+    def test_option_handle(self):
+        handle = settings.OptionHandle('test/handle_value', 5)
+        self.assertEqual(handle.value, 5)
+        settings.set_option('test/handle_value', 6, save=False)
+        self.assertEqual(handle.value, 6)
+        handle.unsubscribe()
+        settings.MANAGER.remove_option('test/handle_value')
@@ -0,0 +1,37 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from xl import startup_profile
+
+
+class TestStartupProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'profile.json')
+        self.profiler = startup_profile.StartupProfiler()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_disabled(self):
+        with self.profiler.phase('nothing'):
+            pass
+        self.assertEqual(self.profiler.phases, [])
+
+    def test_timeline(self):
+        self.profiler.start(self.location)
+        with self.profiler.phase('outer'):
+            with self.profiler.phase('inner'):
+                pass
+        self.profiler.finish()
+
+        with open(self.location) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual([e['name'] for e in events],
+                ['inner', 'outer', 'startup'])
+        self.assertTrue(events[1]['dur'] >= events[0]['dur'])
+        self.assertTrue('cpu_ms' in events[0]['args'])
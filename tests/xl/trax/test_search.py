@@ -350,6 +350,26 @@ class TestTracksMatcher(unittest.TestCase):
         self.str.track.set_tag_raw('artist', 'bar')
         self.assertFalse(matcher.match(self.str))
 
+    def test_compiled_query_reused(self):
+        first = search.TracksMatcher("artist=foo album==bar")
+        second = search.TracksMatcher("artist=foo album==bar")
+        self.assertEqual(first.matchers, second.matchers)
+        first.append_matcher(search.TracksInList([]))
+        self.assertEqual(len(second.matchers), 2)
+        third = search.TracksMatcher("artist=foo album==bar",
+                case_sensitive=False)
+        self.assertNotEqual(first.matchers[:2], third.matchers)
+
+    def test_cheap_conditions_first(self):
+        matcher = search.TracksMatcher(
+                'title~a.*b foo artist=bar __playcount==3 album==baz',
+                keyword_tags=['artist'])
+        types = [type(ma) for ma in matcher.matchers]
+        self.assertEqual(types, [search._ExactMatcher, search._ExactMatcher,
+            search._InMatcher, search._ManyMultiMetaMatcher,
+            search._RegexMatcher])
+        self.assertEqual(matcher.matchers[0].tag, '__playcount')
+
 class TestSearchTracks(unittest.TestCase):
 
     def test_search_tracks(self):
@@ -383,3 +403,73 @@ class TestSearchTracks(unittest.TestCase):
         self.assertEqual(gen.next().track, tracks[0])
         self.assertEqual(gen.next().track, tracks[2])
         self.assertRaises(StopIteration, gen.next)
+
+class TestTagIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tracks = [track.Track(x) for x in ('foo', 'bar', 'baz', 'quux')]
+        self.tracks[0].set_tag_raw('artist', u'Foooo')
+        self.tracks[1].set_tag_raw('artist', [u'bar', u'foo'])
+        self.tracks[2].set_tag_raw('artist', u'foooooo')
+        self.tracks[0].set_tag_raw('tracknumber', u'3/10')
+        self.tracks[1].set_tag_raw('tracknumber', u'7/10')
+        self.index = search.TagIndex(self.tracks)
+
+    def tearDown(self):
+        clear_all_tracks()
+
+    def search(self, query, **kwargs):
+        matcher = search.TracksMatcher(query, **kwargs)
+        return [x.track for x in
+                search.search_tracks(self.tracks, [matcher], index=self.index)]
+
+    def test_exact_case_sensitive(self):
+        self.assertEqual(self.search('artist==foo'), [self.tracks[1]])
+
+    def test_exact_case_insensitive(self):
+        self.assertEqual(self.search('artist==FOO', case_sensitive=False),
+                [self.tracks[1]])
+
+    def test_null(self):
+        self.assertEqual(self.search('artist==__null__'), [self.tracks[3]])
+
+    def test_keyword_on_tags(self):
+        matcher = search.TracksMatcher('foo', keyword_tags=['artist', 'album'])
+        srtrs = list(search.search_tracks(self.tracks, [matcher],
+            index=self.index))
+        self.assertEqual([x.track for x in srtrs],
+                [self.tracks[1], self.tracks[2]])
+        self.assertEqual(srtrs[0].on_tags, ['artist'])
+
+    def test_numeric(self):
+        self.assertEqual(self.search('tracknumber<5'),
+                [self.tracks[0], self.tracks[2], self.tracks[3]])
+        self.assertEqual(self.search('tracknumber>5'), [self.tracks[1]])
+
+    def test_not(self):
+        self.assertEqual(self.search('! artist=foo'),
+                [self.tracks[0], self.tracks[3]])
+
+    def test_regex_falls_back(self):
+        self.assertEqual(self.search('artist~^F'), [self.tracks[0]])
+
+    def test_update(self):
+        self.search('artist==foo')
+        self.tracks[3].set_tag_raw('artist', u'foo', notify_changed=False)
+        self.index.update(self.tracks[3], 'artist')
+        self.assertEqual(self.search('artist==foo'),
+                [self.tracks[1], self.tracks[3]])
+        self.assertEqual(self.search('albumartist==foo'),
+                [self.tracks[1], self.tracks[3]])
+
+    def test_remove(self):
+        self.index.remove([self.tracks[1]])
+        del self.tracks[1]
+        self.assertEqual(self.search('artist=foo'), [self.tracks[1]])
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('artist', u'FOOOO'),
+                set([self.tracks[0]]))
+        self.assertEqual(self.index.lookup('artist', u'foo'),
+                set([self.tracks[1]]))
+        self.assertEqual(self.index.lookup('artist', u'nobody'), set())
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from xl.trax import storage, trackdb
+
+
+class TestSqliteStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'music.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def reopen(self):
+        return storage.SqliteStorage(self.location)
+
+    def test_new_file_is_sqlite(self):
+        self.reopen().close()
+        self.assertTrue(storage.is_sqlite_file(self.location))
+
+    def test_attrs_roundtrip(self):
+        db = self.reopen()
+        db.write({'name': u'Collection', '_dbversion': 3.0}, [], [])
+        db.close()
+        db = self.reopen()
+        self.assertEqual(db.get_attr('name'), u'Collection')
+        self.assertEqual(db.get_attr('_dbversion'), 3.0)
+        self.assertEqual(db.get_attr('missing', 42), 42)
+        db.close()
+
+    def test_tracks_replace_and_delete(self):
+        db = self.reopen()
+        db.write({}, [({'__loc': 'file:///a'}, 0, {}),
+                      ({'__loc': 'file:///b'}, 1, {})], [])
+        db.write({}, [({'__loc': 'file:///a', 'title': [u'A']}, 0, {})], [1])
+        db.close()
+        db = self.reopen()
+        records = list(db.iter_tracks())
+        db.close()
+        self.assertEqual(records,
+                [({'__loc': 'file:///a', 'title': [u'A']}, 0, {})])
+
+
+class TestShelveMigration(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'music.db')
+        shelf = storage.open_shelf(self.location)
+        shelf['_dbversion'] = 2.0
+        shelf['name'] = u'Old'
+        shelf['tracks-0'] = ({'__loc': 'file:///migrated.ogg'}, 0, {})
+        shelf.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_migrate(self):
+        if not os.path.exists(self.location):
+            self.skipTest("shelve isn't backed by bsddb")
+        db = trackdb.TrackDB('test')
+        db.load_from_location(self.location)
+        self.assertTrue(storage.is_sqlite_file(self.location))
+        self.assertFalse(os.path.exists(self.location + '.migrate'))
+        self.assertEqual(db.name, u'Old')
+        self.assertEqual(db.tracks.keys(), ['file:///migrated.ogg'])
+
+
+def test_is_sqlite_file_missing():
+    assert not storage.is_sqlite_file('/nonexistent/music.db')
@@ -19,6 +19,7 @@ except ImportError:
 
 import xl.trax.track as track
 import xl.settings as settings
+from xl import event
 
 from tests.xl.trax import test_data
 
@@ -433,6 +434,79 @@ class TestTrack(unittest.TestCase):
         tr.set_tag_raw('coverart', u'foobar')
         self.assertEqual(tr.get_tag_sort('coverart'), ret)
 
+    def test_get_sort_tag_cache_tag_changed(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'foo')
+        self.assertEqual(tr.get_tag_sort('artist'), u'foo foo foo foo')
+        tr.set_tag_raw('artist', u'bar')
+        self.assertEqual(tr.get_tag_sort('artist'), u'bar bar bar bar')
+
+    def test_get_sort_tag_cache_cuts_changed(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'the foo')
+        self.assertEqual(tr.get_tag_sort('artist'),
+                u'foo the foo the foo the foo')
+        settings.set_option('collection/strip_list', [])
+        track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+        self.assertEqual(tr.get_tag_sort('artist'),
+                u'the foo the foo the foo the foo')
+
+    def test_get_sort_keys(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'foo')
+        tr.set_tag_raw('tracknumber', u'3/10')
+        self.assertEqual(tr.get_sort_keys(['artist', 'tracknumber']),
+                [tr.get_tag_sort('artist'), tr.get_tag_sort('tracknumber')])
+
+    ## Batched tag changes
+    def test_batch_tag_changes(self):
+        tr = track.Track('/foo')
+        events = []
+        def on_changed(type, obj, data):
+            events.append((type, obj, data))
+        event.add_callback(on_changed, 'track_tags_changed')
+        event.add_callback(on_changed, 'tracks_tags_changed')
+        try:
+            with track.batch_tag_changes():
+                with track.batch_tag_changes():
+                    tr.set_tag_raw('artist', u'foo')
+                tr.set_tag_raw('album', u'bar')
+                tr.set_tag_raw('artist', u'baz')
+                self.assertEqual(events, [])
+        finally:
+            event.remove_callback(on_changed, 'track_tags_changed')
+            event.remove_callback(on_changed, 'tracks_tags_changed')
+        self.assertEqual(events, [('tracks_tags_changed', track.Track,
+            set([(tr, 'artist'), (tr, 'album')]))])
+
+    def test_batch_tag_changes_empty(self):
+        events = []
+        def on_changed(type, obj, data):
+            events.append(data)
+        event.add_callback(on_changed, 'tracks_tags_changed')
+        try:
+            with track.batch_tag_changes():
+                pass
+        finally:
+            event.remove_callback(on_changed, 'tracks_tags_changed')
+        self.assertEqual(events, [])
+
+    def test_deferred_read_is_silent(self):
+        uri = Gio.File.new_for_path(
+            test_data.get_file_with_ext('.ogg')).get_uri()
+        tr, = track.Track.from_uris([uri], defer_scan=True)
+        events = []
+        def on_changed(type, obj, data):
+            events.append(data)
+        event.add_callback(on_changed, 'track_tags_changed')
+        event.add_callback(on_changed, 'tracks_tags_changed')
+        try:
+            tr.get_tag_raw('artist')
+        finally:
+            event.remove_callback(on_changed, 'track_tags_changed')
+            event.remove_callback(on_changed, 'tracks_tags_changed')
+        self.assertEqual(events, [])
+
     ## Display Tags
     def test_get_display_tag_loc(self):
         tr = track.Track('/foo')
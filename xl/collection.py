@@ -42,6 +42,7 @@ from gi.repository import Gio
 import logging
 import os
 import os.path
+import Queue
 import shutil
 import threading
 import time
@@ -363,6 +364,9 @@ class LibraryMonitor(GObject.GObject):
     """
         Monitors library locations for changes
     """
+    #: Time in ms during which changes are collected into one batch
+    batch_interval = 500
+
     __gproperties__ = {
         'monitored': (
             GObject.TYPE_BOOLEAN,
@@ -395,9 +399,16 @@ class LibraryMonitor(GObject.GObject):
         self.__library = library
         self.__root = Gio.File.new_for_uri(library.location)
         self.__monitored = False
+        # uri -> (Gio.File, Gio.FileMonitor) of each monitored directory
         self.__monitors = {}
-        self.__queue = {}
         self.__lock = threading.RLock()
+        # uri -> (Gio.File, 'changed' or 'deleted') of the next batch
+        self.__queue = {}
+        self.__flush_id = None
+        # only one batch is processed at a time
+        self.__batch_lock = threading.Lock()
+        self.__dir_index = None
+        self.__dir_index_collection = None
 
     def do_get_property(self, property):
         """
@@ -430,88 +441,210 @@ class LibraryMonitor(GObject.GObject):
                 logger.debug('Setting up library monitors')
 
                 for directory in common.walk_directories(self.__root):
-                    monitor = directory.monitor_directory(Gio.FileMonitorFlags.NONE, None)
-                    monitor.connect('changed', self.on_location_changed)
-                    self.__monitors[directory] = monitor
-
-                    self.emit('location-added', directory)
+                    self.__add_monitors(directory)
             else:
                 logger.debug('Removing library monitors')
 
-                for directory, monitor in self.__monitors.iteritems():
+                for directory, monitor in self.__monitors.itervalues():
                     monitor.cancel()
 
                     self.emit('location-removed', directory)
 
                 self.__monitors = {}
                 
-    def __process_change_queue(self, gfile):
-        if gfile in self.__queue:
-            added_tracks = trax.util.get_tracks_from_uri(gfile.get_uri())
-            for tr in added_tracks:
-                tr.read_tags()
-            self.__library.collection.add_tracks(added_tracks)
-            del self.__queue[gfile]
+    def __add_monitors(self, directory):
+        """
+            Starts monitoring a directory, if it is not monitored yet
+        """
+        uri = directory.get_uri()
+        with self.__lock:
+            if uri in self.__monitors:
+                return False
+            monitor = directory.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+            monitor.connect('changed', self.on_location_changed)
+            self.__monitors[uri] = (directory, monitor)
+
+        self.emit('location-added', directory)
+        return True
+
+    def __get_directory_index(self, collection):
+        """
+            Returns the index of the directories of the collection's
+            tracks, building it on first use
+        """
+        if self.__dir_index_collection is not collection:
+            # this runs on a worker thread while rescans may change the
+            # collection, so follow its changes before taking a snapshot
+            index = self.__dir_index = _DirectoryIndex()
+            self.__dir_index_collection = collection
+            event.add_callback(self.on_tracks_added, 'tracks_added',
+                collection)
+            event.add_callback(self.on_tracks_removed, 'tracks_removed',
+                collection)
+            index.add(collection.get_locations())
+        return self.__dir_index
+
+    def on_tracks_added(self, type, collection, locations):
+        """
+            Keeps the directory index up to date
+        """
+        if collection is self.__dir_index_collection:
+            self.__dir_index.add(locations)
+
+    def on_tracks_removed(self, type, collection, locations):
+        """
+            Keeps the directory index up to date
+        """
+        if collection is self.__dir_index_collection:
+            self.__dir_index.remove(locations)
 
     def on_location_changed(self, monitor, gfile, other_gfile, event):
         """
-            Updates the library on changes of the location
+            Queues changes of the location, to be applied to the
+            library in batches
         """
-        
-        if event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
-            self.__process_change_queue(gfile)
+        if event == Gio.FileMonitorEvent.DELETED:
+            change = 'deleted'
         elif event == Gio.FileMonitorEvent.CREATED or \
-             event == Gio.FileMonitorEvent.CHANGED:
-            
-            # Enqueue tracks retrieval
-            if gfile not in self.__queue:
-                self.__queue[gfile] = True
-            
-                # File monitor only emits the DONE_HINT when using inotify,
-                # and only on single files. Give it some time, but don't 
-                # lose the change notification
-                GLib.timeout_add(500, self.__process_change_queue, gfile)
-            
-            # Set up new monitor if directory
-            fileinfo = gfile.query_info('standard::type', Gio.FileQueryInfoFlags.NONE, None)
+             event == Gio.FileMonitorEvent.CHANGED or \
+             event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+            change = 'changed'
+        else:
+            return
 
-            if fileinfo.get_file_type() == Gio.FileType.DIRECTORY and \
-               gfile not in self.__monitors:
-                
-                for directory in common.walk_directories(gfile):
-                    monitor = directory.monitor_directory(Gio.FileMonitorFlags.NONE, None)
-                    monitor.connect('changed', self.on_location_changed)
-                    self.__monitors[directory] = monitor
+        # Only the last change of a path matters
+        self.__queue[gfile.get_uri()] = (gfile, change)
 
-                    self.emit('location-added', directory)
+        # File monitors send many events while files are being copied,
+        # and one event per file when whole directories are moved in.
+        # Collect them for a while and handle them all at once.
+        if self.__flush_id is None:
+            self.__flush_id = GLib.timeout_add(self.batch_interval,
+                self.__flush_queue)
 
-        elif event == Gio.FileMonitorEvent.DELETED:
-            removed_tracks = []
+    def __flush_queue(self):
+        """
+            Hands the queued changes to a worker thread
+        """
+        self.__flush_id = None
+        batch, self.__queue = self.__queue, {}
+        self.__process_batch(batch.values())
+        return False
 
-            track = trax.Track(gfile.get_uri())
+    @common.threaded
+    def __process_batch(self, batch):
+        """
+            Applies a batch of changes to the library
+        """
+        with self.__batch_lock:
+            collection = self.__library.collection
+            if collection is None:
+                return
 
-            if track in self.__library.collection:
+            deleted = [gfile for gfile, change in batch if change == 'deleted']
+            changed = [gfile for gfile, change in batch if change == 'changed']
+
+            if deleted:
+                self.__remove_locations(collection, deleted)
+            if changed:
+                self.__add_locations(collection, changed)
+
+    def __remove_locations(self, collection, gfiles):
+        """
+            Removes deleted files and directories from the library
+        """
+        removed = set()
+        directories = set()
+        for gfile in gfiles:
+            uri = gfile.get_uri()
+            if collection.loc_is_member(uri):
                 # Deleted file was a regular track
-                removed_tracks += [track]
+                removed.add(uri)
             else:
                 # Deleted file was most likely a directory
-                for track in self.__library.collection:
-                    track_gfile = Gio.File.new_for_uri(track.get_loc_for_io())
+                index = self.__get_directory_index(collection)
+                removed.update(index.get_locations_below(uri))
+                directories.add(uri)
 
-                    if track_gfile.has_prefix(gfile):
-                        removed_tracks += [track]
+        removed_tracks = [tr for tr in collection.get_tracks_by_locs(removed)
+            if tr is not None]
+        if removed_tracks:
+            collection.remove_tracks(removed_tracks)
 
-            self.__library.collection.remove_tracks(removed_tracks)
+        if not directories:
+            return
 
-            # Remove obsolete monitors
-            removed_directories = [d for d in self.__monitors \
-                if d == gfile or d.has_prefix(gfile)]
+        # Remove obsolete monitors
+        with self.__lock:
+            removed_directories = []
+            for uri in self.__monitors.keys():
+                parent = uri
+                while parent not in directories:
+                    parent, sep, name = parent.rpartition('/')
+                    if not sep:
+                        break
+                else:
+                    directory, monitor = self.__monitors.pop(uri)
+                    monitor.cancel()
+                    removed_directories.append(directory)
 
-            for directory in removed_directories:
-                self.__monitors[directory].cancel()
-                del self.__monitors[directory]
-                
-                self.emit('location-removed', directory)
+        for directory in removed_directories:
+            self.emit('location-removed', directory)
+
+    def __add_locations(self, collection, gfiles):
+        """
+            Reads the tags of created or changed files and adds them to
+            the library. Created directories are scanned and monitored.
+        """
+        uris = []
+        for gfile in gfiles:
+            try:
+                fileinfo = gfile.query_info('standard::type',
+                    Gio.FileQueryInfoFlags.NONE, None)
+            except GLib.Error:
+                continue # Deleted again in the meantime
+
+            if fileinfo.get_file_type() != Gio.FileType.DIRECTORY:
+                uris.append(gfile.get_uri())
+            elif self.__add_monitors(gfile):
+                # A directory that was moved in. Directories that were
+                # already monitored report changes of their files
+                # themselves.
+                for fil, fileinfo in common.walk_with_info(gfile):
+                    if fileinfo is None:
+                        continue
+                    if fileinfo.get_file_type() == Gio.FileType.DIRECTORY:
+                        self.__add_monitors(fil)
+                    else:
+                        uris.append(fil.get_uri())
+
+        if not uris:
+            return
+
+        results = []
+        reader = _TagReader(min(len(uris),
+            settings.get_option('collection/scan_threads', 4)))
+        try:
+            for uri in uris:
+                reader.submit((uri,))
+            while reader.pending:
+                results.extend(reader.get_results(block=True))
+        finally:
+            reader.close()
+
+        added_tracks = []
+        with trax.batch_tag_changes():
+            for (uri,), f, ntags in results:
+                if f is None:
+                    continue # not a supported type
+                tr = collection.get_track_by_loc(uri)
+                if tr is None:
+                    tr = trax.Track(uri, scan=False)
+                    added_tracks.append(tr)
+                tr._set_read_tags(f, ntags)
+
+        if added_tracks:
+            collection.add_tracks(added_tracks)
 
 class Library(object):
     """
@@ -549,6 +682,8 @@ class Library(object):
         self.scan_id = None
         self.scanning = False
         self._startup_scan = startup_scan
+        self._file_based_compilations = settings.OptionHandle(
+                'collection/file_based_compilations', True)
         self.monitor = LibraryMonitor(self)
         self.monitor.props.monitored = monitored
 
@@ -658,7 +793,7 @@ class Library(object):
             :param tr: the track to check
         """
         # check for compilations
-        if not settings.get_option('collection/file_based_compilations', True):
+        if not self._file_based_compilations.value:
             return
 
         def joiner(value):
@@ -713,8 +848,8 @@ class Library(object):
         uri = gloc.get_uri()
         if not uri: # we get segfaults if this check is removed
             return None
-        mtime = gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None).get_modification_time()
-        mtime = mtime.tv_sec + (mtime.tv_usec/100000.0)
+        mtime = common.get_mtime(gloc.query_info("time::modified",
+            Gio.FileQueryInfoFlags.NONE, None))
         tr = self.collection.get_track_by_loc(uri)
         if tr:
             if force_update or tr.get_tag_raw('__modified') < mtime:
@@ -737,6 +872,11 @@ class Library(object):
         """
             Rescan the associated folder and add the contained files
             to the Collection
+
+            Files whose modification time matches the one stored in the
+            collection are skipped without touching them. Tags of new and
+            changed files are read on a pool of worker threads, and the
+            results are applied to the collection on the calling thread.
         """
         # TODO: use gio's cancellable support
         
@@ -748,73 +888,24 @@ class Library(object):
 
         logger.info("Scanning library: %s", self.location)
         self.scanning = True
-        db = self.collection
         libloc = Gio.File.new_for_uri(self.location)
 
-        count = 0
-        dirtracks = deque()
-        compilations = deque()
-        ccheck = {}
-        for fil in common.walk(libloc):
-            count += 1
-            type = fil.query_info("standard::type", Gio.FileQueryInfoFlags.NONE, None).get_file_type()
-            if type == Gio.FileType.DIRECTORY:
-                if dirtracks:
-                    for tr in dirtracks:
-                        self._check_compilation(ccheck, compilations, tr)
-                    for (basedir, album) in compilations:
-                        base = basedir.replace('"', '\\"')
-                        alb = album.replace('"', '\\"')
-                        items = [ tr for tr in dirtracks if \
-                                tr.get_tag_raw('__basedir') == base and \
-                                # FIXME: this is ugly
-                                alb in "".join(
-                                    tr.get_tag_raw('album') or []).lower()
-                                ]
-                        for item in items:
-                            item.set_tag_raw('__compilation', (basedir, album))
-                dirtracks = deque()
-                compilations = deque()
-                ccheck = {}
-            elif type == Gio.FileType.REGULAR:
-                tr = self.update_track(fil, force_update=force_update)
-                if not tr:
-                    continue
-
-                if dirtracks is not None:
-                    dirtracks.append(tr)
-                    # do this so that if we have, say, a 4000-song folder
-                    # we dont get bogged down trying to keep track of them
-                    # for compilation detection. Most albums have far fewer
-                    # than 110 tracks anyway, so it is unlikely that this
-                    # restriction will affect the heuristic's accuracy.
-                    # 110 was chosen to accomodate "top 100"-style
-                    # compilations.
-                    if len(dirtracks) > 110:
-                        logger.info("Too many files, skipping "
-                                "compilation detection heuristic.")
-                        dirtracks = None
-
-            if self.collection and self.collection._scan_stopped:
-                self.scanning = False
-                logger.info("Scan canceled")
-                return
-
-            # progress update
-            if notify_interval is not None and count % notify_interval == 0:
-                event.log_event('tracks_scanned', self, count)
-
-        # final progress update
-        if notify_interval is not None:
-            event.log_event('tracks_scanned', self, count)
-
+        reader = _TagReader(settings.get_option('collection/scan_threads', 4))
+        try:
+            seen = self.__scan(libloc, reader, notify_interval, force_update)
+        finally:
+            reader.close()
 
+        if seen is None:
+            self.scanning = False
+            logger.info("Scan canceled")
+            return
 
         removals = deque()
         for tr in self.collection.tracks.itervalues():
             tr = tr._track
             loc = tr.get_loc_for_io()
-            if not loc:
+            if not loc or loc in seen:
                 continue
             gloc = Gio.File.new_for_uri(loc)
             try:
@@ -827,13 +918,133 @@ class Library(object):
             if not gloc.query_exists(None):
                 removals.append(tr)
 
-        for tr in removals:
-            logger.debug(u"Removing %s"%unicode(tr))
-            self.collection.remove(tr)
+        if removals:
+            for tr in removals:
+                logger.debug(u"Removing %s"%unicode(tr))
+            self.collection.remove_tracks(removals)
             
         logger.info("Scan completed: %s", self.location)
         self.scanning = False
 
+    def __scan(self, libloc, reader, notify_interval, force_update):
+        """
+            Walks the library, updating the collection with new and
+            changed files.
+
+            :returns: the set of file URIs seen, or None if the scan
+                was stopped
+        """
+        db = self.collection
+        count = 0
+        seen = set()
+        added = []
+        directories = deque()
+        directory = None
+
+        for fil, fileinfo in common.walk_with_info(libloc):
+            count += 1
+            if fileinfo is None or \
+                    fileinfo.get_file_type() == Gio.FileType.DIRECTORY:
+                directory = _ScanDirectory()
+                directories.append(directory)
+            elif fileinfo.get_file_type() == Gio.FileType.REGULAR:
+                uri = fil.get_uri()
+                if uri: # we get segfaults if this check is removed
+                    seen.add(uri)
+                    mtime = common.get_mtime(fileinfo)
+                    tr = db.get_track_by_loc(uri)
+                    if tr and not force_update and \
+                            tr.get_tag_raw('__modified') >= mtime:
+                        directory.add(tr)
+                    else:
+                        directory.pending += 1
+                        reader.submit((uri, mtime, directory))
+
+            self.__apply_tag_results(reader.get_results(), added)
+            self.__detect_compilations(directories)
+
+            if len(added) >= 500:
+                db.add_tracks(added)
+                added = []
+
+            if self.collection and self.collection._scan_stopped:
+                return None
+
+            # progress update
+            if notify_interval is not None and count % notify_interval == 0:
+                event.log_event('tracks_scanned', self, count)
+
+        while reader.pending:
+            self.__apply_tag_results(reader.get_results(block=True), added)
+            if self.collection and self.collection._scan_stopped:
+                return None
+        self.__detect_compilations(directories, finished=True)
+
+        if added:
+            db.add_tracks(added)
+
+        # final progress update
+        if notify_interval is not None:
+            event.log_event('tracks_scanned', self, count)
+
+        return seen
+
+    def __apply_tag_results(self, results, added):
+        """
+            Updates tracks with the tags read by the workers. New tracks
+            are appended to added.
+        """
+        with trax.batch_tag_changes():
+            for (uri, mtime, directory), f, ntags in results:
+                directory.pending -= 1
+                tr = self.collection.get_track_by_loc(uri)
+                if tr:
+                    if f is not None:
+                        tr._set_read_tags(f, ntags, mtime)
+                    else:
+                        tr._scan_valid = False
+                else:
+                    tr = trax.Track(uri, scan=False)
+                    if f is not None:
+                        tr._set_read_tags(f, ntags, mtime)
+                        tr.set_tag_raw('__date_added', time.time())
+                        added.append(tr)
+                    # Track already existed. This fixes trax.get_tracks_from_uri
+                    # on windows, unknown why fix isnt needed on linux.
+                    elif not tr._init:
+                        added.append(tr)
+                    else:
+                        continue
+                directory.add(tr)
+
+    def __detect_compilations(self, directories, finished=False):
+        """
+            Runs the compilation heuristic on each directory that has
+            been walked and whose tags have all been read.
+        """
+        # the last directory may still receive files, unless we're done
+        while directories and (finished or len(directories) > 1) and \
+                directories[0].pending == 0:
+            dirtracks = directories.popleft().tracks
+            if not dirtracks:
+                continue
+            compilations = deque()
+            ccheck = {}
+            for tr in dirtracks:
+                self._check_compilation(ccheck, compilations, tr)
+            for (basedir, album) in compilations:
+                base = basedir.replace('"', '\\"')
+                alb = album.replace('"', '\\"')
+                items = [ tr for tr in dirtracks if \
+                        tr.get_tag_raw('__basedir') == base and \
+                        # FIXME: this is ugly
+                        alb in "".join(
+                            tr.get_tag_raw('album') or []).lower()
+                        ]
+                with trax.batch_tag_changes():
+                    for item in items:
+                        item.set_tag_raw('__compilation', (basedir, album))
+
     def add(self, loc, move=False):
         """
             Copies (or moves) a file into the library and adds it to the
@@ -892,6 +1103,178 @@ class Library(object):
         pass
 
 
+class _ScanDirectory(object):
+    """
+        The tracks found in one directory during a library scan, kept for
+        the compilation heuristic
+    """
+    __slots__ = ['tracks', 'pending']
+
+    def __init__(self):
+        self.tracks = deque()
+        self.pending = 0 # number of files still being read
+
+    def add(self, tr):
+        if self.tracks is None:
+            return
+        self.tracks.append(tr)
+        # do this so that if we have, say, a 4000-song folder
+        # we dont get bogged down trying to keep track of them
+        # for compilation detection. Most albums have far fewer
+        # than 110 tracks anyway, so it is unlikely that this
+        # restriction will affect the heuristic's accuracy.
+        # 110 was chosen to accomodate "top 100"-style
+        # compilations.
+        if len(self.tracks) > 110:
+            logger.info("Too many files, skipping "
+                    "compilation detection heuristic.")
+            self.tracks = None
+
+
+class _DirectoryIndex(object):
+    """
+        Maps directory uris to the locations of the tracks directly in
+        them and to their subdirectories, so that the tracks below a
+        directory can be found without looking at any other track.
+    """
+    def __init__(self):
+        # directory -> set of locations
+        self.files = {}
+        # directory -> set of subdirectories
+        self.subdirs = {}
+
+    @common.synchronized
+    def add(self, locations):
+        files = self.files
+        for loc in locations:
+            directory = loc.rpartition('/')[0]
+            try:
+                files[directory].add(loc)
+            except KeyError:
+                files[directory] = set([loc])
+                self.__link(directory)
+
+    def __link(self, directory):
+        """
+            Links a directory to its ancestors
+        """
+        while True:
+            parent, sep, name = directory.rpartition('/')
+            # stop at the root, e.g. 'file://'
+            if not sep or parent.endswith('/'):
+                return
+            linked = parent in self.files or parent in self.subdirs
+            try:
+                self.subdirs[parent].add(directory)
+            except KeyError:
+                self.subdirs[parent] = set([directory])
+            if linked:
+                return
+            directory = parent
+
+    @common.synchronized
+    def remove(self, locations):
+        files = self.files
+        for loc in locations:
+            directory = loc.rpartition('/')[0]
+            dirfiles = files.get(directory)
+            if dirfiles is not None:
+                dirfiles.discard(loc)
+                # subdirs keeps the now empty directory linked, which is
+                # harmless and saves relinking it
+                if not dirfiles:
+                    del files[directory]
+
+    @common.synchronized
+    def get_locations_below(self, directory):
+        """
+            Returns the locations of all tracks in a directory and its
+            subdirectories
+        """
+        locations = []
+        stack = [directory]
+        while stack:
+            directory = stack.pop()
+            locations.extend(self.files.get(directory, ()))
+            stack.extend(self.subdirs.get(directory, ()))
+        return locations
+
+
+class _TagReader(object):
+    """
+        Reads the tags of files on a pool of worker threads
+
+        Jobs are (uri, ...) tuples; results are (job, format, tags)
+        tuples, where format and tags are None if the file could not be
+        read.
+
+        :param workers: the number of threads to use
+    """
+    def __init__(self, workers):
+        workers = max(1, workers)
+        self.pending = 0
+        self._jobs = Queue.Queue(maxsize=workers * 8)
+        self._results = Queue.Queue()
+        self._stopped = False
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name='TagReader')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job):
+        """
+            Queues a file for reading. Blocks while all workers are busy
+            and the queue is full.
+        """
+        self.pending += 1
+        self._jobs.put(job)
+
+    def get_results(self, block=False):
+        """
+            Returns the results that are available. If block is True,
+            waits for at least one result unless nothing is pending.
+        """
+        results = []
+        if block and self.pending:
+            results.append(self._results.get())
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except Queue.Empty:
+                break
+        self.pending -= len(results)
+        return results
+
+    def close(self):
+        """
+            Stops the workers, dropping jobs that haven't been started
+        """
+        self._stopped = True
+        for thread in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            if self._stopped:
+                continue
+            f = ntags = None
+            try:
+                f = metadata.get_format(job[0])
+                if f is not None:
+                    ntags = f.read_all()
+            except Exception:
+                f = None
+                logger.exception("Error reading tags for %s", job[0])
+            self._results.put((job, f, ntags))
+
+
 class TransferQueue(object):
 
     def __init__(self, library):
@@ -460,12 +460,28 @@ def walk(root):
         :returns: a generator object
         :rtype: :class:`Gio.File`
     """
+    for fil, fileinfo in walk_with_info(root):
+        yield fil
+
+def walk_with_info(root):
+    """
+        Like :func:`walk`, but yields (file, fileinfo) pairs so that
+        callers don't need to query the file again.
+
+        The fileinfo contains the ``standard::type`` and
+        ``time::modified`` attributes. It is None for the root directory.
+
+        :param root: a :class:`Gio.File` representing the
+            directory to walk through
+        :returns: a generator object
+        :rtype: tuple of (:class:`Gio.File`, :class:`Gio.FileInfo`)
+    """
     queue = deque()
-    queue.append(root)
+    queue.append((root, None))
 
     while len(queue) > 0:
-        dir = queue.pop()
-        yield dir
+        dir, dirinfo = queue.pop()
+        yield dir, dirinfo
         try:
             for fileinfo in dir.enumerate_children("standard::type,"
                     "standard::is-symlink,standard::name,"
@@ -484,12 +500,24 @@ def walk(root):
                         continue
                 type = fileinfo.get_file_type()
                 if type == Gio.FileType.DIRECTORY:
-                    queue.append(fil)
+                    queue.append((fil, fileinfo))
                 elif type == Gio.FileType.REGULAR:
-                    yield fil
+                    yield fil, fileinfo
         except GLib.Error: # why doesnt gio offer more-specific errors?
             logger.exception("Unhandled exception while walking on %s.", dir)
 
+def get_mtime(fileinfo):
+    """
+        Returns the modification time of a file in the form stored in
+        the ``__modified`` tag of tracks
+
+        :param fileinfo: a :class:`Gio.FileInfo` with the
+            ``time::modified`` attribute
+        :rtype: float
+    """
+    mtime = fileinfo.get_modification_time()
+    return mtime.tv_sec + (mtime.tv_usec/100000.0)
+
 def walk_directories(root):
     """
         Walk through a Gio directory, yielding each subdirectory
@@ -34,6 +34,7 @@ from gi.repository import Gio
 import logging
 import hashlib
 import os
+from collections import OrderedDict
 try:
     import cPickle as pickle
 except ImportError:
@@ -115,6 +116,160 @@ class Cacher(object):
         return None
 
 
+class ThumbnailCacher(Cacher):
+    """
+        On-disk cache of scaled-down covers.
+
+        Thumbnails are named after the cover they were made from and
+        their size, so that all size variants of a cover can be found
+        again. Once the cache grows beyond its size limit, the least
+        recently used thumbnails are evicted; recency is kept in the
+        file modification times so it survives restarts.
+    """
+    def __init__(self, cache_dir, limit):
+        """
+            :param cache_dir: directory to use for the cache. will be
+                created if it does not exist.
+            :param limit: the maximum size of the cache, in bytes
+        """
+        Cacher.__init__(self, cache_dir)
+        self.limit = limit
+        # key -> file size, least recently used first. Loaded on demand.
+        self.__entries = None
+        self.__total = 0
+
+    @staticmethod
+    def get_prefix(db_string):
+        """
+            Returns the prefix shared by all thumbnails of a cover
+        """
+        if isinstance(db_string, unicode):
+            db_string = db_string.encode('utf-8')
+        return hashlib.sha256(db_string).hexdigest()
+
+    @classmethod
+    def get_key(cls, db_string, size):
+        """
+            Returns the key of a cover's thumbnail of the given size
+        """
+        return '%s-%dx%d' % (cls.get_prefix(db_string), size[0], size[1])
+
+    def __load(self):
+        if self.__entries is not None:
+            return
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+        entries.sort()
+        self.__entries = OrderedDict((name, size) for _, name, size in entries)
+        self.__total = sum(self.__entries.itervalues())
+
+    @common.synchronized
+    def add(self, key, data):
+        """
+            Adds a thumbnail to the cache, evicting the least recently
+            used thumbnails if the cache grows too large.
+
+            :param key: The key returned by :meth:`get_key`
+            :param data: The image data to store, as a bytestring.
+        """
+        self.__load()
+        path = os.path.join(self.cache_dir, key)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.__total -= self.__entries.pop(key, 0)
+        self.__entries[key] = len(data)
+        self.__total += len(data)
+
+        while self.__total > self.limit and len(self.__entries) > 1:
+            old_key, old_size = self.__entries.popitem(last=False)
+            self.__total -= old_size
+            Cacher.remove(self, old_key)
+        return key
+
+    @common.synchronized
+    def remove(self, key):
+        self.__load()
+        self.__total -= self.__entries.pop(key, 0)
+        Cacher.remove(self, key)
+
+    @common.synchronized
+    def remove_variants(self, db_string):
+        """
+            Removes the thumbnails of all sizes made from a cover
+
+            :param db_string: The db_string identifying the cover
+        """
+        self.__load()
+        prefix = self.get_prefix(db_string) + '-'
+        for key in [k for k in self.__entries if k.startswith(prefix)]:
+            self.remove(key)
+
+    @common.synchronized
+    def get(self, key):
+        self.__load()
+        size = self.__entries.pop(key, None)
+        if size is None:
+            return None
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            self.__total -= size
+            return None
+        self.__entries[key] = size
+        return data
+
+
+def scale_image_data(data, size):
+    """
+        Decodes image data directly at a size fitting within the given
+        size, keeping its ratio, and encodes the result again. Images
+        with an alpha channel are stored as PNG, all others as JPEG.
+        Images are never scaled up, and consumers that need exactly the
+        given size have to pad the result.
+
+        :param data: The raw image data
+        :param size: The maximum (width, height) of the result
+        :returns: the scaled image data, or None if the data could not
+            be decoded
+    """
+    # Only needed when thumbnails are made, which is never the case
+    # without a GUI around.
+    from gi.repository import GdkPixbuf
+
+    def on_size_prepared(loader, width, height):
+        scale = min(size[0] / float(width), size[1] / float(height), 1.0)
+        loader.set_size(max(1, int(width * scale)),
+            max(1, int(height * scale)))
+
+    loader = GdkPixbuf.PixbufLoader()
+    loader.connect('size-prepared', on_size_prepared)
+
+    try:
+        loader.write(data)
+        loader.close()
+    except GLib.GError:
+        return None
+
+    pixbuf = loader.get_pixbuf()
+    if pixbuf is None:
+        return None
+
+    if pixbuf.get_has_alpha():
+        success, buf = pixbuf.save_to_bufferv('png', [], [])
+    else:
+        success, buf = pixbuf.save_to_bufferv('jpeg', ['quality'], ['90'])
+
+    return buf if success else None
+
+
 class CoverManager(providers.ProviderHandler):
     """
         Handles finding covers from various sources.
@@ -125,6 +280,9 @@ class CoverManager(providers.ProviderHandler):
         """
         providers.ProviderHandler.__init__(self, "covers")
         self.__cache = Cacher(os.path.join(location, 'cache'))
+        self.__thumbnails = ThumbnailCacher(
+            os.path.join(location, 'thumbnails'),
+            settings.get_option('covers/thumbnail_cache_size', 32) * 1024 * 1024)
         self.location = location
         self.methods = {}
         self.order = settings.get_option(
@@ -149,7 +307,10 @@ class CoverManager(providers.ProviderHandler):
         event.add_callback(self._on_option_set, 'covers_option_set')
 
     def _on_option_set(self, name, obj, data):
-        if data == "covers/use_tags":
+        if data == "covers/thumbnail_cache_size":
+            self.__thumbnails.limit = settings.get_option(
+                "covers/thumbnail_cache_size", 32) * 1024 * 1024
+        elif data == "covers/use_tags":
             if settings.get_option("covers/use_tags"):
                 providers.register('covers', self.tag_fetcher)
             else:
@@ -265,6 +426,11 @@ class CoverManager(providers.ProviderHandler):
             db_string = "cache:%s"%self.__cache.add(data)
         key = self._get_track_key(track)
         if key:
+            old_db_string = self.db.get(key)
+            if old_db_string:
+                self.__thumbnails.remove_variants(old_db_string)
+            # The image behind a localfile or tag cover may have changed
+            self.__thumbnails.remove_variants(db_string)
             self.db[key] = db_string
             self.timeout_save()
             event.log_event('cover_set', self, track)
@@ -280,6 +446,7 @@ class CoverManager(providers.ProviderHandler):
         if db_string:
             del self.db[key]
             self.__cache.remove(db_string)
+            self.__thumbnails.remove_variants(db_string)
             self.timeout_save()
             event.log_event('cover_removed', self, track)
 
@@ -318,6 +485,48 @@ class CoverManager(providers.ProviderHandler):
 
         return self.get_default_cover() if use_default else None
 
+    def get_cover_thumbnail(self, track, size, save_cover=True,
+            set_only=False, use_default=False):
+        """
+            Get a scaled-down cover for a given track, fitting within
+            the given size. Thumbnails of covers set in the db are
+            cached, so that they do not need to be decoded and scaled
+            from the full image again.
+
+            :param track: the Track to get the cover for.
+            :param size: the maximum (width, height) of the thumbnail
+            :param save_cover: if True, a set_cover call will be made
+                    to store the cover for later use.
+            :param set_only: Only retrieve covers that have been set
+                    in the db.
+            :param use_default: If True, returns the scaled default cover
+                    instead of None when no covers are found.
+        """
+        size = tuple(size)
+        data = None
+
+        if track is not None:
+            db_string = self.get_db_string(track)
+            if db_string:
+                key = self.__thumbnails.get_key(db_string, size)
+                data = self.__thumbnails.get(key)
+                if data is None:
+                    data = self.get_cover_data(db_string)
+                    if data:
+                        data = scale_image_data(data, size)
+                    if data:
+                        self.__thumbnails.add(key, data)
+            elif not set_only:
+                # Covers that were not saved have no stable key, these
+                # are cached on the next call if save_cover stored them
+                data = self.get_cover(track, save_cover=save_cover)
+                if data:
+                    data = scale_image_data(data, size)
+
+        if data is None and use_default:
+            data = self.get_default_thumbnail(size)
+        return data
+
     def get_cover_data(self, db_string, use_default=False):
         """
             Get the raw image data for a cover.
@@ -346,6 +555,13 @@ class CoverManager(providers.ProviderHandler):
         # TODO: wrap this into get_cover_data and get_cover somehow?
         return self.default_cover_data
 
+    @common.cached(5)
+    def get_default_thumbnail(self, size):
+        """
+            Get the default cover scaled down to fit within size
+        """
+        return scale_image_data(self.default_cover_data, size)
+
     def load(self):
         """
             Load the saved db
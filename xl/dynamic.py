@@ -27,6 +27,7 @@
 import logging
 import os
 import random
+import threading
 import time
 
 from xl.nls import gettext as _
@@ -35,6 +36,9 @@ from xl.trax import search
 
 logger = logging.getLogger(__name__)
 
+#: Seconds after which similar artists are queried again
+SIMILAR_ARTISTS_MAX_AGE = 604800 # one week
+
 class DynamicManager(providers.ProviderHandler):
     """
         handles matching of songs for dynamic playlists
@@ -46,6 +50,12 @@ class DynamicManager(providers.ProviderHandler):
         self.cachedir = os.path.join(xdg.get_cache_dir(), 'dynamic')
         if not os.path.exists(self.cachedir):
             os.makedirs(self.cachedir)
+        # artist -> (last update, [(relevance, artist), ...])
+        self._similar = common.LimitedCache(256)
+        self._unsaved = {}
+        self._lock = threading.Lock()
+        # id(playlist) -> whether it has to be filled again
+        self._filling = {}
 
     def find_similar_tracks(self, track, limit=-1, exclude=[]):
         """
@@ -63,27 +73,31 @@ class DynamicManager(providers.ProviderHandler):
         artists = self.find_similar_artists(track)
         if artists == []:
             return []
+        exclude = set(exclude)
         tracks = []
         random.shuffle(artists)
         i = 0
         while (limit > len(tracks) or limit == -1) and i < len(artists):
-            artist = artists[i][1].replace('"', '\\\"')
+            choices = self._get_tracks_by_artist(artists[i][1])
             i += 1
-            searchres = search.search_tracks_from_string(
-                self.collection, 'artist=="%s"'%artist, case_sensitive=False)
-            choices = [x.track for x in searchres]
-            if choices == []:
-                continue
-            random.shuffle(choices)
-            j = 0
-            while j < len(choices):
-                track = choices[j]
-                if track not in exclude:
-                    tracks.append(track)
-                    break
-                j += 1
+            choices = [x for x in choices if x not in exclude]
+            if choices:
+                tracks.append(random.choice(choices))
         return tracks
 
+    def _get_tracks_by_artist(self, artist):
+        """
+            Returns the tracks of an artist in the collection
+        """
+        try:
+            get_tracks_by_tag = self.collection.get_tracks_by_tag
+        except AttributeError:
+            artist = artist.replace('"', '\\"')
+            return [x.track for x in search.search_tracks_from_string(
+                self.collection, 'artist=="%s"' % artist,
+                case_sensitive=False)]
+        return get_tracks_by_tag('artist', artist)
+
     def find_similar_artists(self, track):
         info = self._load_saved_info(track)
         if info == []:
@@ -103,49 +117,111 @@ class DynamicManager(providers.ProviderHandler):
         return info
 
     def _load_saved_info(self, track):
-        artist = track.get_tag_raw('artist')
+        artist = track.get_tag_raw('artist', join=True)
         if not artist: return []
-        filename = os.path.join(self.cachedir, ','.join(artist))
-        if not os.path.exists(filename):
-            return []
-        f = open(filename)
-        line = f.readline()
-        if line == '':
-            return []
-        last_update = float(line)
-        if 604800 < time.time() - last_update: # one week
-            info = self._query_sources(track)
-            if info != []:
-                self._save_info(track, info)
-                return info
-        info = []
-        for line in f:
+        with self._lock:
             try:
-                rel, artist = line.strip().split(" ",1)
-                info.append((rel, artist))
-            except:
-                pass
-        f.close()
-        return info
+                last_update, info = self._similar[artist]
+            except KeyError:
+                last_update, info = self._read_info(artist)
+                self._similar[artist] = (last_update, info)
+        if info and SIMILAR_ARTISTS_MAX_AGE < time.time() - last_update:
+            newinfo = self._query_sources(track)
+            if newinfo != []:
+                self._save_info(track, newinfo)
+                return list(newinfo)
+        return list(info)
+
+    def _read_info(self, artist):
+        """
+            Reads the similar artists of an artist from the cache
+            directory
+        """
+        filename = os.path.join(self.cachedir, artist)
+        try:
+            f = open(filename)
+        except IOError:
+            return 0, []
+        with f:
+            try:
+                last_update = float(f.readline())
+            except ValueError:
+                return 0, []
+            info = []
+            for line in f:
+                try:
+                    rel, artist = line.strip().split(" ",1)
+                    info.append((rel, artist))
+                except:
+                    pass
+        return last_update, info
 
     def _save_info(self, track, info):
         if info == []:
             return
-        filename = os.path.join(self.cachedir,
-                track.get_tag_raw('artist', join=True))
-        f = open(filename, 'w')
-        f.write("%s\n"%time.time())
-        for item in info:
-            f.write("%.2f %s\n"%item)
-        f.close()
+        artist = track.get_tag_raw('artist', join=True)
+        with self._lock:
+            self._similar[artist] = self._unsaved[artist] = \
+                (time.time(), info)
+        self._timeout_save()
+
+    @common.glib_wait_seconds(30)
+    def _timeout_save(self):
+        self.save()
+
+    def save(self):
+        """
+            Writes changed similar artists to the cache directory
+        """
+        with self._lock:
+            unsaved = self._unsaved
+            self._unsaved = {}
+        for artist, (last_update, info) in unsaved.iteritems():
+            filename = os.path.join(self.cachedir, artist)
+            try:
+                with open(filename, 'w') as f:
+                    f.write("%s\n"%last_update)
+                    for item in info:
+                        f.write("%.2f %s\n"%item)
+            except (IOError, OSError):
+                logger.exception("Could not save similar artists of %s",
+                        artist)
 
     def populate_playlist(self, playlist):
         """
             adds tracks to playlists as needed.
             called when the position of a playlist changes.
+
+            Similar tracks are looked up on a separate thread. Calls
+            made while that is running are coalesced into a single
+            refill once it is done, so skipping through several tracks
+            does not query the sources for every one of them.
         """
         if not playlist:
             return
+        key = id(playlist)
+        with self._lock:
+            if key in self._filling:
+                self._filling[key] = True
+                return
+            self._filling[key] = False
+        self._fill_playlist(playlist)
+
+    @common.threaded
+    def _fill_playlist(self, playlist):
+        key = id(playlist)
+        try:
+            while True:
+                self._add_similar_tracks(playlist)
+                with self._lock:
+                    if not self._filling[key]:
+                        break
+                    self._filling[key] = False
+        finally:
+            with self._lock:
+                del self._filling[key]
+
+    def _add_similar_tracks(self, playlist):
         current_pos = playlist.current_position
         if current_pos < 0 or current_pos >= len(playlist):
             return
@@ -155,17 +231,14 @@ class DynamicManager(providers.ProviderHandler):
             needed = 1
         curr = playlist.current
 
-        starttime = time.time()
         tracks = self.find_similar_tracks(curr, needed,
                 playlist)
 
-        remainingtime = 5 - (time.time()-starttime)
-
-        if remainingtime > 0:
-            time.sleep(remainingtime)
-
         if playlist.current_position != current_pos:
-            return # we skipped in that 5 seconds, so ignore it
+            # the position changed while looking, fill for the new one
+            with self._lock:
+                self._filling[id(playlist)] = True
+            return
         playlist.extend(tracks)
         logger.debug("Added %s tracks." % len(tracks))
 
@@ -24,12 +24,10 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
-from datetime import (
-    datetime,
-    timedelta
-)
+import logging
 import os
-import shelve
+import sqlite3
+import time
 import zlib
 import threading
 
@@ -42,68 +40,147 @@ from xl import (
     xdg
 )
 
+logger = logging.getLogger(__name__)
+
 class LyricsNotFoundException(Exception):
     pass
 
 class LyricsCache:
     '''
-        Basically just a thread-safe shelf for convinience.  
+        Thread-safe store of lyrics entries, kept in a SQLite database.
         Supports container syntax.
+
+        Entries are ``(lyrics, source, url, time)`` tuples, where time is
+        the timestamp of when the entry was stored. Writes are kept in
+        memory and committed in batches.
     '''
+    #: Number of pending writes that causes a commit
+    commit_size = 20
+    #: Fraction of free pages that causes the database to be compacted
+    compact_ratio = 0.25
+
     def __init__(self, location, default=None):
         '''
-            @param location: specify the shelve file location
-            
+            @param location: specify the database file location
+
             @param default: can specify a default to return from getter when
-                there is nothing in the shelve
+                there is nothing in the store
         '''
         self.location = location
-        try:
-            self.db = shelve.open(location, flag='c', protocol=common.PICKLE_PROTOCOL, writeback=False)
-        except ImportError:
-            import bsddb3 # ArchLinux disabled bsddb in python2, so we have to use the external module
-            _db = bsddb3.hashopen(location, 'c')
-            self.db = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
-        self.lock = threading.Lock()
         self.default = default
+        self.lock = threading.Lock()
+        # key -> entry, or None for deleted entries
+        self.pending = {}
+        self.db = sqlite3.connect(location, check_same_thread=False)
+        self.db.text_factory = str
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS lyrics "
+                    "(key TEXT PRIMARY KEY, lyrics BLOB NOT NULL, "
+                    "source TEXT, url TEXT, time REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS lyrics_time "
+                    "ON lyrics (time)")
 
     def keys(self):
         '''
-            Return the shelve keys
+            Return the keys of all entries
         '''
-        return self.db.keys()
-        
+        with self.lock:
+            keys = set(k for (k,) in self.db.execute("SELECT key FROM lyrics"))
+            for key, entry in self.pending.iteritems():
+                if entry is None:
+                    keys.discard(key)
+                else:
+                    keys.add(key)
+            return list(keys)
+
     def _get(self, key, default=None):
         with self.lock:
             try:
-                return self.db[key]
-            except:
+                entry = self.pending[key]
+            except KeyError:
+                row = self.db.execute("SELECT lyrics, source, url, time "
+                        "FROM lyrics WHERE key=?", (key,)).fetchone()
+                entry = None if row is None else \
+                    (str(row[0]), row[1], row[2], row[3])
+            if entry is None:
                 return default if default is not None else self.default
-                
+            return entry
+
     def _set(self, key, value):
         with self.lock:
-            self.db[key] = value
-            # force save, wasn't auto-saving...
-            self.db.sync()
-                
+            self.pending[key] = value
+            if len(self.pending) >= self.commit_size:
+                self._commit()
+        self.timeout_flush()
+
+    def _commit(self):
+        '''
+            Writes the pending changes. Must be called with the lock held.
+        '''
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO lyrics "
+                    "(key, lyrics, source, url, time) VALUES (?, ?, ?, ?, ?)",
+                    ((key, sqlite3.Binary(e[0]), e[1], e[2], e[3])
+                        for key, e in self.pending.iteritems()
+                        if e is not None))
+            self.db.executemany("DELETE FROM lyrics WHERE key=?",
+                    ((key,) for key, e in self.pending.iteritems()
+                        if e is None))
+        self.pending.clear()
+
+    def flush(self):
+        '''
+            Writes all pending changes to disk
+        '''
+        with self.lock:
+            self._commit()
+
+    @common.glib_wait_seconds(10)
+    def timeout_flush(self):
+        self.flush()
+
+    def expire(self, max_age):
+        '''
+            Removes entries older than max_age seconds, and compacts
+            the database if much of it is unused afterwards
+        '''
+        with self.lock:
+            self._commit()
+            with self.db:
+                self.db.execute("DELETE FROM lyrics WHERE time < ?",
+                        (time.time() - max_age,))
+            pages = self.db.execute("PRAGMA page_count").fetchone()[0]
+            free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+            if pages and free >= pages * self.compact_ratio:
+                logger.debug("Compacting lyrics cache")
+                self.db.execute("VACUUM")
+
+    def close(self):
+        with self.lock:
+            self._commit()
+            self.db.close()
+
     def __getitem__(self, key):
         return self._get(key)
-        
+
     def __setitem__(self, key, value):
         self._set(key, value)
-        
+
     def __contains__(self, key):
-        return key in self.db
+        return self._get(key) is not None
 
     def __delitem__(self, key):
-        with self.lock:
-            del self.db[key]
+        if key not in self:
+            raise KeyError(key)
+        self._set(key, None)
 
     def __iter__(self):
-        return self.db.__iter__()
-        
+        return iter(self.keys())
+
     def __len__(self):
-        return len(self.db)
+        return len(self.keys())
 
 class LyricsManager(providers.ProviderHandler):
     """
@@ -116,9 +193,35 @@ class LyricsManager(providers.ProviderHandler):
         providers.ProviderHandler.__init__(self, "lyrics")
         self.preferred_order = settings.get_option(
                 'lyrics/preferred_order', [])
-        self.cache = LyricsCache(os.path.join(xdg.get_cache_dir(), 'lyrics.cache'))
+        self.cache = LyricsCache(os.path.join(xdg.get_cache_dir(), 'lyrics.db'))
+        self.__expire_cache()
+
+        self.__prefetch_lock = threading.Lock()
+        self.__prefetch_queue = []
+        self.__prefetching = False
+        # number of consumers showing lyrics; nothing is prefetched
+        # while there are none
+        self.__prefetch_users = 0
 
         event.add_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.add_callback(self.on_tracks_tags_changed, 'tracks_tags_changed')
+        event.add_callback(self.on_playback_track_start, 'playback_track_start')
+        event.add_callback(self.on_quit_application, 'quit_application')
+
+    @common.threaded
+    def __expire_cache(self):
+        """
+            Removes expired entries from the cache. The cache of older
+            versions is removed as well.
+        """
+        old_location = os.path.join(xdg.get_cache_dir(), 'lyrics.cache')
+        if os.path.exists(old_location):
+            try:
+                os.remove(old_location)
+            except OSError:
+                pass
+        cache_time = settings.get_option('lyrics/cache_time', 720) # in hours
+        self.cache.expire(cache_time * 3600)
 
     def __get_cache_key(self, track, provider):
         """
@@ -128,12 +231,12 @@ class LyricsManager(providers.ProviderHandler):
             :param provider: a lyrics provider
             :return: the appropriate cache key
         """
-        return (
-            track.get_loc_for_io() +
-            provider.display_name.encode('utf-8') +
-            track.get_tag_display('artist').encode('utf-8') +
+        return '\0'.join((
+            track.get_loc_for_io(),
+            provider.display_name.encode('utf-8'),
+            track.get_tag_display('artist').encode('utf-8'),
             track.get_tag_display('title').encode('utf-8')
-        )
+        ))
 
     def set_preferred_order(self, order):
         """
@@ -248,11 +351,11 @@ class LyricsManager(providers.ProviderHandler):
         key = self.__get_cache_key(track, method)
 
         # check cache for lyrics
-        if key in self.cache:
-            (lyrics, source, url, time) = self.cache[key]
+        entry = self.cache[key]
+        if entry is not None and not refresh:
+            (lyrics, source, url, stored) = entry
             # return if they are not expired
-            now = datetime.now()
-            if (now-time < timedelta(hours=cache_time) and not refresh):
+            if time.time() - stored < cache_time * 3600:
                 try:
                     lyrics = zlib.decompress(lyrics)
                 except zlib.error as e:
@@ -263,11 +366,90 @@ class LyricsManager(providers.ProviderHandler):
         assert isinstance(lyrics, unicode), (method, track)
 
         # update cache
-        time = datetime.now()
-        self.cache[key] = (zlib.compress(lyrics.encode('utf-8')), source, url, time)
+        self.cache[key] = (zlib.compress(lyrics.encode('utf-8')), source, url,
+            time.time())
 
         return (lyrics, source, url)
 
+    def add_prefetch_user(self):
+        """
+            Enables prefetching the lyrics of the tracks that play next,
+            for a consumer that shows them. Undo with
+            :meth:`remove_prefetch_user`.
+        """
+        with self.__prefetch_lock:
+            self.__prefetch_users += 1
+
+    def remove_prefetch_user(self):
+        """
+            Stops prefetching once no consumer needs it anymore
+        """
+        with self.__prefetch_lock:
+            self.__prefetch_users = max(0, self.__prefetch_users - 1)
+            if not self.__prefetch_users:
+                self.__prefetch_queue = []
+
+    def prefetch(self, tracks):
+        """
+            Looks up the lyrics of tracks in the background, so that
+            later lookups are answered from the cache. Replaces the
+            tracks of earlier calls that were not looked up yet.
+
+            :param tracks: the tracks to look up lyrics for
+        """
+        with self.__prefetch_lock:
+            self.__prefetch_queue = list(tracks)
+            if self.__prefetching or not self.__prefetch_queue:
+                return
+            self.__prefetching = True
+        self.__run_prefetch()
+
+    @common.threaded
+    def __run_prefetch(self):
+        while True:
+            with self.__prefetch_lock:
+                if not self.__prefetch_queue:
+                    self.__prefetching = False
+                    return
+                track = self.__prefetch_queue.pop(0)
+            try:
+                self.find_all_lyrics(track)
+            except LyricsNotFoundException:
+                pass
+            except Exception:
+                logger.exception("Error prefetching lyrics")
+
+    def on_playback_track_start(self, e, player, track):
+        """
+            Prefetches the lyrics of the tracks that play next, if
+            something shows lyrics
+        """
+        if not self.__prefetch_users:
+            return
+        count = settings.get_option('lyrics/prefetch_count', 3)
+        queue = player.queue
+        if count <= 0 or queue is None:
+            return
+
+        tracks = []
+        next = queue.get_next()
+        if next is not None:
+            tracks.append(next)
+
+        playlist = queue.current_playlist
+        position = playlist.current_position
+        if playlist.shuffle_mode == 'disabled' and position != -1:
+            for tr in playlist[position + 1:position + 1 + count]:
+                if len(tracks) >= count:
+                    break
+                if tr not in tracks:
+                    tracks.append(tr)
+
+        self.prefetch(tracks)
+
+    def on_quit_application(self, e, exaile, data):
+        self.cache.flush()
+
     def on_provider_removed(self, provider):
         """
             Remove the provider from the methods dict, and the
@@ -285,12 +467,27 @@ class LyricsManager(providers.ProviderHandler):
             Updates the internal cache upon lyric tag changes
         """
         if tag == 'lyrics':
-            local_provider = self.get_provider('__local')
+            self.__remove_local_lyrics([track])
 
-            # If the local tag provider was removed, don't bother
-            if local_provider is None:
-                return
+    def on_tracks_tags_changed(self, e, obj, changes):
+        """
+            Updates the internal cache upon batched lyric tag changes
+        """
+        tracks = [track for track, tag in changes if tag == 'lyrics']
+        if tracks:
+            self.__remove_local_lyrics(tracks)
+
+    def __remove_local_lyrics(self, tracks):
+        """
+            Removes the cached lyrics of the local tag provider
+        """
+        local_provider = self.get_provider('__local')
+
+        # If the local tag provider was removed, don't bother
+        if local_provider is None:
+            return
 
+        for track in tracks:
             key = self.__get_cache_key(track, local_provider)
 
             # Try to remove the corresponding cache entry
@@ -36,7 +36,7 @@ import platform
 import sys
 import threading
 
-from xl import logger_setup
+from xl import logger_setup, startup_profile
 from xl.nls import gettext as _
 
 # Imported later to avoid PyGObject imports just for --help.
@@ -215,6 +215,10 @@ def create_argument_parser():
         default=True, help=_("Disable D-Bus support"))
     group.add_argument('--no-hal', dest='Hal', action='store_false',
         default=True, help=_("Disable HAL support."))
+    group.add_argument("--startup-profile", dest="StartupProfile",
+        nargs='?', const='', metavar=_('FILE'),
+        help=_("Write the time taken by each phase of startup to FILE,"
+        " or to startup-profile.json in the cache directory"))
 
     return p
 
@@ -251,7 +255,11 @@ class Exaile(object):
             self.version()
             return
 
-        _do_heavy_imports()
+        if self.options.StartupProfile is not None:
+            startup_profile.PROFILER.start(self.options.StartupProfile)
+
+        with startup_profile.phase('imports'):
+            _do_heavy_imports()
 
         if self.options.UseDataDir:
             xdg.data_dirs.insert(1, self.options.UseDataDir)
@@ -327,7 +335,8 @@ class Exaile(object):
             from xl.version import __version__
     
             #load the rest.
-            self.__init()
+            with startup_profile.phase('init'):
+                self.__init()
     
             #handle delayed commands
             if self.options.StartGui and self.options.Dbus and \
@@ -360,12 +369,18 @@ class Exaile(object):
 
         logger.info("Loading settings...")
         try:
-            from xl import settings
+            with startup_profile.phase('settings'):
+                from xl import settings
         except common.VersionError:
             logger.exception("Error loading settings")
             sys.exit(1)
             
         logger.debug("Settings loaded from %s" % settings.location)
+
+        if startup_profile.PROFILER.enabled and \
+                not startup_profile.PROFILER.location:
+            startup_profile.PROFILER.location = os.path.join(
+                xdg.get_cache_dir(), 'startup-profile.json')
         
         # display locale information if available
         try:
@@ -391,28 +406,8 @@ class Exaile(object):
 
         firstrun = settings.get_option("general/first_run", True)
 
-        if not self.options.NoImport and \
-                (firstrun or self.options.ForceImport):
-            try:
-                sys.path.insert(0, xdg.get_data_path("migrations"))
-                import migration_200907100931 as migrator
-                del sys.path[0]
-                migrator.migrate(force=self.options.ForceImport)
-                del migrator
-            except:
-                logger.exception("Failed to migrate from 0.2.14")
-
-        # Migrate old rating options
-        from xl.migrations.settings import rating
-        rating.migrate()
-
-        # Migrate builtin OSD to plugin
-        from xl.migrations.settings import osd
-        osd.migrate()
-        
-        # Migrate engines
-        from xl.migrations.settings import engine
-        engine.migrate()
+        with startup_profile.phase('migrations'):
+            self.__migrate(firstrun)
         
         # TODO: enable audio plugins separately from normal
         #       plugins? What about plugins that use the player?
@@ -420,16 +415,21 @@ class Exaile(object):
         # Gstreamer doesn't initialize itself automatically, and fails
         # miserably when you try to inherit from something and GST hasn't
         # been initialized yet. So this is here.
-        from gi.repository import Gst
-        Gst.init(None)
+        with startup_profile.phase('gstreamer'):
+            from gi.repository import Gst
+            Gst.init(None)
 
         # Initialize plugin manager
         from xl import plugins
         self.plugins = plugins.PluginsManager(self)
         
+        # Plugins that don't need to be there when the interface shows up
+        # are enabled afterwards, see __init_deferred
         if not self.options.SafeMode:
             logger.info("Loading plugins...")
-            self.plugins.load_enabled()
+            with startup_profile.phase('plugins'):
+                self.plugins.load_enabled(
+                        deferred=False if self.options.StartGui else None)
         else:
             logger.info("Safe mode enabled, not loading plugins.")
 
@@ -437,31 +437,38 @@ class Exaile(object):
         logger.info("Loading collection...")
         from xl import collection
         try:
-            self.collection = collection.Collection("Collection",
-                    location=os.path.join(xdg.get_data_dir(), 'music.db'))
+            with startup_profile.phase('collection'):
+                self.collection = collection.Collection("Collection",
+                        location=os.path.join(xdg.get_data_dir(), 'music.db'))
         except common.VersionError:
             logger.exception("VersionError loading collection")
             sys.exit(1)
 
         from xl import event
         # Set up the player and playback queue
-        from xl import player
-        event.log_event("player_loaded", player.PLAYER, None)
-
-        # Initalize playlist manager
-        from xl import playlist
-        self.playlists = playlist.PlaylistManager()
-        self.smart_playlists = playlist.PlaylistManager('smart_playlists',
-            playlist.SmartPlaylist)
-        if firstrun:
-            self._add_default_playlists()
-        event.log_event("playlists_loaded", self, None)
+        with startup_profile.phase('player'):
+            from xl import player
+            event.log_event("player_loaded", player.PLAYER, None)
+
+        # Initalize playlist manager. Smart playlists and radio stations
+        # are read after the interface is shown, unless something needs
+        # them earlier.
+        with startup_profile.phase('playlists'):
+            from xl import playlist
+            self.playlists = playlist.PlaylistManager()
+            self.smart_playlists = playlist.PlaylistManager('smart_playlists',
+                playlist.SmartPlaylist, load=False)
+            self.stations = playlist.PlaylistManager('radio_stations',
+                load=False)
+            if firstrun:
+                self._add_default_playlists()
+            event.log_event("playlists_loaded", self, None)
 
         # Initialize dynamic playlist support
         from xl import dynamic
         dynamic.MANAGER.collection = self.collection
 
-        # Initalize device manager
+        # Initalize device manager. Devices are looked for later.
         logger.info("Loading devices...")
         from xl import devices
         self.devices = devices.DeviceManager()
@@ -473,26 +480,9 @@ class Exaile(object):
         self.udisks2 = None
         self.udisks = None
         self.hal = None
-        
-        if self.options.Hal:
-            from xl import hal
-                
-            udisks2 = hal.UDisks2(self.devices)
-            if udisks2.connect():
-                self.udisks2 = udisks2
-            else:
-                udisks = hal.UDisks(self.devices)
-                if udisks.connect():
-                    self.udisks = udisks
-                else:
-                    self.hal = hal.HAL(self.devices)
-                    self.hal.connect()
-        else:
-            self.hal = None
 
         # Radio Manager
         from xl import radio
-        self.stations = playlist.PlaylistManager('radio_stations')
         self.radio = radio.RadioManager()
 
         self.gui = None
@@ -500,10 +490,11 @@ class Exaile(object):
         if self.options.StartGui:
             logger.info("Loading interface...")
 
-            import xlgui
-            self.gui = xlgui.Main(self)
-            self.gui.main.window.show_all()
-            event.log_event("gui_loaded", self, None)
+            with startup_profile.phase('gui'):
+                import xlgui
+                self.gui = xlgui.Main(self)
+                self.gui.main.window.show_all()
+                event.log_event("gui_loaded", self, None)
 
             if splash is not None:
                 splash.destroy()
@@ -527,17 +518,116 @@ class Exaile(object):
             self.gui.rescan_collection_with_progress(True)
 
         if restore:
-            player.QUEUE._restore_player_state(
-                    os.path.join(xdg.get_data_dir(), 'player.state'))
+            with startup_profile.phase('restore player'):
+                player.QUEUE._restore_player_state(
+                        os.path.join(xdg.get_data_dir(), 'player.state'))
 
         if firstrun:
             settings.set_option("general/first_run", False)
 
-        self.loading = False
         Exaile._exaile = self
-        event.log_event("exaile_loaded", self, None)
+
+        phases = [
+            ('devices', self.__init_devices),
+            ('smart playlists', self.smart_playlists.load_names),
+            ('radio stations', self.stations.load_names),
+        ]
+        if not self.options.SafeMode:
+            phases.append(('deferred plugins', self.__init_deferred_plugins))
+        phases.append(('loaded', self.__init_done))
+
+        # let the interface draw its first frame before going on
+        if self.gui:
+            from gi.repository import GLib
+            GLib.idle_add(self.__init_deferred, phases,
+                    priority=GLib.PRIORITY_LOW)
+        else:
+            while self.__init_deferred(phases):
+                pass
         # pylint: enable-msg=W0201
 
+    def __init_deferred(self, phases):
+        """
+            Runs the next phase of the initialization that waits until
+            the interface is shown. Returns True while phases remain.
+        """
+        name, func = phases.pop(0)
+        try:
+            with startup_profile.phase(name):
+                func()
+        except Exception:
+            logger.exception("Error during startup phase %s", name)
+        return bool(phases)
+
+    def __init_devices(self):
+        """
+            Connects to the device discovery services
+        """
+        if not self.options.Hal:
+            return
+
+        from xl import hal
+            
+        udisks2 = hal.UDisks2(self.devices)
+        if udisks2.connect():
+            self.udisks2 = udisks2
+        else:
+            udisks = hal.UDisks(self.devices)
+            if udisks.connect():
+                self.udisks = udisks
+            else:
+                self.hal = hal.HAL(self.devices)
+                self.hal.connect()
+
+    def __init_deferred_plugins(self):
+        """
+            Enables the plugins that weren't needed to show the interface
+        """
+        # gui_loaded and player_loaded have already been logged, so
+        # plugins enabled now must not wait for them. exaile_loaded is
+        # still logged afterwards.
+        self.loading = False
+        self.plugins.load_enabled(deferred=True)
+
+    def __init_done(self):
+        from xl import event
+        self.loading = False
+        event.log_event("exaile_loaded", self, None)
+
+        profiler = startup_profile.PROFILER
+        if profiler.enabled:
+            for line in profiler.summary():
+                logger.info("Startup: %s", line)
+            profiler.finish()
+            logger.info("Wrote startup profile to %s", profiler.location)
+
+    def __migrate(self, firstrun):
+        """
+            Migrates data and settings of older versions
+        """
+        if not self.options.NoImport and \
+                (firstrun or self.options.ForceImport):
+            try:
+                sys.path.insert(0, xdg.get_data_path("migrations"))
+                import migration_200907100931 as migrator
+                del sys.path[0]
+                migrator.migrate(force=self.options.ForceImport)
+                del migrator
+            except:
+                logger.exception("Failed to migrate from 0.2.14")
+
+        # Migrate old rating options
+        from xl.migrations.settings import rating
+        rating.migrate()
+
+        # Migrate builtin OSD to plugin
+        from xl.migrations.settings import osd
+        osd.migrate()
+        
+        # Migrate engines
+        from xl.migrations.settings import engine
+        engine.migrate()
+
     def __show_splash(self):
         """
             Displays the splash screen
@@ -700,6 +790,9 @@ class Exaile(object):
         from xl import covers
         covers.MANAGER.save()
 
+        from xl import dynamic
+        dynamic.MANAGER.save()
+
         self.collection.save_to_location()
 
         # Save order of custom playlists
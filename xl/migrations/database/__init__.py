@@ -30,12 +30,22 @@ from xl import common
 
 
 def handle_migration(db, pdata, oldversion, newversion):
-    if oldversion == 1 and newversion == 2:
+    """
+        Upgrades the database stored in the
+        :class:`xl.trax.storage.ShelveStorage` pdata from oldversion to
+        newversion, one format version at a time. The caller closes
+        pdata.
+    """
+    if oldversion == 1 and newversion >= 2:
         migrator = imp.load_source("from1to2",
                 os.path.join(os.path.dirname(__file__), "from1to2.py"))
+        migrator.migrate(db, pdata.shelf, oldversion, 2)
+        oldversion = 2
+    if oldversion == 2 and newversion == 3:
+        migrator = imp.load_source("from2to3",
+                os.path.join(os.path.dirname(__file__), "from2to3.py"))
         migrator.migrate(db, pdata, oldversion, newversion)
-    else:
+    elif oldversion != newversion:
         raise common.VersionError, "Don't know how to handle upgrade from " \
                 "music database version %s to %s."%(oldversion, newversion)
 
-
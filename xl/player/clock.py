@@ -0,0 +1,178 @@
+# Copyright (C) 2015 Dustin Spicuzza
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+
+from gi.repository import GLib
+
+import logging
+
+from xl import event
+
+logger = logging.getLogger(__name__)
+
+
+class PositionClock(object):
+    '''
+        Provides the playback position of a player to everything that
+        displays it.
+        
+        The position is queried from the engine at most once per sample
+        interval while playing, and interpolated in between using the
+        monotonic clock. Subscribers are called periodically with the
+        current position from a single timer, which only runs while
+        playback is in progress. This way the number of pipeline queries
+        doesn't depend on how many widgets show the position.
+        
+        The position is sampled again immediately when a track starts,
+        playback is paused or resumed, or the player seeks.
+    '''
+    
+    #: Maximum time in milliseconds between two engine queries
+    sample_interval = 1000
+    
+    def __init__(self, player, query_position):
+        '''
+            :param player: the :class:`xl.player.player.ExailePlayer`
+            :param query_position: function that queries the playback
+                position from the engine, in nanoseconds
+        '''
+        self.player = player
+        self.query_position = query_position
+        
+        self.__sample = None        # (position in ns, monotonic time in us)
+        self.__playing = False      # whether the position is advancing
+        
+        self.__subscribers = []     # [callback, interval, time of last call]
+        self.__timer_id = None
+        self.__tick = None
+        
+        for e in ('playback_track_start', 'playback_toggle_pause',
+                  'playback_seeked'):
+            event.add_callback(self._on_playback_changed, e, player)
+        for e in ('playback_track_end', 'playback_player_end'):
+            event.add_callback(self._on_playback_stopped, e, player)
+    
+    def get_position(self):
+        '''
+            :returns: the playback position in nanoseconds
+        '''
+        now = GLib.get_monotonic_time()
+        sample = self.__sample
+        
+        if sample is None or (self.__playing and
+                now - sample[1] >= self.sample_interval * 1000):
+            self.__playing = self.player.get_state() == 'playing'
+            sample = self.__sample = (self.query_position(), now)
+        
+        if not self.__playing:
+            return sample[0]
+        
+        return sample[0] + (now - sample[1]) * 1000
+    
+    def invalidate(self):
+        '''
+            Makes the next call to get_position query the engine
+        '''
+        self.__sample = None
+    
+    def subscribe(self, callback, interval=1000):
+        '''
+            Calls a function periodically while playback is in progress.
+            The function is passed the playback time in seconds.
+            
+            :param callback: the function to call
+            :param interval: time in milliseconds between calls
+            :returns: a function that unsubscribes the callback
+        '''
+        subscriber = [callback, interval, GLib.get_monotonic_time()]
+        self.__subscribers.append(subscriber)
+        self.__update_timer()
+        
+        def unsubscribe():
+            try:
+                self.__subscribers.remove(subscriber)
+            except ValueError:
+                pass
+            else:
+                self.__update_timer()
+        
+        return unsubscribe
+    
+    def __update_timer(self):
+        '''
+            Runs the timer at the shortest interval of all subscribers
+            while playing, and stops it otherwise
+        '''
+        tick = None
+        if self.__subscribers and self.player.current is not None:
+            self.get_position()
+            if self.__playing:
+                tick = min(s[1] for s in self.__subscribers)
+        
+        if tick == self.__tick:
+            return
+        
+        if self.__timer_id is not None:
+            GLib.source_remove(self.__timer_id)
+            self.__timer_id = None
+        
+        self.__tick = tick
+        if tick is not None:
+            self.__timer_id = GLib.timeout_add(tick, self.__on_timer)
+    
+    def __broadcast(self, due=False):
+        '''
+            Calls the subscribers, or only those whose interval
+            has elapsed if due is True
+        '''
+        time = self.get_position() / 1000000000.0
+        now = GLib.get_monotonic_time()
+        
+        # subscribers may unsubscribe when they are called
+        for subscriber in self.__subscribers[:]:
+            callback, interval, last = subscriber
+            # allow for some jitter of the timer
+            if due and (now - last) < (interval - self.__tick / 2) * 1000:
+                continue
+            subscriber[2] = now
+            try:
+                callback(time)
+            except Exception:
+                logger.exception("Unhandled exception in position subscriber")
+    
+    def __on_timer(self):
+        self.__broadcast(due=True)
+        return True
+    
+    def _on_playback_changed(self, eventname, player, data):
+        self.invalidate()
+        self.__update_timer()
+        if self.__subscribers and player.current is not None:
+            self.__broadcast()
+    
+    def _on_playback_stopped(self, eventname, player, track):
+        self.invalidate()
+        self.__update_timer()
@@ -52,6 +52,7 @@ class ExaileGstEngine(ExaileEngine):
         * gapless playback
         * crossfading (requires gst-plugins-bad)
         * Dynamic audio device switching at runtime
+        * Pre-rolling of the next track, for instant track changes
         
         Notes about crossfading:
         
@@ -77,6 +78,16 @@ class ExaileGstEngine(ExaileEngine):
           installed). Create multiple AudioStream objects, and they have a
           DynamicAudioSink object hooked up to an interaudiosink.
                 
+        Notes about pre-rolling:
+        
+        A standby AudioStream loads the track that the queue predicts to be
+        played next, and waits in the paused state. When that track is
+        played without a gapless transition (the user skips to it, or it is
+        crossfaded to), the standby stream is swapped in and starts playing
+        without having to open and decode the file first. How often the
+        prediction was right is counted by preroll_hits and preroll_misses.
+        Only local tracks are pre-rolled.
+        
         You can register plugins to modify the output audio via the following
         providers:
         
@@ -102,6 +113,11 @@ class ExaileGstEngine(ExaileEngine):
         self.user_fade_enabled = False
         self.user_fade_duration = 1000 
         
+        # Load the predicted next track in a standby stream
+        self.preroll_enabled = True
+        self.preroll_hits = 0
+        self.preroll_misses = 0
+        
         # Key: option name; value: attribute on self
         options = {
             '%s/crossfading' % self.name: 'crossfade_enabled',
@@ -112,7 +128,9 @@ class ExaileGstEngine(ExaileEngine):
             '%s/custom_sink_pipe' % self.name: 'custom_sink_pipe',
             
             '%s/user_fade_enabled' % self.name: 'user_fade_enabled',
-            '%s/user_fade' % self.name: 'user_fade_duration'
+            '%s/user_fade' % self.name: 'user_fade_duration',
+            
+            '%s/preroll_next' % self.name: 'preroll_enabled'
         }
         
         self.settings_unsubscribe = common.subscribe_for_settings(self.name, options, self)
@@ -133,6 +151,9 @@ class ExaileGstEngine(ExaileEngine):
         if name in ['audiosink_device', 'audiosink', 'custom_sink_pipe']:
             self._reconfigure_sink()
         
+        if name == 'preroll_enabled':
+            self._reconfigure_preroll()
+        
     #
     # API
     #
@@ -143,11 +164,13 @@ class ExaileGstEngine(ExaileEngine):
         
         self.main_stream = AudioStream(self)
         self.other_stream = None
+        self.standby_stream = None
         self.crossfade_out = None
         
         self.player.engine_load_volume()
         
         self._reconfigure_crossfader()
+        self._reconfigure_preroll()
     
     def _reconfigure_crossfader(self):
         
@@ -170,6 +193,26 @@ class ExaileGstEngine(ExaileEngine):
         
         self.main_stream.reconfigure_fader(cf_duration, cf_duration)
     
+    def _reconfigure_preroll(self):
+        
+        if self.preroll_enabled:
+            self.logger.info("Pre-rolling: enabled")
+            if self.standby_stream is None:
+                self.standby_stream = AudioStream(self)
+                self.standby_stream.set_user_volume(self.main_stream.get_user_volume())
+                self.preroll_unsubscribe = [
+                    event.add_ui_callback(self._on_preroll_changed, name)
+                    for name in self.preroll_events
+                ]
+            self._preroll_next_track()
+        else:
+            self.logger.info("Pre-rolling: disabled")
+            if self.standby_stream is not None:
+                for unsubscribe in self.preroll_unsubscribe:
+                    unsubscribe()
+                self.standby_stream.destroy()
+                self.standby_stream = None
+    
     def _reconfigure_sink(self):
         
         self.logger.info("Reconfiguring audiosinks")
@@ -177,6 +220,11 @@ class ExaileGstEngine(ExaileEngine):
         self.main_stream.reconfigure_sink()
         if self.other_stream is not None:
             self.other_stream.reconfigure_sink()
+        
+        # the standby stream reconfigures its sink when it is used next
+        if self.standby_stream is not None:
+            self.standby_stream.stop(emit_eos=False)
+            self.standby_stream.needs_sink = True
     
     def destroy(self, permanent=True):
         
@@ -185,6 +233,12 @@ class ExaileGstEngine(ExaileEngine):
         if self.other_stream is not None:
             self.other_stream.destroy()
         
+        if self.standby_stream is not None:
+            for unsubscribe in self.preroll_unsubscribe:
+                unsubscribe()
+            self.standby_stream.destroy()
+            self.standby_stream = None
+        
         if permanent:
             self.settings_unsubscribe()
         
@@ -241,11 +295,16 @@ class ExaileGstEngine(ExaileEngine):
         self.main_stream.set_user_volume(volume)
         if self.other_stream is not None:
             self.other_stream.set_user_volume(volume)
+        if self.standby_stream is not None:
+            self.standby_stream.set_user_volume(volume)
             
     def stop(self):
         if self.other_stream is not None:
             self.other_stream.stop()
         
+        if self.standby_stream is not None:
+            self.standby_stream.stop(emit_eos=False)
+        
         prior_track = self.main_stream.stop(emit_eos=False)
         self.player.engine_notify_track_end(prior_track, True)
     
@@ -275,6 +334,14 @@ class ExaileGstEngine(ExaileEngine):
             self._autoadvance_track()
          
     def _error_func(self, stream, msg):
+        
+        # An error in the track that was pre-rolled is reported once it's
+        # actually played, the user isn't playing it yet
+        if stream is self.standby_stream:
+            self.logger.warning("Could not pre-roll track: %s", msg)
+            stream.stop(emit_eos=False)
+            return
+        
         # Destroy the streams, and create a new one, just in case
         
         self.player.engine_notify_error(msg)
@@ -289,6 +356,10 @@ class ExaileGstEngine(ExaileEngine):
         if prior_track is not None:
             self.player.engine_notify_track_end(prior_track, False)
         
+        # gapless transitions are already queued in the main stream
+        if not already_queued and self.standby_stream is not None:
+            self._swap_standby_stream(track)
+        
         if self.crossfade_enabled:
             self.main_stream, self.other_stream = self.other_stream, self.main_stream
             self.main_stream.play(track, start_at, paused, already_queued,
@@ -302,6 +373,76 @@ class ExaileGstEngine(ExaileEngine):
             self.main_stream.play(track, start_at, paused, already_queued)
         
         self.player.engine_notify_track_start(track)
+        
+        if self.standby_stream is not None:
+            self._preroll_next_track()
+    
+    #
+    # Pre-rolling
+    #
+    
+    #: Events that may change the track that is played next
+    preroll_events = [
+        'playlist_current_position_changed',
+        'playlist_spat_position_changed',
+        'playlist_tracks_added',
+        'playlist_tracks_removed',
+        'playlist_shuffle_mode_changed',
+        'playlist_repeat_mode_changed',
+        'queue_current_playlist_changed',
+    ]
+    
+    def _on_preroll_changed(self, *args):
+        self._preroll_next_track()
+    
+    @common.glib_wait(1000)
+    def _preroll_next_track(self):
+        '''
+            Loads the track that will probably be played next into the
+            standby stream
+        '''
+        
+        standby = self.standby_stream
+        if standby is None:
+            return
+        
+        track = None
+        if self.main_stream.current_track is not None and \
+                self.player.queue is not None:
+            track = self.player.queue.get_next()
+        
+        if track is standby.prerolled_track:
+            return
+        
+        if track is None or not track.is_local():
+            standby.stop(emit_eos=False)
+        else:
+            standby.preroll(track)
+    
+    def _swap_standby_stream(self, track):
+        '''
+            Swaps in the standby stream if it pre-rolled the track, so
+            that it will be played by the stream that plays the next track
+        '''
+        
+        standby = self.standby_stream
+        if standby.prerolled_track is not track:
+            self.preroll_misses += 1
+            self.logger.debug("Pre-roll miss (%s hits, %s misses)",
+                              self.preroll_hits, self.preroll_misses)
+            return
+        
+        self.preroll_hits += 1
+        self.logger.debug("Pre-roll hit (%s hits, %s misses)",
+                          self.preroll_hits, self.preroll_misses)
+        
+        # crossfading plays the next track on other_stream
+        if self.crossfade_enabled:
+            self.other_stream, self.standby_stream = standby, self.other_stream
+        else:
+            self.main_stream, self.standby_stream = standby, self.main_stream
+        
+        self.standby_stream.stop(emit_eos=False)
 
 
 class AudioStream(object):
@@ -323,6 +464,9 @@ class AudioStream(object):
         self.current_track = None
         self.buffered_track = None
         
+        # track loaded in paused state by preroll()
+        self.prerolled_track = None
+        
         # This exists because if there is a sink error, it doesn't
         # really make sense to recreate the sink -- it'll just fail
         # again. Instead, wait for the user to try to play a track,
@@ -406,17 +550,13 @@ class AudioStream(object):
              fade_in_duration=None, fade_out_duration=None):
         '''fade duration is in seconds'''
         
-        if not already_queued:
+        # A pre-rolled track is already loaded, just start it
+        prerolled = not already_queued and track is self.prerolled_track
+        self.prerolled_track = None
+        
+        if not already_queued and not prerolled:
             self.stop(emit_eos=False)
-            
-            # For the moment, the only safe time to add/remove elements
-            # is when the playbin is NULL, so do that here..
-            if self.audio_filters.setup_elements():
-                self.logger.debug("Applying audio filters")
-                self.playbin.props.audio_filter = self.audio_filters
-            else:
-                self.logger.debug("Not applying audio filters")
-                self.playbin.props.audio_filter = None
+            self._setup_audio_filters()
         
         if self.needs_sink:
             self.reconfigure_sink()
@@ -430,7 +570,7 @@ class AudioStream(object):
         
         
         # This is only set for gapless playback
-        if not already_queued:
+        if not already_queued and not prerolled:
             self.playbin.set_property("uri", uri)
             if urlparse.urlsplit(uri)[0] == "cdda":
                 self.notify_id = self.playbin.connect('source-setup',
@@ -452,6 +592,35 @@ class AudioStream(object):
         if paused:
             self.fader.pause()
     
+    def preroll(self, track):
+        '''
+            Loads a track in paused state, so that it starts playing
+            immediately when it is passed to play()
+        '''
+        
+        self.stop(emit_eos=False)
+        self._setup_audio_filters()
+        
+        if self.needs_sink:
+            self.reconfigure_sink()
+        
+        uri = track.get_loc_for_io()
+        self.logger.debug("Pre-rolling %s", common.sanitize_url(uri))
+        
+        self.prerolled_track = track
+        self.playbin.set_property("uri", uri)
+        self.playbin.set_state(Gst.State.PAUSED)
+    
+    def _setup_audio_filters(self):
+        # For the moment, the only safe time to add/remove elements
+        # is when the playbin is NULL, so do that here..
+        if self.audio_filters.setup_elements():
+            self.logger.debug("Applying audio filters")
+            self.playbin.props.audio_filter = self.audio_filters
+        else:
+            self.logger.debug("Not applying audio filters")
+            self.playbin.props.audio_filter = None
+    
     def seek(self, value):
         '''value is in seconds'''
         
@@ -489,6 +658,7 @@ class AudioStream(object):
     def stop(self, emit_eos=True):
         prior_track = self.current_track
         self.current_track = None
+        self.prerolled_track = None
         self.playbin.set_state(Gst.State.NULL)
         self.fader.stop()
         
@@ -557,6 +727,10 @@ class AudioStream(object):
             
             current = self.current_track
             
+            # a pre-rolled track isn't playing yet
+            if current is None:
+                return True
+            
             if not current.is_local():
                 gst_utils.parse_stream_tags(current, message.parse_tag())
             
@@ -634,6 +808,9 @@ class AudioStream(object):
         playbin.disconnect(self.notify_id)
     
     def on_volume_change(self, e, p):
+        # the user doesn't hear the pre-rolled track yet
+        if self.prerolled_track is not None:
+            return
         real = self.playbin.props.volume
         vol, is_same = self.fader.calculate_user_volume(real)
         if not is_same:
@@ -34,6 +34,8 @@ from xl import common
 from xl import event
 from xl import settings
 
+from .clock import PositionClock
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -78,8 +80,12 @@ class ExailePlayer(object):
         
         self._setup_engine()
         
+        #: Shared source of the playback position, see :class:`.PositionClock`
+        self.clock = PositionClock(self, lambda: self._engine.get_position())
+        
         event.add_callback(self._on_track_end, 'playback_track_end', self)
         event.add_callback(self._on_track_tags_changed, 'track_tags_changed')
+        event.add_callback(self._on_tracks_tags_changed, 'tracks_tags_changed')
 
     def _setup_engine(self):
         
@@ -125,6 +131,11 @@ class ExailePlayer(object):
             return
         
         self._engine.on_track_stopoffset_changed(track)
+
+    def _on_tracks_tags_changed(self, eventtype, obj, changes):
+        for track, tag in changes:
+            if tag == '__stopoffset':
+                self._on_track_tags_changed(eventtype, track, tag)
     
     def destroy(self):
         """
@@ -305,7 +316,7 @@ class ExailePlayer(object):
             :returns: the playback position in nanoseconds 
             :rtype: int
         """
-        return self._engine.get_position()
+        return self.clock.get_position()
 
     def get_time(self):
         """
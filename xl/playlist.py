@@ -34,6 +34,7 @@ import cgi
 from collections import namedtuple
 from datetime import datetime, timedelta
 from gi.repository import Gio
+import json
 import logging
 import os
 import random
@@ -853,6 +854,127 @@ class XSPFConverter(FormatConverter):
         return playlist
 providers.register('playlist-format-converter', XSPFConverter())
 
+class _ShuffleIndex(object):
+    """
+        Positions of a playlist that were not played yet in the current
+        shuffle run, and the positions of the tracks of each album, so
+        that picking a random track or album takes constant time.
+
+        The index is kept up to date as tracks are played and appended;
+        other changes to the playlist discard it. The album part is only
+        built once it is needed.
+    """
+    def __init__(self, played):
+        """
+            :param played: for each position, whether it is in the
+                shuffle history
+        """
+        self.size = len(played)
+        self.remaining = [i for i, p in enumerate(played) if not p]
+        self.slots = dict((i, slot) for slot, i in enumerate(self.remaining))
+        # position -> album key, None until build_albums is called
+        self.album_keys = None
+        # album key -> positions, ascending
+        self.albums = {}
+        # album key -> number of remaining positions
+        self.album_remaining = {}
+        # keys of albums with remaining positions, and their slots
+        self.album_choices = []
+        self.album_slots = {}
+
+    @staticmethod
+    def get_album_key(track):
+        album = track.get_tag_raw('album')
+        return tuple(album) if album else None
+
+    def build_albums(self, tracks):
+        self.album_keys = []
+        self.albums = {}
+        self.album_remaining = {}
+        self.album_choices = []
+        self.album_slots = {}
+        slots = self.slots
+        for i, track in enumerate(tracks):
+            key = self.__add_album(i, track)
+            if i in slots:
+                self.__add_album_remaining(key)
+
+    def __add_album(self, position, track):
+        key = self.get_album_key(track)
+        self.album_keys.append(key)
+        try:
+            self.albums[key].append(position)
+        except KeyError:
+            self.albums[key] = [position]
+        return key
+
+    def __add_album_remaining(self, key):
+        if key is None:
+            return
+        count = self.album_remaining.get(key, 0)
+        self.album_remaining[key] = count + 1
+        if count == 0:
+            self.album_slots[key] = len(self.album_choices)
+            self.album_choices.append(key)
+
+    @staticmethod
+    def __swap_remove(items, slots, item):
+        """
+            Removes item from items in constant time, at the cost
+            of their order
+        """
+        slot = slots.pop(item)
+        last = items.pop()
+        if slot < len(items):
+            items[slot] = last
+            slots[last] = slot
+
+    def append(self, track, played):
+        position = self.size
+        self.size += 1
+        if self.album_keys is not None:
+            self.__add_album(position, track)
+        if not played:
+            self.mark_unplayed(position)
+
+    def mark_played(self, position):
+        if position not in self.slots:
+            return
+        self.__swap_remove(self.remaining, self.slots, position)
+        if self.album_keys is not None:
+            key = self.album_keys[position]
+            if key is not None:
+                self.album_remaining[key] -= 1
+                if not self.album_remaining[key]:
+                    del self.album_remaining[key]
+                    self.__swap_remove(self.album_choices, self.album_slots,
+                        key)
+
+    def mark_unplayed(self, position):
+        if position in self.slots:
+            return
+        self.slots[position] = len(self.remaining)
+        self.remaining.append(position)
+        if self.album_keys is not None:
+            self.__add_album_remaining(self.album_keys[position])
+
+    def choose_position(self):
+        """
+            Returns a random position that was not played yet, or -1
+        """
+        if not self.remaining:
+            return -1
+        return random.choice(self.remaining)
+
+    def choose_album(self):
+        """
+            Returns the key of a random album with positions that were
+            not played yet, or None
+        """
+        if not self.album_choices:
+            return None
+        return random.choice(self.album_choices)
+
 class Playlist(object):
     # TODO: how do we document events in sphinx?
     """
@@ -885,7 +1007,11 @@ class Playlist(object):
     dynamic_mode_names = [_('Dynamic _Off'), _('Dynamic by Similar _Artists')]
     save_attrs = ['shuffle_mode', 'repeat_mode', 'dynamic_mode',
             'current_position', 'name']
-    __playlist_format_version = [2, 0]
+    __playlist_format_version = [3, 0]
+    #: Tags stored for tracks which are not local files
+    __saved_tags = ('artist', 'album', 'tracknumber', 'title', 'genre', 'date')
+    #: Number of tracks per record when writing a whole playlist
+    __chunk_size = 1000
 
     def __init__(self, name, initial_tracks=[]):
         """
@@ -910,12 +1036,25 @@ class Playlist(object):
         #   Determines when the 'unsaved' indicator is shown to the user.
         self.__dirty = False
         self.__needs_save = False
+        # changes to the track list since the playlist was last written
+        # to __saved_location, as records for its append log. None if
+        # the next save has to rewrite the whole file.
+        self.__changes = None
+        self.__saved_location = None
+        # size and mtime of __saved_location after it was last written or
+        # read, to tell whether someone else changed it since
+        self.__saved_stamp = None
+        # number of records and tracks appended since the last rewrite
+        self.__log_size = 0
         self.__name = name
         self.__next_data = None
         self.__current_position = -1
         self.__spat_position = -1
         self.__shuffle_history_counter = 1 # start positive so we can
                                 # just do an if directly on the value
+        # see __get_shuffle_index
+        self.__shuffle_index = None
+        self.__album_tags_watched = False
         event.add_callback(self.on_playback_track_start,
                 "playback_track_start")
 
@@ -1040,8 +1179,31 @@ class Playlist(object):
                 self.__tracks.del_meta_key(i, "playlist_shuffle_history")
             except:
                 pass
+        self.__shuffle_index = None
+
+    def __get_shuffle_index(self, albums=False):
+        """
+            Returns the shuffle index of the playlist, building it if
+            it was discarded
+
+            :param albums: whether the album part of the index is needed
+        """
+        index = self.__shuffle_index
+        if index is None:
+            tracks = self.__tracks
+            index = self.__shuffle_index = _ShuffleIndex(
+                [tracks.get_meta_key(i, 'playlist_shuffle_history')
+                    for i in xrange(len(tracks))])
+        if albums and index.album_keys is None:
+            if not self.__album_tags_watched:
+                event.add_callback(self.on_track_tags_changed,
+                    'track_tags_changed')
+                event.add_callback(self.on_tracks_tags_changed,
+                    'tracks_tags_changed')
+                self.__album_tags_watched = True
+            index.build_albums(self.__tracks)
+        return index
 
-    @common.threaded
     def __fetch_dynamic_tracks(self):
         dynamic.MANAGER.populate_playlist(self)
 
@@ -1051,47 +1213,35 @@ class Playlist(object):
             on random_mode
         """
         if mode == "album":
-            # TODO: we really need proper album-level operations in
-            # xl.trax for this
-            try:
+            index = self.__get_shuffle_index(albums=True)
+            tracks = self.__tracks
+            if current_position != -1:
                 # Try and get the next track on the album
                 # NB If the user starts the playlist from the middle
                 # of the album some tracks of the album remain off the
                 # tracks_history, and the album can be selected again
                 # randomly from its first track
-                if current_position == -1:
-                    raise IndexError
-                curr = self[current_position]
-                t = [ x for i, x in enumerate(self) \
-                    if x.get_tag_raw('album') == curr.get_tag_raw('album') \
-                    and i > current_position ]
-                t = trax.sort_tracks(['discnumber', 'tracknumber'], t)
-                return self.__tracks.index(t[0]), t[0]
-
-            except IndexError: #Pick a new album
-                hist = set(self.get_shuffle_history())
-                albums = set()
-                for i, x in enumerate(self):
-                    if (i, x) in hist:
-                        continue
-                    alb = x.get_tag_raw('album')
-                    if alb:
-                        albums.add(tuple(alb))
-                if not albums:
-                    return -1, None
-                album = list(random.choice(list(albums)))
-                t = [ x for x in self if x.get_tag_raw('album') == album ]
-                t = trax.sort_tracks(['tracknumber'], t)
-                return self.__tracks.index(t[0]), t[0]
+                key = index.album_keys[current_position]
+                t = [(tracks[i], i) for i in index.albums[key]
+                    if i > current_position]
+                if t:
+                    t = trax.sort_tracks(['discnumber', 'tracknumber'], t,
+                        trackfunc=lambda x: x[0])
+                    return t[0][1], t[0][0]
+
+            # Pick a new album
+            key = index.choose_album()
+            if key is None:
+                return -1, None
+            t = [(tracks[i], i) for i in index.albums[key]]
+            t = trax.sort_tracks(['tracknumber'], t, trackfunc=lambda x: x[0])
+            return t[0][1], t[0][0]
         else:
-            hist = set([ i for i, tr in self.get_shuffle_history() ])
-            try:
-                return random.choice([ (i, self.__tracks[i]) for i, tr in enumerate(self.__tracks)
-                        if i not in hist])
-            except IndexError: # no more tracks
+            i = self.__get_shuffle_index().choose_position()
+            if i == -1: # no more tracks
                 return -1, None
-                
-    
+            return i, self.__tracks[i]
+
     def __get_next(self, current_position):
         
         # don't recalculate
@@ -1115,6 +1265,8 @@ class Playlist(object):
                 self.__tracks.set_meta_key(current_position,
                         "playlist_shuffle_history", self.__shuffle_history_counter)
                 self.__shuffle_history_counter += 1
+                if self.__shuffle_index is not None:
+                    self.__shuffle_index.mark_played(current_position)
             next_index, next = self.__next_random_track(current_position, shuffle_mode)
             if next is not None:
                 self.__next_data = (None, next_index)
@@ -1198,6 +1350,8 @@ class Playlist(object):
             except IndexError:
                 return self.get_current()
             self.__tracks.del_meta_key(prev_index, 'playlist_shuffle_history')
+            if self.__shuffle_index is not None:
+                self.__shuffle_index.mark_unplayed(prev_index)
             self.current_position = prev_index
         else:
             position = self.current_position - 1
@@ -1352,56 +1506,113 @@ class Playlist(object):
         l.metadata = [x[1] for x in data]
         self[:] = l
 
-    # TODO[0.4?]: drop our custom disk playlist format in favor of an
-    # extended XSPF playlist (using xml namespaces?).
-
     # TODO: add timeout saving support. 5-10 seconds after last change,
     # perhaps?
 
+    # Playlists are stored as a header line followed by one JSON record
+    # per line:
+    #   ["tracks", [entry, ...]]     appends tracks, written on a rewrite
+    #   ["add", index, [entry, ...]] inserts tracks at index
+    #   ["del", start, end]          removes the tracks in [start:end]
+    #   ["attrs", {name: value}]     sets playlist attributes
+    # where each entry is [uri] or, for tracks which are not local
+    # files, [uri, {tag: value}]. Changes to the playlist are appended
+    # to the file, which is rewritten once the appended records outgrow
+    # the playlist.
+
+    def __track_entry(self, track):
+        """
+            Returns the record entry for a track
+        """
+        loc = track.get_loc_for_io()
+        if loc.startswith('file:'):
+            return [loc]
+        meta = {}
+        for tag in self.__saved_tags:
+            value = track.get_tag_raw(tag)
+            if value is not None:
+                # FIXME: This should join multiple values.
+                meta[tag] = value[0]
+        return [loc, meta]
+
+    def __record_change(self, record):
+        """
+            Adds a record to the append log of the next save
+        """
+        if self.__changes is not None:
+            self.__changes.append(record)
+
+    @staticmethod
+    def __write_record(f, record):
+        f.write(json.dumps(record, separators=(',', ':')))
+        f.write('\n')
+
+    @staticmethod
+    def __file_stamp(location):
+        """
+            Returns the size and mtime of a file, None if it is missing
+        """
+        try:
+            st = os.stat(location)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime)
+
     def save_to_location(self, location):
         """
             Writes the content of the playlist to a given location
 
+            Only the changes since the last save are written if the
+            playlist was last saved to or loaded from the same location.
+
             :param location: the location to save to
             :type location: string
         """
-        if os.path.exists(location):
-            f = open(location + ".new", "w")
-        else:
-            f = open(location, "w")
-        for track in self.__tracks:
-            buffer = track.get_loc_for_io()
-            # write track metadata
-            meta = {}
-            items = ('artist', 'album', 'tracknumber',
-                    'title', 'genre', 'date')
-            for item in items:
-                value = track.get_tag_raw(item)
-                if value is not None:
-                    # FIXME: This should join multiple values.
-                    v = value[0]
-                    if isinstance(v, unicode):
-                        v = v.encode('utf-8')
-                    meta[item] = v
-            buffer += '\t%s\n' % urllib.urlencode(meta)
-            try:
-                f.write(buffer.encode('utf-8'))
-            except UnicodeDecodeError:
-                continue
-
-        f.write("EOF\n")
+        attrs = {}
         for item in self.save_attrs:
-            val = getattr(self, item)
-            try:
-                strn = settings.MANAGER._val_to_str(val)
-            except ValueError:
-                strn = ""
+            attrs[item] = getattr(self, item)
+
+        changes = self.__changes
+        if changes is not None and location == self.__saved_location \
+                and self.__file_stamp(location) == self.__saved_stamp:
+            log_size = self.__log_size + 1
+            for record in changes:
+                log_size += len(record[2]) if record[0] == 'add' else 1
+            if log_size <= len(self.__tracks):
+                with open(location, 'r+b') as f:
+                    # don't glue the first record to a partial line
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != '\n':
+                        f.seek(0, os.SEEK_END)
+                        f.write('\n')
+                    f.seek(0, os.SEEK_END)
+                    for record in changes:
+                        self.__write_record(f, record)
+                    self.__write_record(f, ['attrs', attrs])
+                self.__changes = []
+                self.__saved_stamp = self.__file_stamp(location)
+                self.__log_size = log_size
+                self.__needs_save = self.__dirty = False
+                return
 
-            f.write("%s=%s\n"%(item,strn))
-        f.close()
-        if os.path.exists(location + ".new"):
+        with open(location + ".new", 'wb') as f:
+            self.__write_record(f, ['exaile-playlist',
+                self.__playlist_format_version])
+            tracks = self.__tracks
+            entry = self.__track_entry
+            for start in xrange(0, len(tracks), self.__chunk_size):
+                self.__write_record(f, ['tracks', [entry(track) for track
+                    in tracks[start:start + self.__chunk_size]]])
+            self.__write_record(f, ['attrs', attrs])
+
+        if os.path.exists(location):
             os.remove(location)
-            os.rename(location + ".new", location)
+        os.rename(location + ".new", location)
+
+        self.__changes = []
+        self.__saved_location = location
+        self.__saved_stamp = self.__file_stamp(location)
+        self.__log_size = 0
         self.__needs_save = self.__dirty = False
 
     def load_from_location(self, location):
@@ -1423,12 +1634,103 @@ class Playlist(object):
                 pass
         if not f:
             return
-        locs = []
-        while True:
+
+        with f:
             line = f.readline()
-            if line == "EOF\n" or line == "":
+            if line.startswith('["exaile-playlist"'):
+                ver = json.loads(line)[1]
+                if ver[0] > self.__playlist_format_version[0]:
+                    raise IOError("Cannot load playlist, unknown format")
+                elif ver > self.__playlist_format_version:
+                    logger.warning("Playlist created on a newer Exaile version, some attributes may not be handled.")
+                entries, items, damaged = self.__read_records(f)
+                # appended records would be lost behind a damaged one
+                saved = loc == location and not damaged
+            else:
+                entries, items = self.__read_legacy(f, line)
+                saved = False
+
+        trs = trax.Track.from_uris([entry[0] for entry in entries])
+        for track, entry in zip(trs, entries):
+            # readd meta
+            if len(entry) > 1 and not track.is_local():
+                for k, v in entry[1].iteritems():
+                    track.set_tag_raw(k, v, notify_changed=False)
+
+        self.__tracks[:] = trs
+        self.__shuffle_index = None
+
+        for item, val in items.iteritems():
+            if item in self.save_attrs:
+                try:
+                    setattr(self, item, val)
+                except TypeError: # don't bail if we try to set an invalid mode
+                    logger.debug("Got a TypeError when trying to set attribute %s to %s during playlist restore." % (item, val))
+
+        # Only append to files in the current format
+        if saved:
+            self.__changes = []
+            self.__saved_location = location
+            self.__saved_stamp = self.__file_stamp(location)
+        else:
+            self.__changes = None
+
+    def __read_records(self, f):
+        """
+            Replays the records of a playlist file
+
+            :returns: the track entries, the playlist attributes and
+                whether the file ends with a damaged record
+        """
+        entries = []
+        items = {}
+        log_size = 0
+        damaged = False
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # most likely a save got interrupted, and the records
+                # after it don't apply to what was read so far
+                logger.warning("Ignoring playlist records after a damaged one")
+                damaged = True
                 break
-            locs.append(line.strip())
+            op = record[0]
+            if op == 'tracks':
+                entries.extend(record[1])
+                continue
+            elif op == 'add':
+                entries[record[1]:record[1]] = record[2]
+                log_size += len(record[2])
+            elif op == 'del':
+                del entries[record[1]:record[2]]
+                log_size += 1
+            elif op == 'attrs':
+                items.update(record[1])
+                log_size += 1
+        self.__log_size = log_size
+        return entries, items, damaged
+
+    def __read_legacy(self, f, line):
+        """
+            Reads a playlist file written before format version 3
+
+            :param line: the first line of the file
+            :returns: the track entries and the playlist attributes
+        """
+        entries = []
+        while line != "EOF\n" and line != "":
+            loc = line.strip()
+            if loc.find('\t') > -1:
+                splitted = loc.split('\t')
+                loc = "\t".join(splitted[:-1])
+                meta = dict((k, v[0].decode('utf-8')) for k, v
+                    in cgi.parse_qs(splitted[-1]).iteritems())
+                entries.append([loc, meta])
+            else:
+                entries.append([loc])
+            line = f.readline()
+
         items = {}
         while True:
             line = f.readline()
@@ -1447,42 +1749,7 @@ class Playlist(object):
         if ver[0] == 1:
             if items.get("repeat_mode") == "playlist":
                 items['repeat_mode'] = "all"
-        elif ver[0] > self.__playlist_format_version[0]:
-            raise IOError("Cannot load playlist, unknown format")
-        elif ver > self.__playlist_format_version:
-            logger.warning("Playlist created on a newer Exaile version, some attributes may not be handled.")
-        f.close()
-
-        trs = []
-
-        for loc in locs:
-            meta = None
-            if loc.find('\t') > -1:
-                splitted = loc.split('\t')
-                loc = "\t".join(splitted[:-1])
-                meta = splitted[-1]
-
-            track = None
-            track = trax.Track(uri=loc)
-
-            # readd meta
-            if not track: continue
-            if not track.is_local() and meta is not None:
-                meta = cgi.parse_qs(meta)
-                for k, v in meta.iteritems():
-                    track.set_tag_raw(k, v[0].decode('utf-8'), notify_changed=False)
-
-            trs.append(track)
-
-        self.__tracks[:] = trs
-
-
-        for item, val in items.iteritems():
-            if item in self.save_attrs:
-                try:
-                    setattr(self, item, val)
-                except TypeError: # don't bail if we try to set an invalid mode
-                    logger.debug("Got a TypeError when trying to set attribute %s to %s during playlist restore." % (item, val))
+        return entries, items
 
     def reverse(self):
         # reverses current view
@@ -1541,7 +1808,23 @@ class Playlist(object):
             if step != 1:
                 if len(value) != len(oldtracks):
                     raise ValueError("Extended slice assignment must match sizes.")
+                self.__changes = None
+            else:
+                if end > start:
+                    self.__record_change(['del', start, end])
+                if value:
+                    self.__record_change(['add', start,
+                        [self.__track_entry(x) for x in value]])
             self.__tracks.__setitem__(i, value)
+
+            index = self.__shuffle_index
+            if index is not None:
+                if step == 1 and start == end == index.size:
+                    for x, meta in zip(value, metadata):
+                        index.append(x, meta and
+                            meta.get('playlist_shuffle_history'))
+                else:
+                    self.__shuffle_index = None
             removed = MetadataList(zip(range(start, end, step), oldtracks),
                     oldtracks.metadata)
             if step == 1:
@@ -1552,6 +1835,10 @@ class Playlist(object):
             if not isinstance(value, trax.Track):
                 raise ValueError("Need trax.Track object, got %r" % type(value))
             self.__tracks[i] = value
+            j = i + len(self.__tracks) if i < 0 else i
+            self.__record_change(['del', j, j + 1])
+            self.__record_change(['add', j, [self.__track_entry(value)]])
+            self.__shuffle_index = None
             removed = [(i, oldtracks)]
             added = [(i, value)]
 
@@ -1571,12 +1858,19 @@ class Playlist(object):
         oldtracks = self.__getitem__(i)
         oldpos = self.current_position
         self.__tracks.__delitem__(i)
+        self.__shuffle_index = None
         removed = MetadataList()
 
         if isinstance(i, slice):
             removed = MetadataList(zip(xrange(start, end, step), oldtracks),
                     oldtracks.metadata)
+            if step != 1:
+                self.__changes = None
+            elif end > start:
+                self.__record_change(['del', start, end])
         else:
+            j = i + len(self.__tracks) + 1 if i < 0 else i
+            self.__record_change(['del', j, j + 1])
             removed = [(i, oldtracks)]
 
         self.on_tracks_changed()
@@ -1640,6 +1934,16 @@ class Playlist(object):
             if self.dynamic_mode != 'disabled':
                 self.__fetch_dynamic_tracks()
 
+    def on_track_tags_changed(self, type, track, tag):
+        if tag == 'album' and self.__shuffle_index is not None:
+            self.__shuffle_index.album_keys = None
+
+    def on_tracks_tags_changed(self, type, obj, changes):
+        for track, tag in changes:
+            if tag == 'album':
+                self.on_track_tags_changed(type, track, tag)
+                break
+
     def on_tracks_changed(self, *args):
         for idx in xrange(len(self.__tracks)):
             if self.__tracks.get_meta_key(idx, "playlist_current_position"):
@@ -1946,13 +2250,21 @@ class SmartPlaylist(object):
 class PlaylistManager(object):
     """
         Manages saving and loading of playlists
+
+        EVENTS:
+            * playlist_manager_loaded
+                * fired: after the names of the playlists are read
     """
-    def __init__(self, playlist_dir='playlists', playlist_class=Playlist):
+    def __init__(self, playlist_dir='playlists', playlist_class=Playlist,
+            load=True):
         """
             Initializes the playlist manager
 
             @param playlist_dir: the data dir to save playlists to
             @param playlist_class: the playlist class to use
+            @param load: whether to read the playlist names right away.
+                Otherwise they are read by load_names(), or when they
+                are first needed.
         """
         self.playlist_class = playlist_class
         self.playlist_dir = os.path.join(xdg.get_data_dirs()[0],playlist_dir)
@@ -1960,12 +2272,19 @@ class PlaylistManager(object):
             os.makedirs(self.playlist_dir)
         self.order_file = os.path.join(self.playlist_dir, 'order_file')
         self.playlists = []
-        self.load_names()
+        self.loaded = False
+        if load:
+            self.load_names()
+
+    def __ensure_loaded(self):
+        if not self.loaded:
+            self.load_names()
 
     def has_playlist_name(self, playlist_name):
         """
             Returns true if the manager has a playlist with the same name
         """
+        self.__ensure_loaded()
         return playlist_name in self.playlists
         
     def save_playlist(self, pl, overwrite=False):
@@ -1976,6 +2295,7 @@ class PlaylistManager(object):
             @param overwrite: Set to [True] if you wish to overwrite a
                 playlist should it happen to already exist
         """
+        self.__ensure_loaded()
         name = pl.name
         if overwrite or name not in self.playlists:
             pl.save_to_location(os.path.join(self.playlist_dir,
@@ -1997,6 +2317,7 @@ class PlaylistManager(object):
 
             @param name: the name of the playlist to remove
         """
+        self.__ensure_loaded()
         if name in self.playlists:
             try:
                 os.remove(os.path.join(self.playlist_dir,
@@ -2010,6 +2331,7 @@ class PlaylistManager(object):
         """
             Renames the playlist to new_name
         """
+        self.__ensure_loaded()
         old_name = playlist.name
         if old_name in self.playlists:
             self.remove_playlist(old_name)
@@ -2020,6 +2342,9 @@ class PlaylistManager(object):
         """
             Loads the names of the playlists from the order file
         """
+        if self.loaded:
+            return
+        self.loaded = True
         # collect the names of all playlists in playlist_dir
         existing = []
         for f in os.listdir(self.playlist_dir):
@@ -2038,12 +2363,15 @@ class PlaylistManager(object):
         else:
             self.playlists = existing
 
+        event.log_event('playlist_manager_loaded', self, None)
+
     def get_playlist(self, name):
         """
             Gets a playlist by name
 
             @param name: the name of the playlist you wish to retrieve
         """
+        self.__ensure_loaded()
         if name in self.playlists:
             pl = self.playlist_class(name=name)
             pl.load_from_location(os.path.join(self.playlist_dir,
@@ -2056,12 +2384,14 @@ class PlaylistManager(object):
         """
             Returns all the contained playlist names
         """
+        self.__ensure_loaded()
         return self.playlists[:]
 
     def move(self, playlist, position, after = True):
         """
             Moves the playlist to where position is
         """
+        self.__ensure_loaded()
         #Remove the playlist first
         playlist_index = self.playlists.index(playlist)
         self.playlists.pop(playlist_index)
@@ -2075,6 +2405,8 @@ class PlaylistManager(object):
         """
             Saves the order to the order file
         """
+        if not self.loaded:
+            return
         self.save_to_location(self.order_file)
 
     def save_to_location(self, location):
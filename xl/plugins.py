@@ -26,6 +26,7 @@
 
 import imp
 import inspect
+import json
 import logging
 import os
 import shutil
@@ -36,7 +37,9 @@ from xl.nls import gettext as _
 from xl import ( 
     common, 
     event,
+    providers,
     settings,
+    startup_profile,
     xdg
 )
 
@@ -46,7 +49,28 @@ class InvalidPluginError(Exception):
     def __str__(self):
         return str(self.args[0])
 
+class PanelPlaceholder(object):
+    '''
+        Stands in for the panel of a plugin that is activated when its
+        panel is shown. Registered as a 'main-panel-placeholder' provider.
+    '''
+    def __init__(self, name, label, plugin):
+        self.name = name        # name of the panel provider of the plugin
+        self.label = label
+        self.plugin = plugin
+
 class PluginsManager(object):
+    #: Activation triggers that plugins can declare in PLUGININFO, and the
+    #: events that fire them. ('panel', name, label) is also supported.
+    activation_events = {
+        'gui_loaded': 'gui_loaded',
+        'playback': 'playback_player_start',
+    }
+
+    #: Categories of plugins that are enabled before the main window is
+    #: shown at startup. Other plugins are enabled once it is on screen.
+    early_categories = ('GUI', 'Media Sources', 'Output', 'Effect')
+
     def __init__(self, exaile, load=True):
         self.plugindirs = [ os.path.join(p, 'plugins') \
                 for p in xdg.get_data_dirs() ]
@@ -63,6 +87,17 @@ class PluginsManager(object):
 
         self.exaile = exaile
         self.enabled_plugins = {}
+        # enabled plugins that have not been enabled in this session yet
+        self.deferred_plugins = []
+        # enabled plugins waiting for their activation trigger
+        self.inactive_plugins = {}
+        self.placeholders = {}
+        self._activation_callbacks = {}
+
+        self.manifest_location = os.path.join(xdg.get_cache_dir(),
+                'plugins.manifest')
+        self.manifest = self.__load_manifest()
+        self._info_cache = {}
 
         self.load = load
 
@@ -117,7 +152,7 @@ class PluginsManager(object):
         '''Sets up a new-style plugin. See helloworld plugin for details'''
         
         if hasattr(plugin, 'on_gui_loaded'):
-            if self.exaile.loading:
+            if self.exaile.loading and getattr(self.exaile, 'gui', None) is None:
                 event.add_ui_callback(self.__on_new_plugin_loaded, 'gui_loaded',
                                    None, plugin.on_gui_loaded)
             else:
@@ -142,12 +177,16 @@ class PluginsManager(object):
 
     def enable_plugin(self, pluginname):
         try:
-            plugin = self.load_plugin(pluginname)
-            if not plugin: raise Exception("Error loading plugin")
-            plugin.enable(self.exaile)
-            if not inspect.ismodule(plugin):
-                self.__enable_new_plugin(plugin)
+            with startup_profile.phase('plugin %s' % pluginname):
+                plugin = self.load_plugin(pluginname)
+                if not plugin: raise Exception("Error loading plugin")
+                plugin.enable(self.exaile)
+                if not inspect.ismodule(plugin):
+                    self.__enable_new_plugin(plugin)
             self.enabled_plugins[pluginname] = plugin
+            if pluginname in self.deferred_plugins:
+                self.deferred_plugins.remove(pluginname)
+            self.inactive_plugins.pop(pluginname, None)
             logger.debug("Loaded plugin %s" % pluginname)
             self.save_enabled()
         except Exception as e:
@@ -159,6 +198,15 @@ class PluginsManager(object):
             plugin = self.enabled_plugins[pluginname]
             del self.enabled_plugins[pluginname]
         except KeyError:
+            if pluginname in self.inactive_plugins:
+                del self.inactive_plugins[pluginname]
+                self.__remove_trigger(pluginname)
+                self.save_enabled()
+                return True
+            if pluginname in self.deferred_plugins:
+                self.deferred_plugins.remove(pluginname)
+                self.save_enabled()
+                return True
             logger.exception("Plugin not found, possibly already disabled")
             return False
         try:
@@ -171,14 +219,23 @@ class PluginsManager(object):
         return True
 
     def list_installed_plugins(self):
+        dirs = self.manifest['dirs']
         pluginlist = []
         for dir in self.plugindirs:
-            if os.path.exists(dir):
-                for file in os.listdir(dir):
-                    if file not in pluginlist and \
-                            os.path.isdir(os.path.join(dir, file)) and \
-                            file != '__pycache__':
-                        pluginlist.append(file)
+            try:
+                mtime = os.path.getmtime(dir)
+            except OSError:
+                continue
+            cached = dirs.get(dir)
+            if cached is None or cached[0] != mtime:
+                names = [file for file in os.listdir(dir)
+                        if os.path.isdir(os.path.join(dir, file)) and
+                        file != '__pycache__']
+                cached = dirs[dir] = [mtime, names]
+                self.__save_manifest()
+            for file in cached[1]:
+                if file not in pluginlist:
+                    pluginlist.append(file)
         return pluginlist
 
     def list_available_plugins(self):
@@ -188,17 +245,63 @@ class PluginsManager(object):
         pass
 
     def get_plugin_info(self, pluginname):
-        path = os.path.join(self.__findplugin(pluginname), 'PLUGININFO')
-        f = open(path)
+        '''
+            Returns the contents of the PLUGININFO of a plugin as a dict.
+            The file is only read again once it or the directory of the
+            plugin has changed.
+        '''
+        plugindir = self.__findplugin(pluginname)
+        path = os.path.join(plugindir, 'PLUGININFO')
+        stamp = [plugindir, os.path.getmtime(plugindir),
+                os.path.getmtime(path)]
+
+        cached = self._info_cache.get(pluginname)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        entry = self.manifest['plugins'].get(pluginname)
+        if entry is None or entry[0] != stamp:
+            raw = {}
+            with open(path) as f:
+                for line in f:
+                    try:
+                        key, val = line.split("=",1)
+                        raw[key] = val.decode('utf-8')
+                    except ValueError:
+                        pass # this happens on blank lines
+            entry = self.manifest['plugins'][pluginname] = [stamp, raw]
+            self.__save_manifest()
+
         infodict = {}
-        for line in f:
-            try:
-                key, val = line.split("=",1)
-                # restricted eval - no bult-in funcs. marginally more secure.
-                infodict[key] = eval(val, {'__builtins__': None, '_': _}, {})
-            except ValueError:
-                pass # this happens on blank lines
+        for key, val in entry[1].iteritems():
+            # restricted eval - no bult-in funcs. marginally more secure.
+            infodict[key] = eval(val.encode('utf-8'),
+                    {'__builtins__': None, '_': _}, {})
+        self._info_cache[pluginname] = (stamp, infodict)
         return infodict
+
+    def __load_manifest(self):
+        '''
+            Reads the cached PLUGININFO contents and plugin directory
+            listings
+        '''
+        try:
+            with open(self.manifest_location) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == 1:
+                return manifest
+        except (IOError, ValueError):
+            pass
+        return {'version': 1, 'dirs': {}, 'plugins': {}}
+
+    @common.glib_wait(1000)
+    def __save_manifest(self):
+        try:
+            with open(self.manifest_location + '.new', 'w') as f:
+                json.dump(self.manifest, f)
+            os.rename(self.manifest_location + '.new', self.manifest_location)
+        except (IOError, OSError):
+            logger.exception("Could not save the plugin manifest")
     
     def is_compatible(self, info):
         '''
@@ -268,15 +371,118 @@ class PluginsManager(object):
 
     def save_enabled(self):
         if self.load:
-            settings.set_option("plugins/enabled", self.enabled_plugins.keys())
+            settings.set_option("plugins/enabled",
+                    self.enabled_plugins.keys() + self.deferred_plugins +
+                    self.inactive_plugins.keys())
+
+    def get_activation_trigger(self, pluginname):
+        '''
+            Returns the Activation trigger that the PLUGININFO of a plugin
+            declares, or None if it is activated as soon as it's enabled
+        '''
+        try:
+            trigger = self.get_plugin_info(pluginname).get('Activation')
+        except Exception:
+            return None
+        if trigger in self.activation_events:
+            return trigger
+        if isinstance(trigger, tuple) and len(trigger) == 3 and \
+                trigger[0] == 'panel':
+            return trigger
+        if trigger is not None:
+            logger.warning("Unknown activation trigger %r of plugin %s",
+                    trigger, pluginname)
+        return None
+
+    def activate_plugin(self, pluginname):
+        '''
+            Enables a plugin that is waiting for its activation trigger.
+            Plugins are not activated before exaile is done loading.
+        '''
+        if pluginname not in self.inactive_plugins:
+            return
+        if self.exaile.loading:
+            self.__wait_for_event(pluginname, 'exaile_loaded')
+            return
+        try:
+            self.enable_plugin(pluginname)
+        except Exception:
+            self.inactive_plugins.pop(pluginname, None)
+        self.__remove_trigger(pluginname)
+
+    def __wait_for_trigger(self, pluginname, trigger):
+        self.inactive_plugins[pluginname] = trigger
+        if isinstance(trigger, tuple):
+            placeholder = PanelPlaceholder(trigger[1], trigger[2], pluginname)
+            self.placeholders[pluginname] = placeholder
+            providers.register('main-panel-placeholder', placeholder)
+        else:
+            self.__wait_for_event(pluginname, self.activation_events[trigger])
+
+    def __wait_for_event(self, pluginname, eventname):
+        self.__remove_callback(pluginname)
+        self._activation_callbacks[pluginname] = event.add_ui_callback(
+                self.__on_activation_event, eventname, None, pluginname)
+
+    def __on_activation_event(self, eventname, obj, data, pluginname):
+        self.__remove_callback(pluginname)
+        self.activate_plugin(pluginname)
+
+    def __remove_callback(self, pluginname):
+        remove = self._activation_callbacks.pop(pluginname, None)
+        if remove is not None:
+            remove()
 
-    def load_enabled(self):
-        to_enable = settings.get_option("plugins/enabled", [])
+    def __remove_trigger(self, pluginname):
+        self.__remove_callback(pluginname)
+        placeholder = self.placeholders.pop(pluginname, None)
+        if placeholder is not None:
+            providers.unregister('main-panel-placeholder', placeholder)
+
+    def is_deferrable(self, pluginname):
+        '''
+            Returns True if the plugin can be enabled after the main
+            window is shown at startup
+        '''
+        try:
+            info = self.get_plugin_info(pluginname)
+        except Exception:
+            return False
+        early = [_(category) for category in self.early_categories]
+        return info.get('Category') not in early
+
+    def load_enabled(self, deferred=None):
+        '''
+            Enables the plugins that were enabled in the last session
+
+            :param deferred: None enables all of them. False only enables
+                the plugins that are needed before the main window is
+                shown and remembers the others, which True enables.
+
+            Plugins declaring an Activation trigger in their PLUGININFO are
+            only imported once it fires.
+        '''
+        if deferred:
+            to_enable = self.deferred_plugins[:]
+        else:
+            to_enable = []
+            for plugin in settings.get_option("plugins/enabled", []):
+                trigger = self.get_activation_trigger(plugin)
+                if trigger is None:
+                    to_enable.append(plugin)
+                else:
+                    self.__wait_for_trigger(plugin, trigger)
+            if deferred is False:
+                self.deferred_plugins = [p for p in to_enable
+                        if self.is_deferrable(p)]
+                to_enable = [p for p in to_enable
+                        if p not in self.deferred_plugins]
         for plugin in to_enable:
             try:
                 self.enable_plugin(plugin)
             except:
-                pass
+                if plugin in self.deferred_plugins:
+                    self.deferred_plugins.remove(plugin)
 
 # vim: et sts=4 sw=4
 
@@ -34,15 +34,18 @@ from ConfigParser import (
     NoSectionError,
     NoOptionError
 )
+import copy
 import logging
 import os
 import sys
+import threading
 
 from gi.repository import GLib
 
 logger = logging.getLogger(__name__)
 
 from xl import event, xdg
+from xl import common
 from xl.common import VersionError, glib_wait, glib_wait_seconds
 from xl.nls import gettext as _
 
@@ -58,6 +61,8 @@ TYPE_MAPPING = {
 
 MANAGER = None
 
+_UNSET = object()
+
 class SettingsManager(RawConfigParser):
     """
         Manages Exaile's settings
@@ -83,6 +88,11 @@ class SettingsManager(RawConfigParser):
         self._saving = False
         self._dirty = False
 
+        # decoded option values, keyed by option path; options that are
+        # not set are stored as _UNSET so that misses are cached too
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
         if default_location is not None:
             try:
                 self.read(default_location)
@@ -175,19 +185,57 @@ class SettingsManager(RawConfigParser):
             :returns: the option value or *default*
             :rtype: any
         """
+        value = self._cache.get(option, _UNSET)
+        if value is _UNSET:
+            if option in self._cache:
+                return default
+            value = self._get_uncached(option)
+            if value is _UNSET:
+                return default
+
+        # lists and dicts are handed out as copies so that callers
+        # modifying them don't change the cached value
+        if isinstance(value, (list, dict)):
+            return copy.deepcopy(value)
+        return value
+
+    def _get_uncached(self, option):
+        """
+            Reads and decodes an option, storing the result in the cache
+
+            :returns: the option value or _UNSET
+        """
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
-        try:
-            value = self.get(section, key)
-            value = self._str_to_val(value)
-        except NoSectionError:
-            value = default
-        except NoOptionError:
-            value = default
+        with self._cache_lock:
+            try:
+                value = self._str_to_val(self.get(section, key))
+            except (NoSectionError, NoOptionError):
+                value = _UNSET
+            self._cache[option] = value
 
         return value
 
+    def set(self, section, option, value=None):
+        """
+            Sets a raw option value, invalidating the cached values
+        """
+        # Option names are case insensitive, so the whole cache is
+        # dropped rather than trying to find every alias of the option
+        with self._cache_lock:
+            RawConfigParser.set(self, section, option, value)
+            self._cache.clear()
+
+    def remove_section(self, section):
+        """
+            Removes a section, invalidating the cached values
+        """
+        with self._cache_lock:
+            removed = RawConfigParser.remove_section(self, section)
+            self._cache.clear()
+        return removed
+
     def has_option(self, option):
         """
             Returns information about the existence
@@ -214,7 +262,12 @@ class SettingsManager(RawConfigParser):
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
-        RawConfigParser.remove_option(self, section, key)
+        with self._cache_lock:
+            removed = RawConfigParser.remove_option(self, section, key)
+            self._cache.clear()
+
+        if removed:
+            self._dirty = True
 
     def _set_direct(self, option, value):
         """
@@ -297,35 +350,64 @@ class SettingsManager(RawConfigParser):
             return
 
         self._saving = True
+        # cleared before writing, so that changes made while the file is
+        # written cause another save
+        self._dirty = False
 
         logger.debug("Saving settings...")
 
-        with open(self.location + ".new", 'w') as f:
-            self.write(f)
-
-            try:
-                # make it readable by current user only, to protect private data
-                os.fchmod(f.fileno(), 384)
-            except:
-                pass # fail gracefully, eg if on windows
-
-            f.flush()
-
         try:
-            os.rename(self.location, self.location + ".old")
+            with open(self.location + ".new", 'w') as f:
+                self.write(f)
+
+                try:
+                    # make it readable by current user only, to protect private data
+                    os.fchmod(f.fileno(), 384)
+                except:
+                    pass # fail gracefully, eg if on windows
+
+                f.flush()
+                os.fsync(f.fileno())
+
+            if os.name == 'nt':
+                # windows refuses to rename over an existing file
+                try:
+                    os.rename(self.location, self.location + ".old")
+                except:
+                    pass # if it doesn't exist we don't care
+
+                os.rename(self.location + ".new", self.location)
+
+                try:
+                    os.remove(self.location + ".old")
+                except:
+                    pass
+            else:
+                os.rename(self.location + ".new", self.location)
         except:
-            pass # if it doesn'texist we don't care
+            self._dirty = True
+            raise
+        finally:
+            self._saving = False
 
-        os.rename(self.location + ".new", self.location)
 
-        try:
-            os.remove(self.location + ".old")
-        except:
-            pass
+class OptionHandle(object):
+    """
+        Keeps the current value of a single option in its
+        :attr:`value` attribute, for code that reads an option
+        too often to look it up each time.
+
+        Call :meth:`unsubscribe` when the handle is no longer needed.
+
+        :param option: the full path to an option
+        :param default: the value to use while the option is not set
+    """
+    def __init__(self, option, default=None):
+        self.option = option
+        self.value = default
+        self.unsubscribe = common.subscribe_for_settings(
+            option.rsplit('/', 1)[0], {option: 'value'}, self)
 
-        self._saving = False
-        self._dirty = False
-        
 location = xdg.get_config_dir()
 
 
@@ -0,0 +1,133 @@
+# Copyright (C) 2008-2010 Adam Olsen
+# Copyright (C) 2015 Dustin Spicuzza
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Records how long each phase of exaile's startup takes.
+
+    Phases are timed with :func:`phase`, which does nothing unless the
+    profiler was started with ``--startup-profile``. The timeline is
+    written in the Trace Event format, so it can be viewed with
+    chrome://tracing or any other viewer of that format.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+__all__ = ['PROFILER', 'phase']
+
+
+def _cpu_time():
+    user, system = os.times()[:2]
+    return user + system
+
+
+class StartupProfiler(object):
+    """
+        Collects the wall and CPU time of startup phases
+    """
+    def __init__(self):
+        self.enabled = False
+        self.location = None
+        self.origin = None
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def start(self, location):
+        """
+            Starts recording phases, which are written to location
+            by :meth:`finish`
+        """
+        self.enabled = True
+        self.location = location
+        self.origin = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        """
+            Context manager recording the time spent in its body
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        cpu = _cpu_time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time() - start, _cpu_time() - cpu)
+
+    def add(self, name, start, wall, cpu):
+        """
+            Records a phase that began at start and took wall seconds,
+            cpu of which were spent on the CPU
+        """
+        with self._lock:
+            self.phases.append((name, start - self.origin, wall, cpu,
+                threading.current_thread().name))
+
+    def finish(self):
+        """
+            Writes the timeline and stops recording
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.add('startup', self.origin, time.time() - self.origin,
+            _cpu_time())
+
+        pid = os.getpid()
+        events = []
+        for name, start, wall, cpu, thread in self.phases:
+            events.append({
+                'name': name,
+                'ph': 'X',
+                'ts': int(start * 1000000),
+                'dur': int(wall * 1000000),
+                'pid': pid,
+                'tid': thread,
+                'args': {'cpu_ms': round(cpu * 1000, 1)},
+            })
+        with open(self.location, 'w') as f:
+            json.dump({'traceEvents': events}, f, indent=1)
+
+    def summary(self):
+        """
+            Returns the recorded phases as lines of text
+        """
+        return ['%8.1f ms wall %8.1f ms cpu  %s' % (wall * 1000, cpu * 1000,
+            name) for name, start, wall, cpu, thread in self.phases]
+
+
+#: The profiler of this process
+PROFILER = StartupProfiler()
+
+phase = PROFILER.phase
+
+# vim: et sts=4 sw=4
@@ -24,9 +24,18 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
+from collections import deque
+from gi.repository import Gio
 from gi.repository import Gst
+import logging
+import multiprocessing
+import os
+import threading
 
 from xl.nls import gettext as _
+from xl import trax
+
+logger = logging.getLogger(__name__)
 
 """
     explanation of format dicts:
@@ -143,6 +152,7 @@ class Transcoder(object):
         self.input = None
         self.output = None
         self.encoder = None
+        self.raw_encoder = None
         self.pipe = None
         self.bus = None
         self.running = False
@@ -160,10 +170,20 @@ class Transcoder(object):
             self.quality = value
 
     def _construct_encoder(self):
+        if self.raw_encoder is not None:
+            self.encoder = self.raw_encoder
+            return
         fmt = FORMATS[self.dest_format]
         quality = self.quality
         self.encoder = fmt["command"]%quality
 
+    def set_raw_encoder(self, raw):
+        """
+            Uses the given pipeline description to encode, instead of
+            the command of the destination format
+        """
+        self.raw_encoder = raw
+
     def set_input(self, uri):
         self.input = """filesrc location="%s" """%uri
 
@@ -225,3 +245,223 @@ class Transcoder(object):
 
     def is_running(self):
         return self.running
+
+class TranscodeJob(object):
+    """
+        A single transcode run by a :class:`TranscodeQueue`
+
+        The state of a job is one of 'pending', 'running', 'done',
+        'failed' or 'cancelled'.
+    """
+    def __init__(self, output, path=None, raw_input=None, format=None,
+            quality=None, raw_encoder=None, tags=None, length=None):
+        """
+            :param output: the path of the file to write
+            :param path: the path of the file to transcode
+            :param raw_input: a GStreamer source description to read
+                from instead of path
+            :param format: the name of the format to encode to, see
+                :data:`FORMATS`
+            :param quality: a value from the raw_steps of the format;
+                the default of the format if None
+            :param raw_encoder: a GStreamer encoder description to use
+                instead of format
+            :param tags: dict of tags to write to the output once it
+                is complete
+            :param length: the length of the input in seconds, used to
+                report progress
+        """
+        self.output = output
+        self.path = path
+        self.raw_input = raw_input
+        self.format = format
+        self.quality = quality
+        self.raw_encoder = raw_encoder
+        self.tags = tags
+        self.length = length
+        self.state = 'pending'
+        self.transcoder = None
+
+    def _start(self, end_cb):
+        """
+            Starts the pipeline. end_cb is called with the job and
+            whether it succeeded.
+        """
+        tc = self.transcoder = Transcoder()
+        if self.raw_encoder is not None:
+            tc.set_raw_encoder(self.raw_encoder)
+        else:
+            tc.set_format(self.format)
+            if self.quality is not None:
+                tc.set_quality(self.quality)
+        if self.raw_input is not None:
+            tc.set_raw_input(self.raw_input)
+        else:
+            tc.set_input(self.path)
+        tc.set_output(self.output)
+        tc.end_cb = lambda: end_cb(self, True)
+        tc.error_cb = lambda: end_cb(self, False)
+        self.state = 'running'
+        tc.start_transcode()
+
+    def _finish(self):
+        """
+            Writes the tags to the completed output
+        """
+        if self.tags:
+            tr = trax.Track(Gio.File.new_for_path(self.output).get_uri())
+            for tag, values in self.tags.iteritems():
+                tr.set_tag_raw(tag, values)
+            if not tr.write_tags():
+                logger.warning("Could not write tags to %s", self.output)
+        self.state = 'done'
+
+    def _cancel(self):
+        """
+            Stops the pipeline and removes the partial output
+        """
+        self.state = 'cancelled'
+        tc = self.transcoder
+        if tc is not None and tc.pipe is not None:
+            tc.end_cb = tc.error_cb = None
+            tc.stop()
+            try:
+                os.remove(self.output)
+            except OSError:
+                pass
+
+    def get_progress(self):
+        """
+            Returns the fraction of the job that is done
+        """
+        if self.state == 'done':
+            return 1.0
+        if self.state != 'running' or not self.length:
+            return 0.0
+        return min(1.0, self.transcoder.get_time() / float(self.length))
+
+class TranscodeQueue(object):
+    """
+        Runs transcode jobs, several at a time.
+
+        Pipelines report back through their bus, so the GLib main loop
+        has to run while jobs are processed. Jobs may be added from any
+        thread, including from job_done_cb.
+    """
+    def __init__(self, workers=None):
+        """
+            :param workers: the number of jobs to run at the same time,
+                defaults to the number of CPUs
+        """
+        if workers is None:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        self.workers = max(1, workers)
+        self.jobs = []
+        #: Called with each job that finished, failed or not
+        self.job_done_cb = None
+        self.cancelled = False
+        self.__pending = deque()
+        self.__running = []
+        self.__lock = threading.RLock()
+        self.__finished = threading.Event()
+        self.__finished.set()
+
+    def add(self, job):
+        """
+            Queues a job, starting it right away if a worker is free
+
+            :param job: the :class:`TranscodeJob` to run
+        """
+        with self.__lock:
+            if self.cancelled:
+                job.state = 'cancelled'
+                return
+            self.jobs.append(job)
+            self.__pending.append(job)
+            self.__finished.clear()
+        self.__start_jobs()
+
+    def __start_jobs(self):
+        with self.__lock:
+            while self.__pending and len(self.__running) < self.workers:
+                job = self.__pending.popleft()
+                self.__running.append(job)
+                try:
+                    job._start(self.__on_job_end)
+                except Exception:
+                    logger.exception("Could not start transcoding %s",
+                        job.output)
+                    self.__running.remove(job)
+                    job.state = 'failed'
+            if not self.__pending and not self.__running:
+                self.__finished.set()
+
+    def __on_job_end(self, job, success):
+        with self.__lock:
+            if job not in self.__running:
+                return
+            self.__running.remove(job)
+
+        if success:
+            try:
+                job._finish()
+            except Exception:
+                logger.exception("Could not finish transcoding %s",
+                    job.output)
+                job.state = 'failed'
+        else:
+            logger.warning("Transcoding %s failed", job.output)
+            job.state = 'failed'
+
+        if self.job_done_cb is not None:
+            self.job_done_cb(job)
+        self.__start_jobs()
+
+    def cancel(self):
+        """
+            Stops all running jobs and drops the pending ones
+        """
+        with self.__lock:
+            self.cancelled = True
+            pending = list(self.__pending)
+            self.__pending.clear()
+            running = self.__running
+            self.__running = []
+        for job in pending:
+            job.state = 'cancelled'
+        for job in running:
+            job._cancel()
+        self.__finished.set()
+
+    def wait(self, timeout=None):
+        """
+            Blocks until all jobs are finished or the queue is cancelled.
+            Must not be called from the main loop.
+
+            :returns: whether all jobs are finished
+        """
+        return self.__finished.wait(timeout)
+
+    def get_progress(self, total_length=None):
+        """
+            Returns the fraction of the work that is done, weighting
+            each job by its length
+
+            :param total_length: the length to measure against, for
+                queues whose jobs are still being added. Defaults to
+                the length of all jobs added so far.
+        """
+        jobs = list(self.jobs)
+        if not jobs:
+            return 0.0
+        if all(job.length for job in jobs):
+            done = sum(job.get_progress() * job.length for job in jobs)
+            if total_length is None:
+                total_length = sum(job.length for job in jobs)
+        else:
+            done = sum(job.get_progress() for job in jobs)
+            total_length = len(jobs)
+        return min(1.0, done / float(total_length)) if total_length else 0.0
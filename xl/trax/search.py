@@ -24,11 +24,201 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
+import threading
 import time
 import re
 
+from xl import common
+
 __all__ = ['TracksMatcher', 'search_tracks']
 
+# compiled matchers of recent queries, keyed by
+# (search_string, case_sensitive, keyword_tags)
+_query_cache = common.LimitedCache(256)
+_query_cache_lock = threading.Lock()
+
+
+def _index_match(matcher, index):
+    """
+        Asks a matcher for its matching tracks in a :class:`TagIndex`.
+        Returns None for matchers that cannot be answered from an index.
+    """
+    index_match = getattr(matcher, 'index_match', None)
+    if index_match is None:
+        return None
+    return index_match(index)
+
+
+class TagIndex(object):
+    """
+        An inverted index from tag values to the tracks having them,
+        which lets :func:`search_tracks` answer most conditions without
+        looking at every track.
+
+        Values are stored the way :class:`_Matcher` sees them, that is as
+        returned by `Track.get_tag_search(tag, format=False)`, grouped
+        by their lower-cased form. A tag is only indexed once it is first
+        searched for, and is kept up to date from then on.
+
+        Readers must hold :attr:`lock` while using the returned values.
+
+        :param tracks: the tracks to index
+    """
+    # tags whose search value is derived from another tag
+    _derived_tags = {
+        'artist': ('albumartist',),
+        '__loc': ('__basename',),
+    }
+
+    def __init__(self, tracks=()):
+        self.lock = threading.RLock()
+        self.tracks = set(tracks)
+        self._values = {} # tag -> {folded value: {value: set of tracks}}
+        self._keys = {} # tag -> {track: [(folded value, value), ...]}
+        self._unindexable = set()
+
+    def reset(self, tracks):
+        """
+            Discards the index and starts over with the given tracks
+        """
+        with self.lock:
+            self.tracks = set(tracks)
+            self._values.clear()
+            self._keys.clear()
+            self._unindexable.clear()
+
+    def add(self, tracks):
+        """
+            Adds tracks to the index
+        """
+        with self.lock:
+            for track in tracks:
+                if track in self.tracks:
+                    continue
+                self.tracks.add(track)
+                for tag in self._values.keys():
+                    self._reindex(tag, track)
+
+    def remove(self, tracks):
+        """
+            Removes tracks from the index
+        """
+        with self.lock:
+            for track in tracks:
+                if track not in self.tracks:
+                    continue
+                self.tracks.discard(track)
+                for tag in self._values.keys():
+                    self._delete(tag, track)
+
+    def update(self, track, tag):
+        """
+            Updates the index after a tag of a track has changed
+        """
+        with self.lock:
+            if track not in self.tracks:
+                return
+            for t in (tag,) + self._derived_tags.get(tag, ()):
+                if t in self._values:
+                    self._delete(t, track)
+                    self._reindex(t, track)
+
+    def get_values(self, tag):
+        """
+            Returns the indexed values of a tag, as a dict of folded
+            value -> {value: set of tracks}, or None if the tag has values
+            that cannot be indexed.
+        """
+        with self.lock:
+            try:
+                return self._values[tag]
+            except KeyError:
+                pass
+            if tag in self._unindexable:
+                return None
+            self._values[tag] = {}
+            self._keys[tag] = {}
+            for track in self.tracks:
+                if not self._reindex(tag, track):
+                    return None
+            return self._values[tag]
+
+    def lookup(self, tag, value):
+        """
+            Returns the set of tracks having value for tag, ignoring case,
+            or None if the tag cannot be indexed.
+        """
+        try:
+            folded = value.lower()
+        except AttributeError:
+            folded = value
+        with self.lock:
+            values = self.get_values(tag)
+            if values is None:
+                return None
+            result = set()
+            for tracks in values.get(folded, {}).itervalues():
+                result.update(tracks)
+            return result
+
+    @staticmethod
+    def _search_keys(track, tag):
+        """
+            Returns the (folded value, value) pairs a matcher would test
+            for this track and tag. Mirrors :meth:`_Matcher.match`.
+        """
+        value = track.get_tag_search(tag, format=False)
+        if value == '__null__':
+            value = None
+        if tag.startswith("__"):
+            if isinstance(value, list):
+                value = tuple(value)
+            return [(value, value)]
+        if type(value) != list:
+            value = [value]
+        keys = []
+        for item in value:
+            try:
+                folded = item.lower()
+            except AttributeError:
+                folded = item
+            keys.append((folded, item))
+        return keys
+
+    def _reindex(self, tag, track):
+        """
+            Inserts a track into the index of a tag. Stops indexing the
+            tag if the value cannot be hashed.
+        """
+        keys = self._search_keys(track, tag)
+        values = self._values[tag]
+        try:
+            for folded, value in keys:
+                values.setdefault(folded, {}).setdefault(value,
+                        set()).add(track)
+        except TypeError:
+            del self._values[tag]
+            del self._keys[tag]
+            self._unindexable.add(tag)
+            return False
+        self._keys[tag][track] = keys
+        return True
+
+    def _delete(self, tag, track):
+        """
+            Removes a track from the index of a tag
+        """
+        values = self._values[tag]
+        for folded, value in self._keys[tag].pop(track, ()):
+            raws = values[folded]
+            tracks = raws[value]
+            tracks.discard(track)
+            if not tracks:
+                del raws[value]
+                if not raws:
+                    del values[folded]
+
+
 class SearchResultTrack(object):
     """
         Holds a track with search result metadata included.
@@ -76,10 +266,57 @@ class _Matcher(object):
     def _matches(self, value):
         raise NotImplementedError
 
+    def index_match(self, index):
+        """
+            Returns the set of tracks in a :class:`TagIndex` matching
+            this condition, or None if the index can't tell.
+        """
+        values = index.get_values(self.tag)
+        if values is None:
+            return None
+        internal = self.tag.startswith("__")
+        result = set()
+        for raws in self._index_candidates(values):
+            for value, tracks in raws.iteritems():
+                if not internal:
+                    try:
+                        value = self.lower(value)
+                    except:
+                        pass
+                if self._matches(value):
+                    result |= tracks
+        return result
+
+    def _index_candidates(self, values):
+        """
+            Returns the groups of indexed values that may match
+        """
+        return values.itervalues()
+
 class _ExactMatcher(_Matcher):
     """
         Condition for exact matches
     """
+    def _index_candidates(self, values):
+        content = self.content
+        if self.tag.startswith("__"):
+            try:
+                float(content)
+            except (TypeError, ValueError):
+                pass
+            else:
+                # numbers are compared with a tolerance
+                return values.itervalues()
+        else:
+            try:
+                content = content.lower()
+            except AttributeError:
+                pass
+        raws = values.get(content)
+        if raws is None:
+            return ()
+        return (raws,)
+
     def _matches(self, value):
         if self.tag.startswith("__"):
             try:
@@ -113,6 +350,9 @@ class _RegexMatcher(_Matcher):
     def __init__(self, tag, content, lower):
         _Matcher.__init__(self, tag, content, lower)
         self._re = re.compile(content)
+
+    def index_match(self, index):
+        return None
     
     def _matches(self, value):
         if not value:
@@ -161,6 +401,12 @@ class _NotMetaMatcher(object):
     def match(self, srtrack):
         return not self.matcher.match(srtrack)
 
+    def index_match(self, index):
+        found = _index_match(self.matcher, index)
+        if found is None:
+            return None
+        return index.tracks - found
+
 class _OrMetaMatcher(object):
     """
         Condition for boolean OR
@@ -173,6 +419,15 @@ class _OrMetaMatcher(object):
     def match(self, srtrack):
         return self.left.match(srtrack) or self.right.match(srtrack)
 
+    def index_match(self, index):
+        left = _index_match(self.left, index)
+        if left is None:
+            return None
+        right = _index_match(self.right, index)
+        if right is None:
+            return None
+        return left | right
+
 class _MultiMetaMatcher(object):
     """
         Condition for boolean AND
@@ -188,6 +443,15 @@ class _MultiMetaMatcher(object):
                 return False
         return True
 
+    def index_match(self, index):
+        result = set(index.tracks)
+        for ma in self.matchers:
+            found = _index_match(ma, index)
+            if found is None:
+                return None
+            result &= found
+        return result
+
 class _ManyMultiMetaMatcher(object):
     """
         TODO: think of a proper docstring for this
@@ -196,24 +460,96 @@ class _ManyMultiMetaMatcher(object):
         fashion, but also know which tags were matched. Useful for
         the collection panel expansion.
     """
-    __slots__ = ['matchers', 'tags']
+    __slots__ = ['matchers']
     tag = None
     def __init__(self, matchers):
         self.matchers = matchers
-        self.tags = set()
 
     def match(self, srtrack):
-        self.tags = set()
-        matched = False
+        return bool(self.match_tags(srtrack))
+
+    def match_tags(self, srtrack):
+        """
+            Returns the set of tags the track matched in, which is empty
+            if it didn't match
+        """
+        tags = set()
         for ma in self.matchers:
-            if ma.match(srtrack):
-                if ma.tag:
-                    matched = True
-                    self.tags.add(ma.tag)
-                elif hasattr(ma, 'tags') and ma.tags:
-                    matched = True
-                    self.tags.update(ma.tags)
-        return matched
+            if ma.match(srtrack) and ma.tag:
+                tags.add(ma.tag)
+        return tags
+
+    def index_match_tags(self, index):
+        """
+            Like index_match, but returns a list of (tag, tracks) pairs
+            with the tracks matched in each tag.
+        """
+        found = []
+        for ma in self.matchers:
+            if not ma.tag:
+                return None
+            tracks = _index_match(ma, index)
+            if tracks is None:
+                return None
+            found.append((ma.tag, tracks))
+        return found
+
+    def index_match(self, index):
+        found = self.index_match_tags(index)
+        if found is None:
+            return None
+        result = set()
+        for tag, tracks in found:
+            result |= tracks
+        return result
+
+def _match_tags(matcher, srtrack):
+    """
+        Matches a track against one condition of a :class:`TracksMatcher`.
+        Returns the tags the track matched in, or None if it didn't match.
+    """
+    if isinstance(matcher, _ManyMultiMetaMatcher):
+        return matcher.match_tags(srtrack) or None
+    if not matcher.match(srtrack):
+        return None
+    if matcher.tag is not None:
+        return (matcher.tag,)
+    return ()
+
+def _matcher_cost(matcher):
+    """
+        Estimates how expensive a condition is to check and how many
+        tracks it lets through, lower values being cheaper and more
+        selective.
+    """
+    if isinstance(matcher, _ExactMatcher):
+        if matcher.tag.startswith('__'):
+            return 0
+        return 1
+    if isinstance(matcher, (_GtMatcher, _LtMatcher)):
+        return 2
+    if isinstance(matcher, _InMatcher):
+        return 3
+    if isinstance(matcher, _RegexMatcher):
+        return 100
+    if isinstance(matcher, _NotMetaMatcher):
+        # negations let most tracks through
+        return _matcher_cost(matcher.matcher) + 1
+    if isinstance(matcher, _OrMetaMatcher):
+        return _matcher_cost(matcher.left) + _matcher_cost(matcher.right)
+    if isinstance(matcher, _MultiMetaMatcher):
+        return sum(_matcher_cost(ma) for ma in matcher.matchers)
+    if isinstance(matcher, _ManyMultiMetaMatcher):
+        # keywords are looked for in every keyword tag
+        return sum(_matcher_cost(ma) for ma in matcher.matchers) + 1
+    return 1
+
+def _order_matchers(matchers):
+    """
+        Orders the conditions of an AND so that tracks fail on the
+        cheapest, most selective one first
+    """
+    return sorted(matchers, key=_matcher_cost)
 
 class TracksMatcher(object):
     """
@@ -231,10 +567,21 @@ class TracksMatcher(object):
         """
         self.case_sensitive = case_sensitive
         self.keyword_tags = keyword_tags or []
-        tokens = self.__tokenize_query(search_string)
-        tokens = self.__red(tokens)
-        tokens = self.__optimize_tokens(tokens)
-        self.matchers = self.__tokens_to_matchers(tokens)
+
+        # Matchers don't keep any state, so the ones compiled for a
+        # query can be shared by every TracksMatcher built from it.
+        key = (search_string, case_sensitive, tuple(self.keyword_tags))
+        with _query_cache_lock:
+            matchers = _query_cache.get(key)
+        if matchers is None:
+            tokens = self.__tokenize_query(search_string)
+            tokens = self.__red(tokens)
+            tokens = self.__optimize_tokens(tokens)
+            matchers = tuple(_order_matchers(
+                self.__tokens_to_matchers(tokens)))
+            with _query_cache_lock:
+                _query_cache[key] = matchers
+        self.matchers = list(matchers)
         
     def append_matcher(self, matcher, or_match=False):
         '''Here so you can use playlist matchers. Probably needs better impl'''
@@ -256,18 +603,69 @@ class TracksMatcher(object):
             Track object matches this search condition.
         """
         for ma in self.matchers:
-            if not ma.match(srtrack):
-                break
-            if ma.tag is not None:
-                if ma.tag not in srtrack.on_tags:
-                    srtrack.on_tags.append(ma.tag)
-            elif hasattr(ma, 'tags'):
-                for t in ma.tags:
-                    if t not in srtrack.on_tags:
-                        srtrack.on_tags.append(t)
-        else:
-            return True
-        return False
+            tags = _match_tags(ma, srtrack)
+            if tags is None:
+                return False
+            for t in tags:
+                if t not in srtrack.on_tags:
+                    srtrack.on_tags.append(t)
+        return True
+
+    def index_plan(self, index):
+        """
+            Evaluates the conditions that a :class:`TagIndex` can answer.
+            The index lock must be held.
+
+            :returns: a tuple of the set of tracks matching all answered
+                conditions (None if no condition could be answered), and
+                a plan to pass to :meth:`match_planned` for each of those
+                tracks.
+        """
+        candidates = None
+        plan = []
+        for ma in self.matchers:
+            if isinstance(ma, _ManyMultiMetaMatcher):
+                tag_sets = ma.index_match_tags(index)
+                found = None
+                if tag_sets is not None:
+                    found = set()
+                    for tag, tracks in tag_sets:
+                        found |= tracks
+            else:
+                found = _index_match(ma, index)
+                if ma.tag is not None:
+                    tag_sets = [(ma.tag, None)]
+                else:
+                    tag_sets = []
+
+            if found is None:
+                plan.append((ma, None))
+                continue
+            plan.append((ma, tag_sets))
+            if candidates is None:
+                candidates = found
+            else:
+                candidates &= found
+        return candidates, plan
+
+    def match_planned(self, srtrack, plan):
+        """
+            Same as :meth:`match` for a track out of the candidates of
+            :meth:`index_plan`, only checking conditions the index could
+            not answer.
+        """
+        for ma, tag_sets in plan:
+            if tag_sets is None:
+                tags = _match_tags(ma, srtrack)
+                if tags is None:
+                    return False
+            else:
+                tags = [tag for tag, tracks in tag_sets
+                        if tracks is None or srtrack.track in tracks]
+            for t in tags:
+                if t not in srtrack.on_tags:
+                    srtrack.on_tags.append(t)
+        return True
 
     def __tokens_to_matchers(self, tokens, matchers=None):
         """
@@ -300,7 +698,7 @@ class TracksMatcher(object):
             # ()
             elif subtoken == "(":
                 inner = self.__tokens_to_matchers([token[1]])
-                matchers.append(_MultiMetaMatcher(inner))
+                matchers.append(_MultiMetaMatcher(_order_matchers(inner)))
             else:
                 return matchers
 
@@ -483,6 +881,8 @@ class TracksInList(object):
     def match(self, track):
         return track.track in self._tracks
 
+    def index_match(self, index):
+        return self._tracks & index.tracks
     
 class TracksNotInList(TracksInList):
     '''
@@ -491,14 +891,32 @@ class TracksNotInList(TracksInList):
     def match(self, track):
         return track.track not in self._tracks
 
+    def index_match(self, index):
+        return index.tracks - self._tracks
 
-def search_tracks(trackiter, trackmatchers):
+
+def search_tracks(trackiter, trackmatchers, index=None):
     """
         Search a set of tracks for those that match specified conditions.
 
         :param trackiter: An iterable object returning Track objects
         :param trackmatchers: A list of TrackMatcher objects
+        :param index: A :class:`TagIndex` containing every track of
+            trackiter, used to avoid testing each track. Defaults to the
+            index of trackiter if it is a :class:`xl.trax.TrackDB`.
     """
+    ordered = True
+    if index is None:
+        get_tag_index = getattr(trackiter, 'get_tag_index', None)
+        if get_tag_index is not None:
+            index = get_tag_index()
+            ordered = False
+
+    if index is not None:
+        for srtr in _search_index(trackiter, trackmatchers, index, ordered):
+            yield srtr
+        return
+
     for srtr in trackiter:
         if not isinstance(srtr, SearchResultTrack):
             srtr = SearchResultTrack(srtr)
@@ -516,8 +934,49 @@ def search_tracks(trackiter, trackmatchers):
         # noticable effect on search speed.
         time.sleep(0)
 
+def _search_index(trackiter, trackmatchers, index, ordered):
+    """
+        search_tracks using a TagIndex. Tracks are yielded in the order
+        of trackiter if ordered is True, in no particular order otherwise.
+    """
+    with index.lock:
+        candidates = None
+        plans = []
+        for tma in trackmatchers:
+            index_plan = getattr(tma, 'index_plan', None)
+            if index_plan is None:
+                plans.append((tma, None))
+                continue
+            found, plan = index_plan(index)
+            plans.append((tma, plan))
+            if found is None:
+                continue
+            if candidates is None:
+                candidates = found
+            else:
+                candidates &= found
+        if candidates is None:
+            candidates = set(index.tracks)
+
+    if not ordered:
+        trackiter = candidates
+
+    for srtr in trackiter:
+        if not isinstance(srtr, SearchResultTrack):
+            srtr = SearchResultTrack(srtr)
+        if ordered and srtr.track not in candidates:
+            continue
+        for tma, plan in plans:
+            if plan is None:
+                if not tma.match(srtr):
+                    break
+            elif not tma.match_planned(srtr, plan):
+                break
+        else:
+            yield srtr
+
 def search_tracks_from_string(trackiter, search_string,
-        case_sensitive=True, keyword_tags=None):
+        case_sensitive=True, keyword_tags=None, index=None):
     """
         Convenience wrapper around search_tracks that builds matchers
         automatically from the search string.
@@ -527,7 +986,7 @@ def search_tracks_from_string(trackiter, search_string,
     """
     matchers = [TracksMatcher(search_string, case_sensitive=case_sensitive,
         keyword_tags=keyword_tags)]
-    return search_tracks(trackiter, matchers)
+    return search_tracks(trackiter, matchers, index=index)
 
 
 def match_track_from_string(track, search_string,
@@ -0,0 +1,206 @@
+# Copyright (C) 2008-2010 Adam Olsen
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Storage engines used by :class:`xl.trax.TrackDB` to persist tracks.
+
+    A storage engine keeps two kinds of records: named attributes of the
+    database itself (its name, serialized libraries, version, ...) and one
+    record per track, identified by the integer key the TrackDB assigned
+    to it. Each track record is a ``(tags, key, attrs)`` tuple.
+"""
+
+from __future__ import absolute_import
+
+import cPickle as pickle
+import logging
+import os
+import shelve
+import sqlite3
+
+from xl import common
+
+logger = logging.getLogger(__name__)
+
+_SQLITE_MAGIC = 'SQLite format 3\x00'
+
+
+def is_sqlite_file(location):
+    """
+        Returns True if the file at location is a SQLite database.
+        Nonexistent and empty files are not.
+    """
+    try:
+        with open(location, 'rb') as f:
+            return f.read(len(_SQLITE_MAGIC)) == _SQLITE_MAGIC
+    except IOError:
+        return False
+
+
+class TrackDBStorage(object):
+    """
+        Base class for TrackDB storage engines.
+
+        Storage objects are opened for a single load or save operation
+        and closed afterwards; they are not shared between threads.
+    """
+    def __init__(self, location):
+        self.location = location
+
+    def get_attr(self, name, default=None):
+        """
+            Returns the stored value of a database attribute
+        """
+        raise NotImplementedError
+
+    def iter_tracks(self):
+        """
+            Yields every stored ``(tags, key, attrs)`` track record
+        """
+        raise NotImplementedError
+
+    def write(self, attrs, tracks, deleted_keys):
+        """
+            Writes changes to the store as a single unit
+
+            :param attrs: dict of database attributes to store
+            :param tracks: iterable of ``(tags, key, attrs)`` records
+                to add or replace
+            :param deleted_keys: keys of track records to remove
+        """
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class ShelveStorage(TrackDBStorage):
+    """
+        The pre-3.0 storage engine, a shelve file with one ``tracks-N``
+        key per track. Kept around to migrate old databases.
+    """
+    def __init__(self, location):
+        TrackDBStorage.__init__(self, location)
+        self.shelf = open_shelf(location)
+
+    def get_attr(self, name, default=None):
+        return self.shelf.get(name, default)
+
+    def iter_tracks(self):
+        for k in (x for x in self.shelf.keys() if x.startswith("tracks-")):
+            yield self.shelf[k]
+
+    def write(self, attrs, tracks, deleted_keys):
+        for name, value in attrs.iteritems():
+            self.shelf[name] = value
+        for record in tracks:
+            self.shelf["tracks-%s" % record[1]] = record
+        for key in deleted_keys:
+            key = "tracks-%s" % key
+            if key in self.shelf:
+                del self.shelf[key]
+        self.shelf.sync()
+
+    def close(self):
+        self.shelf.close()
+
+
+class SqliteStorage(TrackDBStorage):
+    """
+        Stores each track in its own row of a SQLite database, so that
+        saving only touches the tracks that changed. The database runs
+        in WAL mode so that writes don't block concurrent readers.
+    """
+    def __init__(self, location):
+        TrackDBStorage.__init__(self, location)
+        self.conn = sqlite3.connect(location)
+        self.conn.text_factory = str
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS attrs "
+                    "(name TEXT PRIMARY KEY, value BLOB NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tracks "
+                    "(key INTEGER PRIMARY KEY, value BLOB NOT NULL)")
+
+    @staticmethod
+    def _dumps(value):
+        return sqlite3.Binary(pickle.dumps(value, common.PICKLE_PROTOCOL))
+
+    @staticmethod
+    def _loads(value):
+        return pickle.loads(str(value))
+
+    def get_attr(self, name, default=None):
+        row = self.conn.execute("SELECT value FROM attrs WHERE name=?",
+                (name,)).fetchone()
+        if row is None:
+            return default
+        return self._loads(row[0])
+
+    def iter_tracks(self):
+        for (value,) in self.conn.execute("SELECT value FROM tracks"):
+            yield self._loads(value)
+
+    def write(self, attrs, tracks, deleted_keys):
+        dumps = self._dumps
+        with self.conn:
+            self.conn.executemany(
+                    "INSERT OR REPLACE INTO attrs (name, value) VALUES (?, ?)",
+                    ((name, dumps(value)) for name, value in attrs.iteritems()))
+            self.conn.executemany(
+                    "INSERT OR REPLACE INTO tracks (key, value) VALUES (?, ?)",
+                    ((record[1], dumps(record)) for record in tracks))
+            self.conn.executemany("DELETE FROM tracks WHERE key=?",
+                    ((key,) for key in deleted_keys))
+
+    def close(self):
+        self.conn.close()
+
+
+def open_shelf(location):
+    """
+        Opens a shelve file, falling back to the external bsddb3 module
+        where python was built without bsddb
+    """
+    try:
+        return shelve.open(location, flag='c',
+                protocol=common.PICKLE_PROTOCOL)
+    except ImportError:
+        import bsddb3 # ArchLinux disabled bsddb in python2, so we have to use the external module
+        _db = bsddb3.hashopen(location, 'c')
+        return shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
+
+
+def replace_file(src, dst):
+    """
+        Moves src over dst, which os.rename refuses to do on Windows
+    """
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+# vim: et sts=4 sw=4
@@ -25,10 +25,12 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
+from contextlib import contextmanager
 from copy import deepcopy
 from gi.repository import Gio
 from gi.repository import GLib
 import logging
+import threading
 import time
 import unicodedata
 import weakref
@@ -124,18 +126,72 @@ class _MetadataCacher(object):
 
 _CACHER = _MetadataCacher()
 
+class _TagChangeBatch(threading.local):
+    """
+        Tag changes held back by batch_tag_changes on the current thread
+    """
+    depth = 0
+    changes = None
+
+_BATCH = _TagChangeBatch()
+
+@contextmanager
+def batch_tag_changes():
+    """
+        Context manager for changing the tags of many tracks at once.
+
+        While it is active, changing a tag on the current thread does not
+        send a ``track_tags_changed`` event. Leaving the outermost batch
+        sends a single ``tracks_tags_changed`` event from the
+        :class:`Track` class instead, whose data is the set of
+        ``(track, tag)`` pairs that were changed.
+
+        Example::
+
+            with batch_tag_changes():
+                for track in tracks:
+                    track.set_tag_raw('genre', u'Jazz')
+    """
+    if _BATCH.depth == 0:
+        _BATCH.changes = set()
+    _BATCH.depth += 1
+    try:
+        yield
+    finally:
+        _BATCH.depth -= 1
+        if _BATCH.depth == 0:
+            changes = _BATCH.changes
+            _BATCH.changes = None
+            if changes:
+                event.log_event('tracks_tags_changed', Track, changes)
+
+def _notify_tag_changed(track, tag):
+    """
+        Sends the ``track_tags_changed`` event, or adds the change to the
+        current batch
+    """
+    if _BATCH.depth:
+        _BATCH.changes.add((track, tag))
+    else:
+        event.log_event('track_tags_changed', track, tag)
+
+# value of Track._scan_valid for tracks whose tags are read on first use
+_SCAN_DEFERRED = object()
+
 class Track(object):
     """
         Represents a single track.
     """
     # save a little memory this way
     __slots__ = ["__tags", "_scan_valid",
-            "_dirty", "__weakref__", "_init"]
+            "_dirty", "__weakref__", "_init", "_sort_cache"]
     # this is used to enforce the one-track-per-uri rule
     __tracksdict = weakref.WeakValueDictionary()
     # store a copy of the settings values here - much faster (0.25 cpu
     # seconds) (see _the_cuts_cb)
     __the_cuts = settings.get_option('collection/strip_list', [])
+    # bumped whenever cached sort values of all tracks become invalid
+    __sort_generation = 0
 
     def __new__(cls, *args, **kwargs):
         """
@@ -216,11 +272,15 @@ class Track(object):
         """
         # don't re-init if its a reused track. see __new__
         if self._init == False:
+            if scan and self._scan_valid is _SCAN_DEFERRED:
+                self.__read_deferred_tags()
             return
 
         self.__tags = {}
         self._scan_valid = None # whether our last tag read attempt worked
         self._dirty = False
+        # (generation, {tag: sort value}), see get_tag_sort
+        self._sort_cache = None
 
         if _unpickles:
             self._unpickles(_unpickles)
@@ -232,6 +292,43 @@ class Track(object):
         else:
             raise ValueError("Cannot create a Track from nothing")
 
+    @classmethod
+    def from_uris(cls, uris, defer_scan=True):
+        """
+            Returns a Track for each of the given uris, in order.
+
+            Uris in the form returned by :meth:`get_loc_for_io` are
+            looked up in the registry of existing tracks directly,
+            which skips normalizing them. Tracks for unknown uris are
+            created without scanning; if defer_scan is True, the tags
+            of local files are read the first time any tag but
+            ``__loc`` is requested.
+
+            :param uris: the locations of the tracks
+            :param defer_scan: whether to defer reading tags
+            :rtype: list of :class:`Track`
+        """
+        tracksdict = cls.__tracksdict
+        tracks = []
+        for uri in uris:
+            track = tracksdict.get(uri)
+            if track is None:
+                track = cls(uri, scan=not defer_scan)
+                if defer_scan and track._scan_valid is None \
+                        and track.is_local():
+                    track._scan_valid = _SCAN_DEFERRED
+            tracks.append(track)
+        return tracks
+
+    def __read_deferred_tags(self):
+        """
+            Reads the tags whose reading was deferred by :meth:`from_uris`
+        """
+        self._scan_valid = None
+        # only callers about to use the tags get here, so nothing has
+        # seen the missing values and there is no change to announce
+        self.read_tags(notify_changed=False)
+
     def __register(self):
         """
             Register this instance into the global registry of Track
@@ -258,8 +355,9 @@ class Track(object):
         self.__unregister()
         gloc = Gio.File.new_for_commandline_arg(loc)
         self.__tags['__loc'] = gloc.get_uri()
+        self._sort_cache = None
         self.__register()
-        event.log_event('track_tags_changed', self, '__loc')
+        _notify_tag_changed(self, '__loc')
 
     def exists(self):
         """
@@ -350,12 +448,15 @@ class Track(object):
             logger.exception( "Unknown exception: Could not write tags to file: %s" % e )
             return False
 
-    def read_tags(self):
+    def read_tags(self, notify_changed=True):
         """
             Reads tags from the file for this Track.
 
             Returns False if unsuccessful, and a Format object from
             `xl.metadata` otherwise.
+
+            :param notify_changed: whether to send events for the tags
+                that changed, see :meth:`set_tag_raw`
         """
         loc = self.get_loc_for_io()
         try:
@@ -363,38 +464,55 @@ class Track(object):
             if f is None:
                 self._scan_valid = False
                 return False # not a supported type
-            ntags = f.read_all()
-            for k, v in ntags.iteritems():
-                self.set_tag_raw(k, v)
-
-            # remove tags that have been deleted in the file, while
-            # taking into account that the db may have tags not
-            # supported by the file's tag format.
-            if f.others:
-                supported_tags = [ t for t in self.list_tags() \
-                        if not t.startswith("__") ]
-            else:
-                supported_tags = f.tag_mapping.keys()
-            for tag in supported_tags:
-                if tag not in ntags.keys():
-                    self.set_tag_raw(tag, None)
-
-            # fill out file specific items
-            gloc = Gio.File.new_for_uri(loc)
-            mtime = gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None).get_modification_time()
-            mtime = mtime.tv_sec + (mtime.tv_usec/100000.0)
-            self.set_tag_raw('__modified', mtime)
-            # TODO: this probably breaks on non-local files
-            path = gloc.get_parent().get_path()
-            self.set_tag_raw('__basedir', path)
-            self._dirty = True
-            self._scan_valid = True
+            self._set_read_tags(f, f.read_all(), notify_changed=notify_changed)
             return f
         except Exception:
             self._scan_valid = False
             logger.exception("Error reading tags for %s", loc)
             return False
 
+    def _set_read_tags(self, f, ntags, mtime=None, notify_changed=True):
+        """
+            Updates the Track with the tags read from its file, which
+            allows reading them on another thread.
+
+            internal use only please
+
+            :param f: the Format object the tags were read with
+            :param ntags: the result of `f.read_all()`
+            :param mtime: the modification time of the file, queried
+                from the file if not given
+            :param notify_changed: whether to send events for the tags
+                that changed
+        """
+        loc = self.get_loc_for_io()
+        for k, v in ntags.iteritems():
+            self.set_tag_raw(k, v, notify_changed=notify_changed)
+
+        # remove tags that have been deleted in the file, while
+        # taking into account that the db may have tags not
+        # supported by the file's tag format.
+        if f.others:
+            supported_tags = [ t for t in self.list_tags() \
+                    if not t.startswith("__") ]
+        else:
+            supported_tags = f.tag_mapping.keys()
+        for tag in supported_tags:
+            if tag not in ntags:
+                self.set_tag_raw(tag, None, notify_changed=notify_changed)
+
+        # fill out file specific items
+        gloc = Gio.File.new_for_uri(loc)
+        if mtime is None:
+            mtime = common.get_mtime(gloc.query_info("time::modified",
+                Gio.FileQueryInfoFlags.NONE, None))
+        self.set_tag_raw('__modified', mtime, notify_changed=notify_changed)
+        # TODO: this probably breaks on non-local files
+        path = gloc.get_parent().get_path()
+        self.set_tag_raw('__basedir', path, notify_changed=notify_changed)
+        self._dirty = True
+        self._scan_valid = True
+
     def is_local(self):
         """
             Determines whether a file is accessible on the local filesystem.
@@ -435,6 +553,8 @@ class Track(object):
 
             internal use only please
         """
+        if self._scan_valid is _SCAN_DEFERRED:
+            self.__read_deferred_tags()
         return deepcopy(self.__tags)
 
     def _unpickles(self, pickle_obj):
@@ -444,11 +564,14 @@ class Track(object):
             internal use only please
         """
         self.__tags = deepcopy(pickle_obj)
+        self._sort_cache = None
 
     def list_tags(self):
         """
             Returns a list of the names of all tags present in this Track.
         """
+        if self._scan_valid is _SCAN_DEFERRED:
+            self.__read_deferred_tags()
         return self.__tags.keys() + ['__basename']
 
     def set_tag_raw(self, tag, values, notify_changed=True):
@@ -495,8 +618,9 @@ class Track(object):
             self.__tags[tag] = values
 
         self._dirty = True
+        self._sort_cache = None
         if notify_changed:
-            event.log_event("track_tags_changed", self, tag)
+            _notify_tag_changed(self, tag)
 
     def get_tag_raw(self, tag, join=False):
         """
@@ -507,6 +631,9 @@ class Track(object):
             :param join: If True, joins lists of values into a
                 single value.
         """
+        if self._scan_valid is _SCAN_DEFERRED and tag != '__loc':
+            self.__read_deferred_tags()
+
         if tag == '__basename':
             value = self.get_basename()
         elif tag == '__startoffset': # necessary?
@@ -524,6 +651,9 @@ class Track(object):
         """
             Get a tag value in a form suitable for sorting.
 
+            Joined values are computed once and cached until a tag of
+            this track or the ``collection/strip_list`` option changes.
+
             :param tag: The name of the tag to get
             :param join: If True, joins lists of values into a
                 single value.
@@ -533,6 +663,41 @@ class Track(object):
             :param extend_title: If the title tag is unknown, try to
                 add some identifying information to it.
         """
+        if not join:
+            return self.__get_tag_sort(tag, join, artist_compilations)
+        return self.get_sort_keys((tag,), artist_compilations)[0]
+
+    def get_sort_keys(self, tags, artist_compilations=False):
+        """
+            Get the joined sort values of several tags at once, as
+            returned by :meth:`get_tag_sort`. This is the fast path used
+            by :func:`xl.trax.sort_tracks`.
+
+            :param tags: The names of the tags to get
+            :param artist_compilations: see :meth:`get_tag_sort`
+            :rtype: list
+        """
+        cache = self._sort_cache
+        if cache is None or cache[0] != Track.__sort_generation:
+            cache = self._sort_cache = (Track.__sort_generation, {})
+        values = cache[1]
+        keys = []
+        for tag in tags:
+            key = (tag, True) if artist_compilations else tag
+            try:
+                keys.append(values[key])
+            except KeyError:
+                value = values[key] = self.__get_tag_sort(tag, True,
+                        artist_compilations)
+                keys.append(value)
+        return keys
+
+    def __get_tag_sort(self, tag, join, artist_compilations):
+        """
+            Computes the value returned by :meth:`get_tag_sort`
+        """
+        if self._scan_valid is _SCAN_DEFERRED:
+            self.__read_deferred_tags()
         # The two magic values here are to ensure that compilations
         # and unknown values are always sorted below all normal
         # values.
@@ -601,6 +766,9 @@ class Track(object):
             uri = Gio.File.new_for_uri(self.__tags['__loc']).get_parse_name()
             return uri.decode('utf-8')
 
+        if self._scan_valid is _SCAN_DEFERRED:
+            self.__read_deferred_tags()
+
         value = None
         if tag == "albumartist":
             if artist_compilations and self.__tags.get('__compilation'):
@@ -658,6 +826,9 @@ class Track(object):
             :param extend_title: If the title tag is unknown, try to
                 add some identifying information to it.
         """
+        if self._scan_valid is _SCAN_DEFERRED:
+            self.__read_deferred_tags()
+
         extraformat = ""
         if tag == "albumartist":
             if artist_compilations and self.__tags.get('__compilation'):
@@ -923,6 +1094,7 @@ class Track(object):
         """
         if data == "collection/strip_list":
             cls._Track__the_cuts = settings.get_option('collection/strip_list', [])
+            cls._Track__sort_generation += 1
 
     ### Utility method intended for TrackDB ###
     
@@ -27,18 +27,15 @@
 from __future__ import absolute_import
 
 import logging
-import shelve
-
-from copy import deepcopy
-
-from gi.repository import GLib
+import os
 
 from xl import common, event
 from xl.nls import gettext as _
 
+from xl.trax import storage
 from xl.trax.track import Track
 from xl.trax.util import sort_tracks
-from xl.trax.search import search_tracks_from_string
+from xl.trax.search import TagIndex, search_tracks_from_string
 
 logger = logging.getLogger(__name__)
 
@@ -80,7 +77,12 @@ class TrackDB(object):
                 of :class:`Track` objects.
         :param load_first: Set to True if this collection should be
                 loaded before any tracks are created. 
+
+        The on-disk format is provided by :attr:`storage_class`, see
+        :mod:`xl.trax.storage`.
     """
+    storage_class = storage.SqliteStorage
+
     def __init__(self, name="", location="", pickle_attrs=[], loadfirst=False):
         """
             Sets up the trackDB.
@@ -100,9 +102,11 @@ class TrackDB(object):
         self.pickle_attrs += ['tracks', 'name', '_key']
         self._saving = False
         self._key = 0
-        self._dbversion = 2.0
+        self._dbversion = 3.0
         self._dbminorversion = 0
-        self._deleted_keys = []
+        self._deleted_keys = set()
+        self._unsaved_keys = set()
+        self._tag_index = None
         if location:
             self.load_from_location()
             self._timeout_save()
@@ -163,8 +167,10 @@ class TrackDB(object):
     @common.synchronized
     def load_from_location(self, location=None):
         """
-            Restores :class:`TrackDB` state from the pickled representation
-            stored at the specified location.
+            Restores :class:`TrackDB` state from the storage at the
+            specified location.
+
+            Databases in the old shelve format are migrated first.
 
             :param location: the location to load the data from
             :type location: string
@@ -176,28 +182,17 @@ class TrackDB(object):
                     _("You did not specify a location to load the db from"))
 
         logger.debug("Loading %s DB from %s." % (self.name, location))
-                    
-        try:
-            try:
-                pdata = shelve.open(location, flag='c',
-                        protocol=common.PICKLE_PROTOCOL)
-            except ImportError:
-                import bsddb3 # ArchLinux disabled bsddb in python2, so we have to use the external module
-                _db = bsddb3.hashopen(location, 'c')
-                pdata = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
-            if "_dbversion" in pdata:
-                if int(pdata['_dbversion']) > int(self._dbversion):
-                    raise common.VersionError, \
-                            "DB was created on a newer Exaile version."
-                elif pdata['_dbversion'] < self._dbversion:
-                    logger.info("Upgrading DB format....")
-                    import shutil
-                    shutil.copyfile(location,
-                            location + "-%s.bak"%pdata['_dbversion'])
-                    import xl.migrations.database as dbmig
-                    dbmig.handle_migration(self, pdata, pdata['_dbversion'],
-                            self._dbversion)
 
+        try:
+            if os.path.exists(location) and os.path.getsize(location) and \
+                    not storage.is_sqlite_file(location):
+                self._migrate_shelve(location)
+            pdata = self.storage_class(location)
+            version = pdata.get_attr('_dbversion', self._dbversion)
+            if int(version) > int(self._dbversion):
+                pdata.close()
+                raise common.VersionError, \
+                        "DB was created on a newer Exaile version."
         except common.VersionError:
             raise
         except Exception:
@@ -208,9 +203,7 @@ class TrackDB(object):
             try:
                 if 'tracks' == attr:
                     data = {}
-                    for k in (x for x in pdata.keys() \
-                            if x.startswith("tracks-")):
-                        p = pdata[k]
+                    for p in pdata.iter_tracks():
                         tr = Track(_unpickles=p[0])
                         loc = tr.get_loc_for_io()
                         if loc not in data:
@@ -219,35 +212,58 @@ class TrackDB(object):
                             logger.warning("Duplicate track found: %s" % loc )
                             # presumably the second track was written because of an error, 
                             # so use the first track found. 
-                            del pdata[k]
+                            self._deleted_keys.add(p[1])
                             
                     setattr(self, attr, data)
+                    if self._tag_index is not None:
+                        self._tag_index.reset(self)
                 else:
-                    setattr(self, attr, pdata.get(attr, getattr(self, attr)))
+                    setattr(self, attr, pdata.get_attr(attr,
+                            getattr(self, attr)))
             except Exception:
                 # FIXME: Do something about this
                 logger.exception("Exception occurred while loading %s" % location)
 
         pdata.close()
 
-        self._dirty = False
+        self._dirty = bool(self._deleted_keys)
+
+    def _migrate_shelve(self, location):
+        """
+            Converts a shelve database at location into the current
+            storage format, keeping a backup of the original.
+        """
+        pdata = storage.ShelveStorage(location)
+        try:
+            version = pdata.get_attr('_dbversion', 2.0)
+            if int(version) > int(self._dbversion):
+                raise common.VersionError, \
+                        "DB was created on a newer Exaile version."
+            logger.info("Upgrading DB format....")
+            import shutil
+            shutil.copyfile(location, location + "-%s.bak" % version)
+            import xl.migrations.database as dbmig
+            dbmig.handle_migration(self, pdata, version, self._dbversion)
+        finally:
+            pdata.close()
+        # the shelf can only be replaced once it is closed on Windows
+        storage.replace_file(location + ".migrate", location)
 
     @common.synchronized
     def save_to_location(self, location=None):
         """
-            Saves a pickled representation of this :class:`TrackDB` to the
-            specified location.
+            Saves this :class:`TrackDB` to the specified location.
+
+            Only tracks that were added or changed since the last save
+            are written.
 
             :param location: the location to save the data to
             :type location: string
         """
-        if not self._dirty:
-            for track in self.tracks.itervalues():
-                if track._track._dirty:
-                    self._dirty = True
-                    break
+        changed = [track for track in self.tracks.itervalues()
+                if track._track._dirty or track._key in self._unsaved_keys]
 
-        if not self._dirty:
+        if not self._dirty and not changed:
             return
 
         if not location:
@@ -260,52 +276,48 @@ class TrackDB(object):
             return
         self._saving = True
 
-        logger.debug("Saving %s DB to %s." % (self.name, location))
+        logger.debug("Saving %s DB to %s (%d changed tracks)." % (self.name,
+            location, len(changed)))
 
         try:
             try:
-                pdata = shelve.open(location, flag='c',
-                        protocol=common.PICKLE_PROTOCOL)
-            except ImportError:
-                import bsddb3
-                _db = bsddb3.hashopen(location, 'c')
-                pdata = shelve.Shelf(_db, protocol=common.PICKLE_PROTOCOL)
-            if pdata.get('_dbversion', self._dbversion) > self._dbversion:
-                raise common.VersionError, \
-                    "DB was created on a newer Exaile."
-        except Exception:
-            logger.exception("Failed to open music DB for writing.")
-            return
+                pdata = self.storage_class(location)
+                if pdata.get_attr('_dbversion', self._dbversion) > \
+                        self._dbversion:
+                    pdata.close()
+                    raise common.VersionError, \
+                        "DB was created on a newer Exaile."
+            except Exception:
+                logger.exception("Failed to open music DB for writing.")
+                return
 
-        for attr in self.pickle_attrs:
-            # bad hack to allow saving of lists/dicts of Tracks
-            if 'tracks' == attr:
-                for k, track in self.tracks.iteritems():
-                    key = "tracks-%s" % track._key
-                    if track._track._dirty or key not in pdata:
-                        pdata[key] = (
-                            track._track._pickles(),
-                            track._key,
-                            deepcopy(track._attrs)
-                        )
-            else:
-                pdata[attr] = deepcopy(getattr(self, attr))
-
-        pdata['_dbversion'] = self._dbversion
-
-        for key in self._deleted_keys:
-            key = "tracks-%s" % key
-            if key in pdata:
-                del pdata[key]
-
-        pdata.sync()
-        pdata.close()
+            attrs = {}
+            for attr in self.pickle_attrs:
+                if 'tracks' != attr:
+                    attrs[attr] = getattr(self, attr)
+            attrs['_dbversion'] = self._dbversion
 
-        for track in self.tracks.itervalues():
-            track._track._dirty = False
+            for track in changed:
+                track._track._dirty = False
 
-        self._dirty = False
-        self._saving = False
+            records = ((track._track._pickles(), track._key, track._attrs)
+                    for track in changed)
+
+            try:
+                pdata.write(attrs, records, self._deleted_keys)
+            except Exception:
+                logger.exception("Failed to save music DB.")
+                for track in changed:
+                    track._track._dirty = True
+                return
+            finally:
+                pdata.close()
+
+            self._unsaved_keys.clear()
+            self._deleted_keys.clear()
+            self._dirty = False
+        finally:
+            self._saving = False
 
     def get_track_by_loc(self, loc, raw=False):
         """
@@ -361,8 +373,12 @@ class TrackDB(object):
             location = tr.get_loc_for_io()
             locations += [location]
             self.tracks[location] = TrackHolder(tr, self._key)
+            self._unsaved_keys.add(self._key)
             self._key += 1
 
+        if self._tag_index is not None:
+            self._tag_index.add(tracks)
+
         event.log_event('tracks_added', self, locations)
 
         self._dirty = True
@@ -385,9 +401,14 @@ class TrackDB(object):
         for tr in tracks:
             location = tr.get_loc_for_io()
             locations += [location]
-            self._deleted_keys.append(self.tracks[location]._key)
+            key = self.tracks[location]._key
+            self._unsaved_keys.discard(key)
+            self._deleted_keys.add(key)
             del self.tracks[location]
 
+        if self._tag_index is not None:
+            self._tag_index.remove(tracks)
+
         event.log_event('tracks_removed', self, locations)
 
         self._dirty = True
@@ -395,6 +416,57 @@ class TrackDB(object):
     def get_tracks(self):
         return list(self)
 
+    @common.synchronized
+    def get_locations(self):
+        """
+            Returns the locations of all tracks in the database. Unlike
+            iterating over the database, this is safe while other
+            threads add or remove tracks.
+        """
+        return self.tracks.keys()
+
+    @common.synchronized
+    def get_tag_index(self):
+        """
+            Returns the :class:`xl.trax.search.TagIndex` of the tracks in
+            this database, which searches use to avoid looking at every
+            track. The index is built on first use and kept up to date
+            from then on.
+        """
+        if self._tag_index is None:
+            self._tag_index = TagIndex(self)
+            event.add_callback(self._on_track_tags_changed,
+                    'track_tags_changed')
+            event.add_callback(self._on_tracks_tags_changed,
+                    'tracks_tags_changed')
+        return self._tag_index
+
+    def get_tracks_by_tag(self, tag, value):
+        """
+            Returns the list of tracks having value for tag, ignoring case.
+            Uses the tag index, so that only the first lookup of a tag
+            has to look at every track.
+        """
+        tracks = self.get_tag_index().lookup(tag, value)
+        if tracks is None:
+            value = value.replace('"', '\\"')
+            return [x.track for x in search_tracks_from_string(self,
+                    '%s=="%s"' % (tag, value), case_sensitive=False)]
+        return list(tracks)
+
+    def _on_track_tags_changed(self, type, track, tag):
+        """
+            Keeps the tag index up to date
+        """
+        self._tag_index.update(track, tag)
+
+    def _on_tracks_tags_changed(self, type, obj, changes):
+        """
+            Keeps the tag index up to date after a batch of changes
+        """
+        for track, tag in changes:
+            self._tag_index.update(track, tag)
+
 
     def search(self, query, sort_fields=[], return_lim=-1,
             tracks=None, reverse=False):
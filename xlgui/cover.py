@@ -199,8 +199,8 @@ class CoverManager(GObject.GObject):
 
         outstanding = []
         # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
-        pixbuf_from_data = icons.MANAGER.pixbuf_from_data
+        get_cover_thumbnail = COVER_MANAGER.get_cover_thumbnail
+        get_thumbnail_pixbuf = self.get_thumbnail_pixbuf
         default_cover_pixbuf = self.default_cover_pixbuf
         cover_size = self.cover_size
 
@@ -210,13 +210,11 @@ class CoverManager(GObject.GObject):
             if self.stopper.is_set():
                 return
 
-            cover_data = get_cover(self.album_tracks[album][0], set_only=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+            cover_data = get_cover_thumbnail(self.album_tracks[album][0],
+                cover_size, set_only=True)
+            thumbnail_pixbuf = get_thumbnail_pixbuf(cover_data)
 
-            try:
-                thumbnail_pixbuf = cover_pixbuf.scale_simple(*cover_size,
-                    interp_type=GdkPixbuf.InterpType.BILINEAR)
-            except AttributeError: # cover_pixbuf is None
+            if thumbnail_pixbuf is None:
                 thumbnail_pixbuf = default_cover_pixbuf
                 outstanding.append(album)
 
@@ -229,6 +227,29 @@ class CoverManager(GObject.GObject):
         self.outstanding = outstanding
         self.emit('prefetch-completed', len(self.outstanding))
 
+    def get_thumbnail_pixbuf(self, cover_data):
+        """
+            Returns the pixbuf of a cover thumbnail centered on a
+            transparent background of the cover size, so that all
+            covers line up in the view. Thumbnails keep the ratio of
+            their cover.
+        """
+        pixbuf = icons.MANAGER.pixbuf_from_data(cover_data)
+        if pixbuf is None:
+            return None
+
+        width, height = pixbuf.get_width(), pixbuf.get_height()
+        if (width, height) == self.cover_size:
+            return pixbuf
+
+        padded = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, True, 8,
+            *self.cover_size)
+        padded.fill(0)
+        pixbuf.copy_area(0, 0, width, height, padded,
+            (self.cover_size[0] - width) // 2,
+            (self.cover_size[1] - height) // 2)
+        return padded
+
     def fetch(self):
         """
             Collects covers for all outstanding items
@@ -236,17 +257,19 @@ class CoverManager(GObject.GObject):
         self.emit('fetch-started', len(self.outstanding))
 
         # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
+        get_cover_thumbnail = COVER_MANAGER.get_cover_thumbnail
         save = COVER_MANAGER.save
-        pixbuf_from_data = icons.MANAGER.pixbuf_from_data
+        get_thumbnail_pixbuf = self.get_thumbnail_pixbuf
+        cover_size = self.cover_size
 
         for i, album in enumerate(self.outstanding[:]):
             if self.stopper.is_set():
                 # Allow for "fetch-completed" signal to be emitted
                 break
 
-            cover_data = get_cover(self.album_tracks[album][0], save_cover=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+            cover_data = get_cover_thumbnail(self.album_tracks[album][0],
+                cover_size, save_cover=True)
+            cover_pixbuf = get_thumbnail_pixbuf(cover_data)
 
             self.emit('fetch-progress', i + 1)
 
@@ -390,8 +413,7 @@ class CoverManager(GObject.GObject):
             Updates the widgets to reflect the newly fetched cover
         """
         path = self.model_path_cache[album]
-        self.model[path][1] = pixbuf.scale_simple(*self.cover_size,
-            interp_type=GdkPixbuf.InterpType.BILINEAR)
+        self.model[path][1] = pixbuf
 
     def on_cover_chosen(self, cover_chooser, track, cover_data):
         """
@@ -401,7 +423,9 @@ class CoverManager(GObject.GObject):
 
         if path:
             album = self.model[path][0]
-            pixbuf = icons.MANAGER.pixbuf_from_data(cover_data)
+            pixbuf = self.get_thumbnail_pixbuf(
+                COVER_MANAGER.get_cover_thumbnail(track, self.cover_size,
+                    set_only=True))
 
             self.emit('cover-fetched', album, pixbuf)
 
@@ -541,6 +565,9 @@ class CoverWidget(Gtk.EventBox):
     __gsignals__ = {
         'cover-found': (GObject.SignalFlags.RUN_LAST, None, (object,)),
     }
+    #: Tags that the cover of a track is looked up by
+    cover_tags = ('album', 'albumartist', '__compilation')
+
     def __init__(self, image):
         """
             Initializes the widget
@@ -562,6 +589,10 @@ class CoverWidget(Gtk.EventBox):
         
         event.add_callback(self.on_quit_application,
                 'quit_application')
+        event.add_ui_callback(self.on_track_tags_changed,
+                'track_tags_changed')
+        event.add_ui_callback(self.on_tracks_tags_changed,
+                'tracks_tags_changed')
 
         if settings.get_option('gui/use_alpha', False):
             self.set_app_paintable(True)
@@ -576,6 +607,10 @@ class CoverWidget(Gtk.EventBox):
         
         event.remove_callback(self.on_quit_application,
                 'quit-application')
+        event.remove_callback(self.on_track_tags_changed,
+                'track_tags_changed')
+        event.remove_callback(self.on_tracks_tags_changed,
+                'tracks_tags_changed')
         
     def set_track(self, track):
         """
@@ -775,7 +810,7 @@ class CoverWidget(Gtk.EventBox):
         """
             Updates the displayed cover upon tag changes
         """
-        if self.__track == track:
+        if self.__track == track and tag in self.cover_tags:
             cover_data = COVER_MANAGER.get_cover(track)
 
             if not cover_data:
@@ -783,6 +818,15 @@ class CoverWidget(Gtk.EventBox):
 
             GLib.idle_add(self.on_cover_chosen, None, cover_data)
 
+    def on_tracks_tags_changed(self, e, obj, changes):
+        """
+            Updates the displayed cover upon batched tag changes
+        """
+        for track, tag in changes:
+            if self.__track == track and tag in self.cover_tags:
+                self.on_track_tags_changed(e, track, tag)
+                return
+
     def on_quit_application(self, type, exaile, nothing):
         """
             Cleans up temporary files
@@ -330,6 +330,8 @@ class MainWindow(GObject.GObject):
         event.add_ui_callback(self.on_toggle_pause, 'playback_toggle_pause',
             player.PLAYER)
         event.add_ui_callback(self.on_track_tags_changed, 'track_tags_changed')
+        event.add_ui_callback(self.on_tracks_tags_changed,
+            'tracks_tags_changed')
         event.add_ui_callback(self.on_buffering, 'playback_buffering',
             player.PLAYER)
         event.add_ui_callback(self.on_playback_error, 'playback_error',
@@ -610,6 +612,15 @@ class MainWindow(GObject.GObject):
         if track is player.PLAYER.current:
             self._update_track_information()
 
+    def on_tracks_tags_changed(self, type, obj, changes):
+        """
+            Called when the tags of many tracks are changed at once
+        """
+        current = player.PLAYER.current
+        if current is not None and \
+                any(track is current for track, tag in changes):
+            self._update_track_information()
+
     def on_collection_tree_loaded(self, tree):
         """
             Updates information on collection tree load
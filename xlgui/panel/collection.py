@@ -152,6 +152,202 @@ DEFAULT_ORDERS = [
             (("discnumber", "tracknumber", "title"), "$title", ("title",)))),
         ]
 
+def _group_value(track, tag):
+    """
+        Returns a hashable stand-in for track.get_tag_search(tag) that is
+        much cheaper to compute. Tracks with equal group values always
+        have equal search values.
+    """
+    if tag == 'albumartist':
+        tag = 'artist' # get_tag_search looks at artist for this one
+    elif tag == '__basename':
+        tag = '__loc'
+    value = track.get_tag_raw(tag)
+    if isinstance(value, list):
+        return tuple(value)
+    if value is None and tag == 'title':
+        return (None, track.get_loc_for_io())
+    return value
+
+class AggregateNode(object):
+    """
+        A node of a :class:`CollectionAggregate`: the tracks sharing the
+        same search values for the tags of one level of an Order
+    """
+    __slots__ = ('parent', 'level', 'query', 'tracks', 'children',
+        'expand', '_display', '_ordered')
+    def __init__(self, parent, level, query):
+        self.parent = parent
+        self.level = level
+        self.query = query
+        self.tracks = set()
+        self.children = {} # query -> AggregateNode
+        self.expand = False
+        self._display = None
+        self._ordered = None
+
+class CollectionAggregate(object):
+    """
+        Groups tracks into the levels of an Order in a single pass, so
+        that the collection panel can fill in any node of its tree
+        without searching the collection again.
+
+        Every node knows all of the tracks below it. The levels above
+        the last one are made of :class:`AggregateNode` objects, the
+        tracks themselves make up the last level. Children are only
+        sorted when they are first asked for.
+    """
+    def __init__(self, order, srtracks=()):
+        """
+            :param order: the :class:`Order` to group by
+            :param srtracks: the :class:`xl.trax.SearchResultTrack`
+                objects to start with
+        """
+        self.order = order
+        self.root = AggregateNode(None, -1, None)
+        self._depth = len(order) - 1
+        self._tags = [order.get_sort_tags(i) for i in xrange(len(order))]
+        self._expand_tags = [set(itertools.chain(*self._tags[i+1:]))
+            for i in xrange(len(order))]
+        self._queries = {} # (level, group values) -> query
+        self._leaves = {} # track -> (loc, deepest AggregateNode)
+        self._locs = {} # loc -> track
+
+        self.add_tracks(srtracks)
+
+    def __contains__(self, track):
+        return track in self._leaves
+
+    def __len__(self):
+        return len(self._leaves)
+
+    def add(self, srtrack):
+        """
+            Adds a track, or moves it to where its current tags belong
+
+            :param srtrack: the :class:`xl.trax.SearchResultTrack`
+        """
+        self.add_tracks([srtrack])
+
+    def add_tracks(self, srtracks):
+        """
+            Like add(), but takes an iterable of
+            :class:`xl.trax.SearchResultTrack`
+        """
+        root = self.root
+        leaves = self._leaves
+        locs = self._locs
+        queries = self._queries
+        levels = [(level, self._tags[level], self._expand_tags[level])
+            for level in xrange(self._depth)]
+
+        for srtr in srtracks:
+            track = srtr.track
+            if track in leaves:
+                self.remove(track)
+
+            node = root
+            node.tracks.add(track)
+            for level, tags, expand_tags in levels:
+                if len(tags) == 1:
+                    key = (level, _group_value(track, tags[0]))
+                else:
+                    key = (level,) + tuple([_group_value(track, t)
+                        for t in tags])
+                query = queries.get(key)
+                if query is None:
+                    query = " ".join([track.get_tag_search(t, format=True)
+                        for t in tags])
+                    queries[key] = query
+                child = node.children.get(query)
+                if child is None:
+                    child = node.children[query] = \
+                        AggregateNode(node, level, query)
+                    node._ordered = None
+                node = child
+                node.tracks.add(track)
+                if srtr.on_tags and not node.expand and \
+                        expand_tags.intersection(srtr.on_tags):
+                    node.expand = True
+            node._ordered = None
+
+            loc = track.get_loc_for_io()
+            leaves[track] = (loc, node)
+            locs[loc] = track
+
+    def remove(self, track):
+        """
+            Removes a track, pruning nodes that become empty
+
+            :param track: the :class:`xl.trax.Track`
+        """
+        try:
+            loc, node = self._leaves.pop(track)
+        except KeyError:
+            return
+        if self._locs.get(loc) is track:
+            del self._locs[loc]
+
+        while node is not None:
+            node.tracks.discard(track)
+            node._ordered = None
+            parent = node.parent
+            if not node.tracks and parent is not None:
+                del parent.children[node.query]
+            node = parent
+
+    def get_parent(self, track):
+        """
+            Returns the node of the level above the last one that holds
+            the track, or None
+        """
+        try:
+            return self._leaves[track][1]
+        except KeyError:
+            return None
+
+    def get_track_by_loc(self, loc):
+        """
+            Returns the track added with the given location, or None
+        """
+        return self._locs.get(loc)
+
+    def get_children(self, node=None):
+        """
+            Returns the sorted children of a node: a list of
+            :class:`AggregateNode` objects, or of tracks if node is on
+            the level above the last one.
+
+            :param node: the node, or None for the top level
+        """
+        if node is None:
+            node = self.root
+        if node._ordered is None:
+            level = node.level + 1
+            tags = self._tags[level]
+            if level == self._depth:
+                node._ordered = trax.sort_tracks(tags, node.tracks)
+            else:
+                node._ordered = sorted(node.children.itervalues(),
+                    key=lambda n: (self.get_sort_key(n), n.query))
+        return node._ordered
+
+    def get_sort_key(self, node):
+        """
+            Returns the sort values of the tags of the node's level
+        """
+        track = next(iter(node.tracks))
+        return track.get_sort_keys(self._tags[node.level])
+
+    def get_display(self, node):
+        """
+            Returns the text the node should be shown with
+        """
+        if node._display is None:
+            node._display = self.order.format_track(node.level,
+                next(iter(node.tracks)))
+        return node._display
+
 class CollectionPanel(panel.Panel):
     """
         The collection panel
@@ -193,8 +389,10 @@ class CollectionPanel(panel.Panel):
         self._setup_images()
         self._connect_events()
         self.order = None
-        self.tracks = []
-        self.sorted_tracks = []
+        self.aggregate = None
+        self._matcher = None
+        self._keyword_tags = []
+        self._reexpand = set()
 
         event.add_ui_callback(self._check_collection_empty, 'libraries_modified',
             collection)
@@ -258,6 +456,8 @@ class CollectionPanel(panel.Panel):
         })
         self.tree.connect('key-release-event', self.on_key_released)
         event.add_ui_callback(self.refresh_tags_in_tree, 'track_tags_changed')
+        event.add_ui_callback(self.refresh_tags_in_tree_batch,
+            'tracks_tags_changed')
         event.add_ui_callback(self.refresh_tracks_in_tree, 
             'tracks_added', self.collection)
         event.add_ui_callback(self.refresh_tracks_in_tree, 
@@ -407,11 +607,12 @@ class CollectionPanel(panel.Panel):
         """
             finds tracks matching a given iter.
         """
-        self.load_subtree(iter)
-        search = self.get_node_search_terms(iter)
-        matcher = trax.TracksMatcher(search)
-        srtrs = trax.search_tracks(self.tracks, [matcher])
-        return [ x.track for x in srtrs ]
+        value = self.model.get_value(iter, 2)
+        if value is None:
+            return []
+        if isinstance(value, AggregateNode):
+            return list(value.tracks)
+        return [value]
 
     def append_to_playlist(self, item=None, event=None, replace=False):
         """
@@ -473,21 +674,79 @@ class CollectionPanel(panel.Panel):
             return ""
 
         queries = []
-        while node:
-            queries.append(self.model.get_value(node, 2))
-            node = self.model.iter_parent(node)
+        value = self.model.get_value(node, 2)
+        if not isinstance(value, AggregateNode):
+            if value is None:
+                return ""
+            level = len(self.order) - 1
+            queries = [value.get_tag_search(t, format=True)
+                for t in self.order.get_sort_tags(level) + ['__loc']]
+            value = self.aggregate.get_parent(value)
+        while value is not None and value.query is not None:
+            queries.append(value.query)
+            value = value.parent
 
         return " ".join(queries)
 
     def refresh_tags_in_tree(self, type, track, tag):
-        if settings.get_option('gui/sync_on_tag_change', True) and \
-            tag in self.order.all_sort_tags() and \
-            self.collection.loc_is_member(track.get_loc_for_io()):
-            self._refresh_tags_in_tree()
+        self._update_aggregate([(track, tag)])
+
+    def refresh_tags_in_tree_batch(self, type, obj, changes):
+        self._update_aggregate(changes)
+
+    def _update_aggregate(self, changes):
+        """
+            Moves the tracks whose tags changed to where they now belong
+            in the aggregate
+
+            :param changes: iterable of (track, tag) pairs
+        """
+        if not settings.get_option('gui/sync_on_tag_change', True) or \
+                self.aggregate is None:
+            return
+        tags = set(self.order.all_sort_tags())
+        tags.add('__loc')
+        if self.keyword.strip():
+            tags.update(self._keyword_tags)
+
+        tracks = set()
+        for track, tag in changes:
+            if tag in tags and track not in tracks and \
+                    (track in self.aggregate or self.collection.loc_is_member(
+                        track.get_loc_for_io())):
+                tracks.add(track)
+        if not tracks:
+            return
 
-    def refresh_tracks_in_tree(self, type, obj, loc):
+        for track in tracks:
+            self.aggregate.remove(track)
+        self._add_matching(tracks)
+        self._refresh_tags_in_tree()
+
+    def refresh_tracks_in_tree(self, type, obj, locs):
+        if self.aggregate is None:
+            return
+        if type == 'tracks_removed':
+            for loc in locs:
+                track = self.aggregate.get_track_by_loc(loc)
+                if track is not None:
+                    self.aggregate.remove(track)
+        else:
+            tracks = [self.collection.get_track_by_loc(loc) for loc in locs]
+            self._add_matching([tr for tr in tracks if tr is not None])
         self._refresh_tags_in_tree()
 
+    def _add_matching(self, tracks):
+        """
+            Adds the tracks matching the current search to the aggregate
+        """
+        matching = []
+        for track in tracks:
+            srtr = trax.SearchResultTrack(track)
+            if self._matcher.match(srtr):
+                matching.append(srtr)
+        self.aggregate.add_tracks(matching)
+
     @common.glib_wait(500)
     def _refresh_tags_in_tree(self):
         """
@@ -498,17 +757,9 @@ class CollectionPanel(panel.Panel):
         # so we delay it until we're done scanning.
         if self.collection._scanning:
             return True
-        self.resort_tracks()
-        self.load_tree()
+        self.load_model()
         return False
 
-    def resort_tracks(self):
-#        import time
-#        print "sorting...", time.clock()
-        self.sorted_tracks = trax.sort_tracks(self.order.get_sort_tags(0),
-            self.collection.get_tracks())
-#        print "sorted.", time.clock()
-
     def load_tree(self):
         """
             Loads the Gtk.TreeView for this collection panel.
@@ -518,16 +769,8 @@ class CollectionPanel(panel.Panel):
         """
         logger.debug("Reloading collection tree")
         self.current_start_count = self.start_count
-        self.tree.set_model(None)
-        self.model.clear()
-
-        self.root = None
-        oldorder = self.order
         self.order = self.orders[self.choice.get_active()]
 
-        if not oldorder or oldorder != self.order:
-            self.resort_tracks()
-
         # save the active view setting
         settings.set_option(
                 'gui/collection_active_view',
@@ -536,11 +779,31 @@ class CollectionPanel(panel.Panel):
         keyword = self.keyword.strip()
         tags = list(SEARCH_TAGS)
         tags += self.order.all_search_tags()
-        tags = list(set(tags)) # uniquify list to speed up search
+        self._keyword_tags = list(set(tags)) # uniquify list to speed up search
+        self._matcher = trax.TracksMatcher(keyword, case_sensitive=False,
+                keyword_tags=self._keyword_tags)
+
+        self.aggregate = CollectionAggregate(self.order,
+                trax.search_tracks(self.collection, [self._matcher]))
+
+        self.load_model(keep_expanded=False)
+
+    def load_model(self, keep_expanded=True):
+        """
+            Fills the tree from the current aggregate, without searching
+            the collection again
 
-        self.tracks = list(
-                trax.search_tracks_from_string(self.sorted_tracks,
-                    keyword, case_sensitive=False, keyword_tags=tags) )
+            :param keep_expanded: whether the rows that are currently
+                expanded should be expanded again
+        """
+        self._reexpand = set()
+        if keep_expanded:
+            self.tree.map_expanded_rows(lambda tree, path, data:
+                self._reexpand.add(self.model[path][2]), None)
+
+        self.tree.set_model(None)
+        self.model.clear()
+        self.root = None
 
         self.load_subtree(None)
 
@@ -563,8 +826,6 @@ class CollectionPanel(panel.Panel):
         while iter:
             if search_num != self._search_num: return
             value = self.model.get_value(iter, 1)
-            if not value:
-                value = self.model.get_value(iter, 2)
             if value: value = unicode(value, 'utf-8')
 
             if value == name:
@@ -585,131 +846,71 @@ class CollectionPanel(panel.Panel):
 
             @param node: the node
         """
-        previously_loaded = False # was the subtree already loaded
         iter_sep = None
-        if parent == None:
+        if parent is None:
+            node = None
             depth = 0
         else:
             if self.model.iter_n_children(parent) != 1 or \
                 self.model.get_value(
                     self.model.iter_children(parent), 1) != None:
-                previously_loaded = True
+                return # already loaded
             iter_sep = self.model.iter_children(parent)
-            depth = self.model.iter_depth(parent) + 1
-        if previously_loaded:
-            return
-
-        search = self.get_node_search_terms(parent)
+            node = self.model.get_value(parent, 2)
+            if not isinstance(node, AggregateNode):
+                return # at the bottom of the tree
+            depth = node.level + 1
 
-        try:
-            tags = self.order.get_sort_tags(depth)
-            matchers = [trax.TracksMatcher(search)]
-            srtrs = trax.search_tracks(self.tracks, matchers)
-            # sort only if we are not on top level, because tracks are 
-            # already sorted by fist order
-            if depth > 0:
-                srtrs = trax.sort_result_tracks(tags, srtrs)
-        except IndexError:
-            return # at the bottom of the tree
+        tags = self.order.get_sort_tags(depth)
         try:
             image = getattr(self, "%s_image"%tags[-1])
         except:
             image = None
-        bottom = False
-        if depth == len(self.order)-1:
-            bottom = True
-
+        bottom = depth == len(self.order)-1
 
         display_counts = settings.get_option('gui/display_track_counts', True)
-        draw_seps = settings.get_option('gui/draw_separators', True)
-        last_char = ''
-        last_val = ''
-        last_dval = ''
-        last_matchq = ''
-        count = 0
-        first = True
-        path = None
-        expanded = False
-        to_expand = []
-
-        for srtr in srtrs:
-            stagvals = [unicode(srtr.track.get_tag_sort(x)) for x in tags]
-            stagval = " ".join(stagvals)
-            if (last_val != stagval or bottom):
-                tagval = self.order.format_track(depth, srtr.track)
-                match_query = " ".join([
-                    srtr.track.get_tag_search(t, format=True) for t in tags])
-                if bottom:
-                    match_query += " " + \
-                            srtr.track.get_tag_search("__loc", format=True)
-
-                # Different *sort tags can cause stagval to not match
-                # but the below code will produce identical entries in
-                # the displayed tree.  This condition checks to ensure
-                # that new entries are added if and only if they will
-                # display different results, avoiding that problem.
-                if match_query != last_matchq or tagval != last_dval or bottom:
-                    if display_counts and path and not bottom:
-                        iter = self.model.get_iter(path)
-                        val = self.model.get_value(iter, 1)
-                        val = "%s (%s)"%(val, count)
-                        self.model.set_value(iter, 1, val)
-                        count = 0
-
-                    last_val = stagval
-                    last_dval = tagval
-                    if depth == 0 and draw_seps:
-                        val = srtr.track.get_tag_sort(tags[0])
-                        char = first_meaningful_char(val)
-                        if first:
-                            last_char = char
-                        else:
-                            if char != last_char and last_char != '':
-                                self.model.append(parent, [None, None, None])
-                            last_char = char
-                    first = False
-
-                    last_matchq = match_query
-                    iter = self.model.append(parent, 
-                        [image, tagval, match_query])
-                    path = self.model.get_path(iter)
-                    expanded = False
-                    if not bottom:
-                        self.model.append(iter, [None, None, None])
-            count += 1
-            if not expanded:
-                alltags = []
-                for i in range(depth+1, len(self.order)):
-                    alltags.extend(self.order.get_sort_tags(i))
-                for t in alltags:
-                    if t in srtr.on_tags:
-                        # keep original path intact for following block
-                        newpath = path
-                        if depth > 0:
-                            # for some reason, nested iters are always
-                            # off by one in the terminal entry.
-                            newpath = Gtk.TreePath.new_from_indices(newpath[:-1] + [newpath[-1]-1])
-                        to_expand.append(newpath)
-                        expanded = True
-
-        if display_counts and path and not bottom:
-            iter = self.model.get_iter(path)
-            val = self.model.get_value(iter, 1)
-            val = "%s (%s)"%(val, count)
-            self.model.set_value(iter, 1, val)
-            count = 0
-
-        if settings.get_option("gui/expand_enabled", True) and \
-            len(to_expand) < \
-                    settings.get_option("gui/expand_maximum_results", 100) and \
+        draw_seps = depth == 0 and \
+                settings.get_option('gui/draw_separators', True)
+        expand = settings.get_option("gui/expand_enabled", True) and \
             len(self.keyword.strip()) >= \
-                    settings.get_option("gui/expand_minimum_term_length", 2):
-            for row in to_expand:
-                GLib.idle_add(self.tree.expand_row, row, False)
+                settings.get_option("gui/expand_minimum_term_length", 2)
+        last_char = None
+        to_expand = []
+        reexpand = []
+
+        for child in self.aggregate.get_children(node):
+            if bottom:
+                self.model.append(parent,
+                    [image, self.order.format_track(depth, child), child])
+                continue
+
+            if draw_seps:
+                char = first_meaningful_char(
+                    self.aggregate.get_sort_key(child)[0])
+                if last_char is not None and char != last_char:
+                    self.model.append(parent, [None, None, None])
+                last_char = char
+
+            tagval = self.aggregate.get_display(child)
+            if display_counts:
+                tagval = "%s (%s)"%(tagval, len(child.tracks))
+            iter = self.model.append(parent, [image, tagval, child])
+            self.model.append(iter, [None, None, None])
+            if child in self._reexpand:
+                reexpand.append(iter)
+            elif expand and child.expand:
+                to_expand.append(iter)
 
         if iter_sep is not None:
             self.model.remove(iter_sep)
 
+        if len(to_expand) >= \
+                settings.get_option("gui/expand_maximum_results", 100):
+            to_expand = []
+        for iter in reexpand + to_expand:
+            GLib.idle_add(self.tree.expand_row,
+                self.model.get_path(iter), False)
+
 class CollectionDragTreeView(DragTreeView):
     """
         Custom DragTreeView to retrieve data
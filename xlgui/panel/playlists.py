@@ -636,7 +636,11 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
 
     def _connect_events(self):
         event.add_ui_callback(self.refresh_playlists, 'track_tags_changed')
+        event.add_ui_callback(self.refresh_playlists_batch,
+            'tracks_tags_changed')
         event.add_ui_callback(self._on_playlist_added, 'playlist_added', self.playlist_manager)
+        event.add_ui_callback(self._on_smart_manager_loaded,
+            'playlist_manager_loaded', self.smart_manager)
 
         self.tree.connect('key-release-event', self.on_key_released)
 
@@ -654,6 +658,14 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
             tag in ['title', 'artist']:
             self._refresh_playlists()
 
+    def refresh_playlists_batch(self, type, obj, changes):
+        """
+            Like refresh_playlists, for a batch of tag changes
+        """
+        if settings.get_option('gui/sync_on_tag_change', True) and \
+            any(tag in ['title', 'artist'] for track, tag in changes):
+            self._refresh_playlists()
+
     @common.glib_wait(500)
     def _refresh_playlists(self):
         """
@@ -689,11 +701,7 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
         self.custom = self.model.append(None, [self.folder,
             _("Custom Playlists"), None])
 
-        names = self.smart_manager.playlists[:]
-        names.sort()
-        for name in names:
-            self.model.append(self.smart, [self.playlist_image, name,
-                self.smart_manager.get_playlist(name)])
+        self._load_smart_playlists()
 
         names = self.playlist_manager.playlists[:]
         names.sort()
@@ -706,6 +714,27 @@ class PlaylistsPanel(panel.Panel, BasePlaylistPanelMixin):
         self.tree.expand_row(self.model.get_path(self.smart), False)
         self.tree.expand_row(self.model.get_path(self.custom), False)
 
+    def _load_smart_playlists(self):
+        """
+            Adds the smart playlists, if the manager has read them
+        """
+        names = self.smart_manager.playlists[:]
+        names.sort()
+        for name in names:
+            self.model.append(self.smart, [self.playlist_image, name,
+                self.smart_manager.get_playlist(name)])
+
+    def _on_smart_manager_loaded(self, type, manager, data):
+        """
+            Shows the smart playlists once they are read
+        """
+        child = self.model.iter_children(self.smart)
+        while child is not None:
+            if not self.model.remove(child):
+                break
+        self._load_smart_playlists()
+        self.tree.expand_row(self.model.get_path(self.smart), False)
+
     def update_playlist_node(self, pl):
         """
             Updates the playlist node of the playlist
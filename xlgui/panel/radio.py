@@ -103,7 +103,19 @@ class RadioPanel(panel.Panel, playlistpanel.BasePlaylistPanelMixin):
         """
             Loads radio streams from plugins
         """
+        self._load_stations()
+
+        for name, value in self.manager.stations.iteritems():
+            self.add_driver(value)
+
+    def _load_stations(self):
+        """
+            Adds the saved stations, if the manager has read them
+        """
+        shown = set(pl.name for pl in self.playlist_nodes)
         for name in self.playlist_manager.playlists:
+            if name in shown:
+                continue
             pl = self.playlist_manager.get_playlist(name)
             if pl is not None:
                 self.playlist_nodes[pl] = self.model.append(self.custom,
@@ -112,8 +124,11 @@ class RadioPanel(panel.Panel, playlistpanel.BasePlaylistPanelMixin):
                 self._load_playlist_nodes(pl)
         self.tree.expand_row(self.model.get_path(self.custom), False)
 
-        for name, value in self.manager.stations.iteritems():
-            self.add_driver(value)
+    def _on_station_manager_loaded(self, type, manager, data):
+        """
+            Shows the saved stations once they are read
+        """
+        self._load_stations()
 
     def _add_driver_cb(self, type, object, driver):
         self.add_driver(driver)
@@ -173,6 +188,8 @@ class RadioPanel(panel.Panel, playlistpanel.BasePlaylistPanelMixin):
                 self.manager)
         event.add_ui_callback(self._remove_driver_cb, 'station_removed',
                 self.manager)
+        event.add_ui_callback(self._on_station_manager_loaded,
+                'playlist_manager_loaded', self.playlist_manager)
 
     def _on_add_button_clicked(self, *e):
         dialog = dialogs.MultiTextEntryDialog(self.parent,
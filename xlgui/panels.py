@@ -63,6 +63,47 @@ class PanelData(object):
             (self.tab, self.panel, self.position, self.shown)
 
 
+class PlaceholderPanel(object):
+    '''
+        Empty panel shown in place of the panel of a plugin that is only
+        activated once its panel is selected
+    '''
+    placeholder = True
+
+    def __init__(self, placeholder):
+        self.name = placeholder.name
+        self.label = placeholder.label
+        self.plugin = placeholder.plugin
+        self._panel = None
+
+    def get_panel(self):
+        if self._panel is None:
+            self._panel = notebook.NotebookPage(Gtk.Box(), self.label)
+        return self._panel
+
+
+class PanelPlaceholders(providers.ProviderHandler):
+    '''
+        Registers a PlaceholderPanel for each 'main-panel-placeholder'
+        provider
+    '''
+
+    def __init__(self):
+        self.stubs = {}     # key: placeholder, value: PlaceholderPanel
+        providers.ProviderHandler.__init__(self, 'main-panel-placeholder',
+                                           simple_init=True)
+
+    def on_provider_added(self, placeholder):
+        stub = PlaceholderPanel(placeholder)
+        self.stubs[placeholder] = stub
+        providers.register('main-panel', stub)
+
+    def on_provider_removed(self, placeholder):
+        stub = self.stubs.pop(placeholder, None)
+        if stub is not None:
+            providers.unregister('main-panel', stub)
+
+
 class PanelNotebook(notebook.SmartNotebook, providers.ProviderHandler):
     '''
         This notebook holds the panels shown on the left side of the main
@@ -104,6 +145,7 @@ class PanelNotebook(notebook.SmartNotebook, providers.ProviderHandler):
                             .register('menubar-view-menu')
         
         providers.ProviderHandler.__init__(self, 'main-panel', simple_init=True)
+        self.placeholders = PanelPlaceholders()
         
         # Provide interface for adding buttons to the notebook
         self.actions = notebook.NotebookActionService(self, 'main-panel-actions')
@@ -142,6 +184,28 @@ class PanelNotebook(notebook.SmartNotebook, providers.ProviderHandler):
             logger.warn("Ignoring improperly initialized panel provider: %s" % provider)
             return
         
+        # the panel of a plugin replaces its placeholder
+        position, switch, shown = -1, True, True
+        data = self.panels.get(provider.name)
+        if data is not None and getattr(data.panel, 'placeholder', False):
+            shown = data.shown
+            if shown:
+                position = self.page_num(data.tab.page)
+                switch = position == self.get_current_page()
+            else:
+                position, switch = data.position, False
+            loading, self.loading_panels = self.loading_panels, True
+            self.on_provider_removed(data.panel)
+            self.loading_panels = loading
+        elif not self.loading_panels:
+            # panels of plugins enabled after startup go back to where
+            # they were in the last session
+            saved = settings.get_option('gui/panels', {}).get(provider.name)
+            if saved is not None:
+                shown, position = saved
+                switch = settings.get_option('gui/last_selected_panel') == \
+                    provider.name
+        
         panel = provider.get_panel()
         panel.show()
         
@@ -156,14 +220,21 @@ class PanelNotebook(notebook.SmartNotebook, providers.ProviderHandler):
         
         self.view_menu.add_item(item)
         
-        self.add_tab(tab, panel)
-        self.panels[provider.name] = PanelData(tab, provider, self.get_n_pages()-1, item)
+        self.add_tab(tab, panel, position, switch=switch)
+        data = PanelData(tab, provider, self.page_num(panel), item)
+        self.panels[provider.name] = data
+        
+        if not shown:
+            self.remove_tab(tab)
+            data.shown = False
         
         self.save_panel_settings()
         
     def on_provider_removed(self, provider):
         
-        data = self.panels[provider.name]
+        data = self.panels.get(provider.name)
+        if data is None or data.panel is not provider:
+            return
         
         for n in range(self.get_n_pages()):
             if data.tab.page == self.get_nth_page(n):
@@ -198,23 +269,31 @@ class PanelNotebook(notebook.SmartNotebook, providers.ProviderHandler):
 
     def on_panel_switch(self, notebook, page, pagenum):
         """
-            Saves the currently selected panel
+            Saves the currently selected panel, and activates the plugin
+            of a placeholder panel
         """
-        if self.exaile.loading:
-            return
-
         page = notebook.get_nth_page(pagenum)
         for name, data in self.panels.iteritems():
             if data.tab.page == page:
+                if not self.loading_panels:
+                    self._activate_placeholder(data.panel)
+                if self.exaile.loading:
+                    return
                 settings.set_option('gui/last_selected_panel', name)
                 return
             
+    def _activate_placeholder(self, panel):
+        if getattr(panel, 'placeholder', False):
+            GLib.idle_add(self.exaile.plugins.activate_plugin, panel.plugin)
+
     def save_panel_settings(self):
         
         if self.loading_panels:
             return
         
-        param = dict([(k, v.opts) for k, v in self.panels.iteritems()])
+        # keep the placement of panels whose plugin isn't enabled yet
+        param = dict(settings.get_option('gui/panels', {}))
+        param.update([(k, v.opts) for k, v in self.panels.iteritems()])
         settings.set_option('gui/panels', param)
     
     def on_gui_loaded(self):
@@ -256,6 +335,11 @@ class PanelNotebook(notebook.SmartNotebook, providers.ProviderHandler):
         if selected_panel is not None:
             panel_num = self.page_num(selected_panel)            
             self.set_current_page(panel_num)
+        
+        current = self.get_nth_page(self.get_current_page())
+        for data in self.panels.itervalues():
+            if data.tab.page == current:
+                self._activate_placeholder(data.panel)
 
 
 def _register_builtin_panels(exaile, window):
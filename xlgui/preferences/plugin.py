@@ -118,7 +118,8 @@ class PluginManager(object):
             else:
                 icon = Gtk.STOCK_APPLY
 
-            enabled = plugin in self.plugins.enabled_plugins
+            enabled = plugin in self.plugins.enabled_plugins or \
+                    plugin in self.plugins.inactive_plugins
             plugin_data = (plugin, info['Name'], str(info['Version']),
                            enabled, icon, broken, compatible, True)
             
@@ -201,47 +201,48 @@ class TrackPropertiesDialog(GObject.GObject):
     def _tags_write(self, data):
         errors = []
         dialog = SavingProgressWindow(self.dialog, len(data))
-        for n, trackdata in data:
-            track = self.tracks[n]
-            poplist = []
-
-            for tag in trackdata:
-                if not tag.startswith("__"):
-                    if tag in ("tracknumber", "discnumber") \
-                       and trackdata[tag] == ["0/0"]:
-                        poplist.append(tag)
-                        continue
-                    track.set_tag_raw(tag, trackdata[tag])
-                elif tag in ('__startoffset', '__stopoffset'):
-                    try:
-                        offset = int(trackdata[tag][0])
-                    except ValueError:
-                        poplist.append(tag)
+        with trax.batch_tag_changes():
+            for n, trackdata in data:
+                track = self.tracks[n]
+                poplist = []
+
+                for tag in trackdata:
+                    if not tag.startswith("__"):
+                        if tag in ("tracknumber", "discnumber") \
+                           and trackdata[tag] == ["0/0"]:
+                            poplist.append(tag)
+                            continue
+                        track.set_tag_raw(tag, trackdata[tag])
+                    elif tag in ('__startoffset', '__stopoffset'):
+                        try:
+                            offset = int(trackdata[tag][0])
+                        except ValueError:
+                            poplist.append(tag)
+                        else:
+                            track.set_tag_raw(tag, offset)
+
+                # In case a tag has been removed..
+                for tag in track.list_tags():
+                    if tag in tag_data:
+                        if tag_data[tag] is not None:
+                            try:
+                                trackdata[tag]
+                            except KeyError:
+                                poplist.append(tag)
                     else:
-                        track.set_tag_raw(tag, offset)
-
-            # In case a tag has been removed..
-            for tag in track.list_tags():
-                if tag in tag_data:
-                    if tag_data[tag] is not None:
                         try:
                             trackdata[tag]
                         except KeyError:
                             poplist.append(tag)
-                else:
-                    try:
-                        trackdata[tag]
-                    except KeyError:
-                        poplist.append(tag)
 
-            for tag in poplist:
-                track.set_tag_raw(tag, None)
+                for tag in poplist:
+                    track.set_tag_raw(tag, None)
 
-            if not track.write_tags():
-                errors.append(track.get_loc_for_io());
+                if not track.write_tags():
+                    errors.append(track.get_loc_for_io());
                 
-            trax.track._CACHER.remove(track)
-            dialog.step()
+                trax.track._CACHER.remove(track)
+                dialog.step()
         dialog.destroy()
         
         if len(errors) > 0:
@@ -296,10 +296,9 @@ class DragTreeView(AutoScrollTreeView):
             for track in tracks:
                 album = track.get_tag_raw('album', join=True)
                 if album not in albums:
-                    image_data = cover_manager.get_cover(track,
-                        set_only=True, use_default=True)
-                    pixbuf = icons.MANAGER.pixbuf_from_data(
-                        image_data, (width, height))
+                    image_data = cover_manager.get_cover_thumbnail(track,
+                        (width, height), set_only=True, use_default=True)
+                    pixbuf = icons.MANAGER.pixbuf_from_data(image_data)
 
                     if first_pixbuf is None:
                         first_pixbuf = pixbuf
@@ -123,7 +123,8 @@ class TrackInfoPane(Gtk.Alignment):
 
             p_evts = ['playback_player_end', 'playback_track_start',
                       'playback_toggle_pause', 'playback_error']
-            events = ['track_tags_changed', 'cover_set', 'cover_removed']
+            events = ['track_tags_changed', 'tracks_tags_changed',
+                      'cover_set', 'cover_removed']
 
             if auto_update:
                 for e in p_evts:
@@ -329,6 +330,15 @@ class TrackInfoPane(Gtk.Alignment):
            track is self.__track:
             self.set_track(track)
 
+    def on_tracks_tags_changed(self, event, obj, changes):
+        """
+            Updates the info pane on batched tag changes
+        """
+        for track, tag in changes:
+            if track is self.__track:
+                self.on_track_tags_changed(event, track, tag)
+                return
+
     def on_cover_set(self, event, covers, track):
         """
             Updates the info pane on cover set
@@ -25,7 +25,6 @@
 # from your version.
 
 from gi.repository import Gdk
-from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Pango
@@ -77,7 +76,7 @@ class PlaybackProgressBar(Gtk.ProgressBar):
         self.reset()
 
         self.formatter = ProgressBarFormatter(player)
-        self.__timer_id = None
+        self.__unsubscribe = None
         self.__events = ('playback_track_start', 'playback_player_end',
                          'playback_toggle_pause', 'playback_error')
 
@@ -102,17 +101,12 @@ class PlaybackProgressBar(Gtk.ProgressBar):
         """
             Enables the update timer
         """
-        if self.__timer_id is not None:
+        if self.__unsubscribe is not None:
             return
 
         interval = settings.get_option('gui/progress_update_millisecs', 1000)
-
-        if interval % 1000 == 0:
-            self.__timer_id = GLib.timeout_add_seconds(
-                interval / 1000, self.on_timer)
-        else:
-            self.__timer_id = GLib.timeout_add(
-                interval, self.on_timer)
+        self.__unsubscribe = self.__player.clock.subscribe(self.on_timer,
+                                                           interval)
 
         self.on_timer()
 
@@ -120,23 +114,21 @@ class PlaybackProgressBar(Gtk.ProgressBar):
         """
             Disables the update timer
         """
-        if self.__timer_id is not None:
-            GLib.source_remove(self.__timer_id)
-            self.__timer_id = None
+        if self.__unsubscribe is not None:
+            self.__unsubscribe()
+            self.__unsubscribe = None
 
-    def on_timer(self):
+    def on_timer(self, time=None):
         """
             Updates progress bar appearance
         """
         if self.__player.current is None:
             self.__disable_timer()
             self.reset()
-            return False
+            return
 
         self.set_fraction(self.__player.get_progress())
-        self.set_text(self.formatter.format())
-
-        return True
+        self.set_text(self.formatter.format(current_time=time))
 
     def on_playback_track_start(self, event_type, player, track):
         """
@@ -292,7 +284,7 @@ class MarkerManager(providers.ProviderHandler):
         providers.ProviderHandler.__init__(self, 'playback-markers')
 
         self.__events = ('playback_track_start', 'playback_track_end')
-        self.__timeout_id = None
+        self.__unsubscribe = None
 
         for e in self.__events:
             event.add_ui_callback(getattr(self, 'on_%s' % e), e)
@@ -356,42 +348,39 @@ class MarkerManager(providers.ProviderHandler):
         """
             Starts marker watching
         """
-        if self.__timeout_id is not None:
-            GLib.source_remove(self.__timeout_id)
+        if self.__unsubscribe is not None:
+            self.__unsubscribe()
 
-        self.__timeout_id = GLib.timeout_add_seconds(1, self.on_timeout, player)
+        self.__unsubscribe = player.clock.subscribe(
+            lambda time: self.on_timeout(player, time), 1000)
 
     def on_playback_track_end(self, event, player, track):
         """
             Stops marker watching
         """
-        if self.__timeout_id is not None:
-            GLib.source_remove(self.__timeout_id)
-            self.__timeout_id = None
+        if self.__unsubscribe is not None:
+            self.__unsubscribe()
+            self.__unsubscribe = None
 
-    def on_timeout(self, player):
+    def on_timeout(self, player, playback_time):
         """
             Triggers "reached" signal of markers
         """
         
         if player.current is None:
-            self.__timeout_id = None
             return
         
         track_length = player.current.get_tag_raw('__length')
 
         if track_length is None:
-            return True
+            return
 
-        playback_time = player.get_time()
         reached_markers = (m for m in providers.get('playback-markers')
             if int(m.props.position * track_length) == playback_time)
 
         for marker in reached_markers:
             marker.emit('reached')
 
-        return True
-
 __MARKERMANAGER = MarkerManager()
 add_marker = __MARKERMANAGER.add_marker
 remove_marker = __MARKERMANAGER.remove_marker
@@ -460,14 +449,14 @@ class _SeekInternalProgressBar(PlaybackProgressBar):
                 )
             context.stroke()
     
-    def on_timer(self):
+    def on_timer(self, time=None):
         """
             Prevents update while seeking
         """
         if self._seeking:
-            return True
+            return
 
-        return PlaybackProgressBar.on_timer(self)
+        PlaybackProgressBar.on_timer(self, time)
 
 class SeekProgressBar(Gtk.EventBox, providers.ProviderHandler):
     """
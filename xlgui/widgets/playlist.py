@@ -33,7 +33,10 @@ from gi.repository import Pango
 
 from itertools import izip
 import logging
+from operator import itemgetter
 import sys
+import threading
+import weakref
 
 from xl.nls import gettext as _
 from xl.playlist import (
@@ -436,7 +439,7 @@ class PlaylistPage(PlaylistPageBase):
         self.view.model.connect('row-changed', self.on_row_changed)
         self.view.model.connect('data-loading', self.on_data_loading)
         
-        if self.view.model.data_loading:
+        if self.view.model.data_loading_signalled:
             self.on_data_loading(None, True)
 
         self.show_all()
@@ -1289,6 +1292,11 @@ class PlaylistModel(Gtk.ListStore):
         )
     }
     
+    # Rows are inserted in chunks of this many rows, the first one being
+    # about a screenful so that it shows up as soon as possible
+    load_first_chunk = 100
+    load_chunk = 500
+    
     def __init__(self, playlist, columns, player):
         Gtk.ListStore.__init__(self, int) # real types are set later
         self.playlist = playlist
@@ -1296,10 +1304,23 @@ class PlaylistModel(Gtk.ListStore):
         self.player = player
         
         self.data_loading = False
+        # whether data-loading was emitted and no rows were inserted since
+        self.data_loading_signalled = False
+        # changes that arrived while loading, applied in order afterwards
         self.data_load_queue = []
 
-        self.coltypes = [object, GdkPixbuf.Pixbuf] + [providers.get_provider('playlist-columns', c).datatype for c in columns]
+        column_providers = [providers.get_provider('playlist-columns', c) for c in columns]
+        self.coltypes = [object, GdkPixbuf.Pixbuf] + [p.datatype for p in column_providers]
         self.set_column_types(self.coltypes)
+        self.formatters = [p.formatter.format for p in column_providers]
+        
+        # track -> formatted values of the columns, until its tags change.
+        # Filled from the loader thread too, so it's only used with the lock.
+        self._format_cache = weakref.WeakKeyDictionary()
+        self._format_lock = threading.Lock()
+        # location -> iters of the rows of that track. ListStore iters
+        # stay valid until their row is removed.
+        self._rows = {}
         
         self._redraw_timer = None
         self._redraw_queue = []
@@ -1322,6 +1343,8 @@ class PlaylistModel(Gtk.ListStore):
                 "playback_player_resume", self.player)
         event.add_ui_callback(self.on_track_tags_changed,
                 "track_tags_changed")
+        event.add_ui_callback(self.on_tracks_tags_changed,
+                "tracks_tags_changed")
 
         event.add_ui_callback(self.on_option_set, "gui_option_set")
                 
@@ -1406,9 +1429,41 @@ class PlaylistModel(Gtk.ListStore):
         self._load_data(tracks)
 
     def on_tracks_removed(self, event_type, playlist, tracks):
-        tracks.reverse()
-        for position, track in tracks:
-            self.remove(self.iter_nth_child(None, position))
+        if self.data_loading:
+            self.data_load_queue.append((self._remove_rows, tracks))
+            return
+        self._remove_rows(tracks)
+
+    def _remove_rows(self, tracks):
+        length = len(self)
+        tracks = sorted(((position + length if position < 0 else position,
+            track) for position, track in tracks), key=itemgetter(0))
+        
+        # after removing a row the iter points to the next one, so runs of
+        # rows only need to be looked up once
+        iter = None
+        last = None
+        for removed, (position, track) in enumerate(tracks):
+            if iter is None or position != last + 1:
+                iter = self.iter_nth_child(None, position - removed)
+            last = position
+            self._forget_row(track, iter)
+            if not self.remove(iter):
+                iter = None
+
+    def _forget_row(self, track, iter):
+        loc = track.get_loc_for_io()
+        iters = self._rows.get(loc)
+        if not iters:
+            return
+        if len(iters) == 1:
+            del self._rows[loc]
+            return
+        path = self.get_path(iter)
+        for i, row in enumerate(iters):
+            if self.get_path(row) == path:
+                del iters[i]
+                break
 
     def on_current_position_changed(self, event_type, playlist, positions):
         for position in positions:
@@ -1429,30 +1484,61 @@ class PlaylistModel(Gtk.ListStore):
 
     @guiutil.idle_add()   # sync this call to prevent race conditions
     def on_track_tags_changed(self, type, track, tag):
-        if not track or not \
-            settings.get_option('gui/sync_on_tag_change', True) or not\
-            tag in self.columns:
+        if not track or not tag in self.columns:
             return
-            
+        
+        with self._format_lock:
+            self._format_cache.pop(track, None)
+        if settings.get_option('gui/sync_on_tag_change', True):
+            self._queue_redraw([track])
+
+    @guiutil.idle_add()   # sync this call to prevent race conditions
+    def on_tracks_tags_changed(self, type, obj, changes):
+        tracks = set([track for track, tag in changes
+            if track and tag in self.columns])
+        
+        with self._format_lock:
+            for track in tracks:
+                self._format_cache.pop(track, None)
+        if tracks and settings.get_option('gui/sync_on_tag_change', True):
+            self._queue_redraw(tracks)
+
+    def _queue_redraw(self, tracks):
         if self._redraw_timer:
             GLib.source_remove(self._redraw_timer)
-        self._redraw_queue.append( track )
+        self._redraw_queue.extend( tracks )
         self._redraw_timer = GLib.timeout_add(100, self._on_track_tags_changed)
             
     def _on_track_tags_changed(self):
         self._redraw_timer = None
-        tracks = {}
-        redraw_queue = self._redraw_queue
+        tracks = set(self._redraw_queue)
         self._redraw_queue = []
-        for track in redraw_queue:
-            tracks[track.get_loc_for_io()] = track
-           
-        for row in self:
-            track = tracks.get( row[0].get_loc_for_io() )
-            if track is not None:
-                track_data = [providers.get_provider('playlist-columns', name).formatter.format(track) for name in self.columns]
-                for i in range(len(track_data)):
-                    row[2+i] = track_data[i]
+        if self.data_loading:
+            self.data_load_queue.append((self._redraw_rows, tracks))
+        else:
+            self._redraw_rows(tracks)
+
+    def _redraw_rows(self, tracks):
+        columns = range(2, 2 + len(self.formatters))
+        for track in tracks:
+            iters = self._rows.get(track.get_loc_for_io())
+            if not iters:
+                continue
+            track_data = self._format(track)
+            for iter in iters:
+                self.set(iter, columns, track_data)
+
+    def _format(self, track):
+        '''
+            Returns the formatted values of the columns for a track
+        '''
+        with self._format_lock:
+            track_data = self._format_cache.get(track)
+        if track_data is None:
+            track_data = [formatter(track) for formatter in self.formatters]
+            with self._format_lock:
+                self._format_cache[track] = track_data
+        return track_data
 
     #
     # Loading data into the playlist:
@@ -1464,55 +1550,74 @@ class PlaylistModel(Gtk.ListStore):
     #
     # Now, the program is annoyingly blocked when this happens, so we need to
     # process new tracks on a different thread, and show some kind of loading
-    # indicator instead. That's what these four functions help us do.
+    # indicator instead. That's what these functions help us do. Rows are
+    # handed to the main thread in chunks, so that large lists show up
+    # progressively instead of freezing the UI while they are inserted.
+    #
+    # Changes to the playlist that arrive while loading are queued, and
+    # applied in order once it's done.
     #
     
     def _load_data(self, tracks):
         
-        # Don't allow race condition between adds.. there's probably a race
-        # condition for removal
         if self.data_loading:
-            self.data_load_queue.extend(tracks)
+            self.data_load_queue.append((self._load_data, tracks))
             return
         
         # get column types
         coltypes = [self.get_column_type(i) for i in xrange(self.get_n_columns())]
-        formatters = [providers.get_provider('playlist-columns', name).formatter.format for name in self.columns]
         self.data_loading = True
+        self.data_loading_signalled = True
         self.emit('data-loading', True)
         
         if len(tracks) > 50:
-            self._load_data_thread(coltypes, formatters, tracks)
+            self._load_data_thread(coltypes, tracks)
         else:
-            render_data = self._load_data_fn(coltypes, formatters, tracks)
-            self._load_data_done(render_data)
+            render_data = self._load_data_fn(coltypes, tracks)
+            self._load_data_chunk(render_data, True)
     
     @common.threaded
-    def _load_data_thread(self, coltypes, formatters, tracks):
-        render_data = self._load_data_fn(coltypes, formatters, tracks)
-        GLib.idle_add(self._load_data_done, render_data)
+    def _load_data_thread(self, coltypes, tracks):
+        start = 0
+        size = self.load_first_chunk
+        while start < len(tracks):
+            end = start + size
+            render_data = self._load_data_fn(coltypes, tracks[start:end])
+            GLib.idle_add(self._load_data_chunk, render_data,
+                end >= len(tracks))
+            start = end
+            size = self.load_chunk
     
-    def _load_data_fn(self, coltypes, formatters, tracks):
+    def _load_data_fn(self, coltypes, tracks):
     
         Value = GObject.Value
     
         render_data = []
     
         for position, track in tracks:
-            track_data = [track, self.icon_for_row(position).pixbuf] + [formatter(track) for formatter in formatters]
-            render_data.append((position, [Value(typ, val) for typ, val in izip(coltypes, track_data)]))
+            track_data = [track, self.icon_for_row(position).pixbuf] + self._format(track)
+            render_data.append((position, track, [Value(typ, val) for typ, val in izip(coltypes, track_data)]))
         
         return render_data
         
-    def _load_data_done(self, render_data):
-        for args in render_data:
-            self.insert(*args)
+    def _load_data_chunk(self, render_data, done):
+        rows = self._rows
+        for position, track, values in render_data:
+            iter = self.insert(position, values)
+            rows.setdefault(track.get_loc_for_io(), []).append(iter)
         
+        # the first rows are shown, so the rest can load without the
+        # loading indicator hiding them
+        if self.data_loading_signalled:
+            self.data_loading_signalled = False
+            self.emit('data-loading', False)
+        
+        if done:
+            self._load_data_done()
+    
+    def _load_data_done(self):
         self.data_loading = False
-        self.emit('data-loading', False)
         
-        if self.data_load_queue:
-            tracks = self.data_load_queue
-            self.data_load_queue = None
-            
-            self._load_data(tracks)
+        while self.data_load_queue and not self.data_loading:
+            func, args = self.data_load_queue.pop(0)
+            func(args)
@@ -25,7 +25,6 @@
 # from your version.
 
 
-from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Pango
@@ -382,7 +381,7 @@ class ScheduleTimeColumn(Column):
 
     def __init__(self, *args):
         Column.__init__(self, *args)
-        self.timeout_id = None
+        self.unsubscribe = None
 
         event.add_ui_callback(self.on_queue_current_playlist_changed,
             'queue_current_playlist_changed', player.QUEUE)
@@ -435,27 +434,24 @@ class ScheduleTimeColumn(Column):
         """
             Enables realtime updates
         """
-        timeout_id = self.timeout_id
-
         # Make sure to stop any timer still running
-        if timeout_id is not None:
-            GLib.source_remove(timeout_id)
+        if self.unsubscribe is not None:
+            self.unsubscribe()
 
-        self.timeout_id = GLib.timeout_add_seconds(60, self.on_timeout)
+        self.unsubscribe = self.player.clock.subscribe(self.on_timeout, 60000)
 
     def stop_timer(self):
         """
             Disables realtime updates
         """
-        timeout_id = self.timeout_id
-
-        if timeout_id is not None:
-            GLib.source_remove(timeout_id)
+        if self.unsubscribe is not None:
+            self.unsubscribe()
+            self.unsubscribe = None
 
         # Update once more
         self.on_timeout()
 
-    def on_timeout(self):
+    def on_timeout(self, time=None):
         """
             Makes sure schedule times are updated in realtime
         """
@@ -463,9 +459,9 @@ class ScheduleTimeColumn(Column):
         view = self.get_tree_view()
         if view is not None:
             view.queue_draw()
-            return True
-
-        return False
+        elif self.unsubscribe is not None:
+            self.unsubscribe()
+            self.unsubscribe = None
 
     def on_queue_current_playlist_changed(self, e, queue, current_playlist):
         """